@@ -0,0 +1,45 @@
+import argparse
+import time
+
+from benchmarks.common import create_forest
+from src.simulation.forest import Forest
+
+
+def steps_per_second(forest: Forest, steps: int, fused: bool) -> float:
+    start = time.perf_counter()
+    if fused:
+        forest.advance(steps)
+    else:
+        for _ in range(steps):
+            forest.next_gen()
+    forest.sync_to_host()
+    return steps / (time.perf_counter() - start)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare next_gen with the fused advance path")
+    parser.add_argument('--backend', default='auto', choices=['gpu', 'cpu', 'auto'])
+    parser.add_argument('--size', type=int, default=256)
+    parser.add_argument('--steps', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=1234)
+    args = parser.parse_args()
+
+    results = {}
+    for name, resident, fused in (('next_gen', False, False),
+                                  ('next_gen resident', True, False),
+                                  ('advance', True, True)):
+        forest = create_forest(backend=args.backend, size=args.size, resident=resident, seed=args.seed)
+        # Warm-up, also compiles the fused kernel
+        if fused:
+            forest.advance(8)
+        else:
+            forest.next_gen()
+        results[name] = steps_per_second(forest, args.steps, fused)
+
+    baseline = results['next_gen']
+    for name, rate in results.items():
+        print(f"{name:>18}: {rate:10.1f} steps/s ({rate / baseline:5.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import argparse
+import math
+import os
+import time
+import zlib
+
+from benchmarks.common import create_forest
+
+
+def layout(workers: int, blocks: bool) -> int | tuple[int, int]:
+    # Horizontal strips, or the most square rows x columns of blocks
+    if not blocks:
+        return workers
+    rows = max(r for r in range(1, math.isqrt(workers) + 1) if workers % r == 0)
+    return rows, workers // rows
+
+
+def run_case(width: int, height: int, steps: int, seed: int, backend: str, workers=None) -> tuple[float, int]:
+    # Steps/s of fused stepping and a checksum of the final grid
+    forest = create_forest(backend=backend, width=width, height=height, resident=True, workers=workers, seed=seed)
+    # Warm-up, the workers import NumPy on their first command
+    forest.advance(1)
+    forest.sync_to_host()
+
+    start = time.perf_counter()
+    forest.advance(steps)
+    forest.sync_to_host()
+    elapsed = time.perf_counter() - start
+    checksum = zlib.crc32(forest.grid.tobytes())
+    forest.close()
+    return steps / elapsed, checksum
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Strong and weak scaling of the partitioned backend")
+    parser.add_argument('--size', type=int, default=2048, help='world side for strong scaling')
+    parser.add_argument('--block', type=int, default=512, help='block side per worker for weak scaling')
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count())
+    parser.add_argument('--steps', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--blocks', action='store_true', help='2D blocks instead of horizontal strips')
+    args = parser.parse_args()
+
+    counts = sorted({2 ** k for k in range(args.max_workers.bit_length()) if 2 ** k <= args.max_workers}
+                    | {args.max_workers})
+
+    # Same world for every worker count, results must not change with it
+    baseline, expected = run_case(args.size, args.size, args.steps, args.seed, 'cpu')
+    print(f"Strong scaling, {args.size}x{args.size}, single-process cpu backend {baseline:.2f} steps/s")
+    print(f"{'workers':>8} {'layout':>8} {'steps/s':>10} {'speedup':>8} {'efficiency':>10} {'same grid':>10}")
+    single = None
+    for workers in counts:
+        blocks = layout(workers, args.blocks)
+        rate, checksum = run_case(args.size, args.size, args.steps, args.seed, 'partitioned', blocks)
+        single = single or rate
+        shape = 'x'.join(map(str, blocks)) if args.blocks else str(blocks)
+        print(f"{workers:8d} {shape:>8} {rate:10.2f} {rate / single:8.2f} {rate / single / workers:10.2f} "
+              f"{'yes' if checksum == expected else 'NO':>10}")
+
+    # One block per worker, the world grows with the worker count
+    print(f"\nWeak scaling, {args.block}x{args.block} cells per worker")
+    print(f"{'workers':>8} {'grid':>13} {'steps/s':>10} {'Mcells/s':>10} {'efficiency':>10}")
+    single = None
+    for workers in counts:
+        blocks = layout(workers, args.blocks)
+        rows, columns = blocks if args.blocks else (blocks, 1)
+        width, height = args.block * columns, args.block * rows
+        rate, _ = run_case(width, height, args.steps, args.seed, 'partitioned', blocks)
+        single = single or rate
+        print(f"{workers:8d} {width:>6}x{height:<6} {rate:10.2f} {rate * width * height / 1e6:10.1f} "
+              f"{rate / single:10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+import argparse
+import os
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+from benchmarks.common import create_forest
+from src.game.grid_renderer import GridRenderer
+from src.simulation.profiler import PROFILER, span
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Per-stage timings of a headless run")
+    parser.add_argument('--backend', default='auto', choices=['gpu', 'cpu', 'auto'])
+    parser.add_argument('--size', type=int, default=256)
+    parser.add_argument('--steps', type=int, default=300)
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--resident', action='store_true')
+    parser.add_argument('--double-buffered', action='store_true')
+    parser.add_argument('--render', action='store_true', help='also render every frame off screen')
+    parser.add_argument('--trace', default='profile_trace.json', help='Chrome trace-event JSON')
+    parser.add_argument('--csv', default='profile_summary.csv', help='per-stage summary')
+    args = parser.parse_args()
+
+    forest = create_forest(backend=args.backend, size=args.size, seed=args.seed,
+                           resident=args.resident, double_buffered=args.double_buffered)
+    renderer = GridRenderer(forest.shape, 1) if args.render else None
+
+    PROFILER.enable(tracing=True)
+    for frame in range(args.steps):
+        forest.next_gen(frame)
+        if renderer is not None:
+            forest.sync_to_host()
+            with span('render_grid'):
+                renderer.render(forest.grid, forest.humidity)
+    forest.close()
+    PROFILER.disable()
+
+    PROFILER.export_trace(args.trace)
+    PROFILER.export_csv(args.csv)
+
+    print(f"{'stage':<16} {'count':>7} {'total ms':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, values in sorted(PROFILER.stats().items(), key=lambda item: -item[1]['total_ms']):
+        print(f"{name:<16} {values['count']:7d} {values['total_ms']:10.1f} {values['p50_ms']:9.3f} "
+              f"{values['p95_ms']:9.3f} {values['p99_ms']:9.3f}")
+    print(f"Wrote {args.trace} and {args.csv}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+import argparse
+import time
+
+from benchmarks.common import create_forest
+from src.simulation.types import Type
+
+RADII = [1, 2, 4, 8, 16]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Steps/s of resident stepping for growing neighbourhood radii")
+    parser.add_argument('--backend', default='auto', choices=['gpu', 'cpu', 'auto'])
+    parser.add_argument('--size', type=int, default=1024)
+    parser.add_argument('--steps', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--radii', type=int, nargs='+', default=RADII)
+    args = parser.parse_args()
+
+    print(f"{'radius':>6} {'steps/s':>10} {'Mcells/s':>10} {'burning':>9}")
+    for radius in args.radii:
+        forest = create_forest(backend=args.backend, size=args.size, radius=radius, resident=True, seed=args.seed)
+        forest.next_gen()
+        forest.sync_to_host()
+
+        start = time.perf_counter()
+        for _ in range(args.steps):
+            forest.next_gen()
+        forest.sync_to_host()
+        elapsed = time.perf_counter() - start
+        forest.close()
+
+        rate = args.steps / elapsed
+        burning = int((forest.grid == Type.BURNING).sum())
+        print(f"{radius:6d} {rate:10.2f} {rate * args.size * args.size / 1e6:10.1f} {burning:9d}")
+
+
+if __name__ == "__main__":
+    main()
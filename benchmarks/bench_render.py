@@ -0,0 +1,82 @@
+import argparse
+import os
+import time
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import numpy as np
+import pygame
+
+from src.game.grid_renderer import GridRenderer
+from src.simulation.forest import initial_grid, initial_humidity
+from src.simulation.types import Type
+
+SIZES = [256, 512, 1024, 2048]
+
+
+def legacy_color_array(grid: np.ndarray, humidity: np.ndarray) -> np.ndarray:
+    # Game.get_color_array before the palette renderer
+    grid_flat = grid.flatten()
+    humidity_flat = humidity.flatten()
+    height, width = grid.shape
+
+    colors = np.zeros((height * width, 3), dtype=np.uint8)
+    colors[grid_flat == Type.EMPTY] = [220, 220, 220]
+    green_intensity = np.clip(
+        (120 / humidity_flat[grid_flat == Type.TREE]).astype(np.uint8),
+        0, 255
+    )
+    colors[grid_flat == Type.TREE] = np.stack([
+        np.zeros_like(green_intensity),
+        green_intensity,
+        np.zeros_like(green_intensity)
+    ], axis=1)
+    colors[grid_flat == Type.BURNING] = [220, 0, 0]
+    colors[grid_flat == Type.LIGHTNING] = [100, 100, 220]
+    colors[grid_flat == Type.ASH] = [50, 50, 50]
+    colors[grid_flat == Type.WATER] = [150, 150, 250]
+    return colors.reshape((height, width, 3))
+
+
+def legacy_render(surface: pygame.Surface, grid: np.ndarray, humidity: np.ndarray, block_size: int) -> pygame.Surface:
+    pygame.surfarray.blit_array(surface, legacy_color_array(grid, humidity))
+    height, width = grid.shape
+    return pygame.transform.scale(surface, (height * block_size, width * block_size))
+
+
+def time_frames(render, frames: int) -> float:
+    render()
+    start = time.perf_counter()
+    for _ in range(frames):
+        render()
+    return (time.perf_counter() - start) / frames * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Per-frame grid render time, legacy RGB masking vs palette")
+    parser.add_argument('--frames', type=int, default=50)
+    parser.add_argument('--window', type=int, default=900, help='height of the grid area in pixels')
+    parser.add_argument('--seed', type=int, default=1234)
+    args = parser.parse_args()
+
+    pygame.display.init()
+    pygame.display.set_mode((1, 1))
+
+    print(f"{'grid':>6} {'block':>6} {'legacy ms':>10} {'palette ms':>11} {'speedup':>8}")
+    for size in SIZES:
+        rng = np.random.default_rng(args.seed)
+        shape = (size, size)
+        humidity = initial_humidity(rng, shape).astype(np.float32)
+        grid = initial_grid(rng, shape, humidity, 0.6, 1.3)
+        grid[rng.random(shape) < 0.01] = Type.BURNING
+        block_size = max(1, args.window // size)
+
+        surface = pygame.Surface(shape)
+        renderer = GridRenderer(shape, block_size)
+        legacy = time_frames(lambda: legacy_render(surface, grid, humidity, block_size), args.frames)
+        palette = time_frames(lambda: renderer.render(grid, humidity), args.frames)
+        print(f"{size:>6} {block_size:>6} {legacy:10.2f} {palette:11.2f} {legacy / palette:7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+import argparse
+import multiprocessing
+import resource
+import time
+
+from benchmarks.common import create_forest
+
+SIZES = [256, 512, 1024, 2048, 4096, 8192, 16384]
+
+
+def run_case(backend: str, width: int, height: int, steps: int, seed: int, sparse: bool = False) -> dict:
+    start = time.perf_counter()
+    forest = create_forest(backend=backend, width=width, height=height, resident=True, sparse=sparse, seed=seed)
+    setup = time.perf_counter() - start
+
+    forest.next_gen()
+    forest.sync_to_host()
+
+    start = time.perf_counter()
+    for _ in range(steps):
+        forest.next_gen()
+    forest.sync_to_host()
+    elapsed = time.perf_counter() - start
+
+    return {
+        'width': width,
+        'height': height,
+        'setup_s': setup,
+        'steps_per_s': steps / elapsed,
+        'cells_per_s': width * height * steps / elapsed,
+        'state_mb': (forest.grid.nbytes + forest.humidity.nbytes) / 2**20,
+        # ru_maxrss is in kilobytes on Linux
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Steps/s and memory use from 256^2 up to 16384^2")
+    parser.add_argument('--backend', default='auto', choices=['gpu', 'cpu', 'auto'])
+    parser.add_argument('--max-size', type=int, default=16384,
+                        help='largest square side; the cpu backend peaks near 5 GB of RSS at 8192^2 and '
+                             '20 GB at 16384^2, lower it on smaller machines')
+    parser.add_argument('--steps', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--sparse', action='store_true', help='use active-tile stepping (cpu only)')
+    args = parser.parse_args()
+
+    cases = [(size, size) for size in SIZES if size <= args.max_size]
+    cases.append((3000, 5000))
+
+    # Each case runs in a fresh process so peak RSS is per grid size
+    context = multiprocessing.get_context('spawn')
+    print(f"{'grid':>13} {'setup s':>9} {'steps/s':>10} {'Mcells/s':>10} {'state MB':>10} {'peak RSS MB':>12}")
+    for width, height in cases:
+        with context.Pool(1) as pool:
+            try:
+                result = pool.apply(run_case, (args.backend, width, height, args.steps, args.seed, args.sparse))
+            except Exception as error:
+                # A size that does not fit in memory does not end the run
+                print(f"{width:>6}x{height:<6} failed: {type(error).__name__}: {error}")
+                continue
+        print(f"{width:>6}x{height:<6} {result['setup_s']:9.2f} {result['steps_per_s']:10.2f} "
+              f"{result['cells_per_s'] / 1e6:10.1f} {result['state_mb']:10.1f} {result['peak_rss_mb']:12.1f}")
+
+
+if __name__ == "__main__":
+    main()
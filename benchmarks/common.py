@@ -0,0 +1,8 @@
+from src.config import load_forest_config
+from src.simulation.forest import Forest
+
+
+def create_forest(**overrides) -> Forest:
+    params = load_forest_config()
+    params.update(overrides)
+    return Forest(**params)
@@ -0,0 +1,305 @@
+import argparse
+import datetime
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from typing import Callable, Iterator
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import numpy as np
+
+from benchmarks.common import create_forest
+from src.simulation.forest import TERRAIN_WORKERS
+from src.simulation.helpers import generate_cluster_map
+from src.simulation.profiler import PROFILER
+
+# Benchmarks every run repeats with the same seeds, so two result files of
+# the same commit differ only by noise. Each result is the median of
+# --repeat timed samples after warm-up runs.
+GROUPS = ('terrain', 'stages', 'history', 'reset', 'render')
+
+SIZES = {'full': [256, 1024, 4096], 'quick': [256, 1024]}
+STAGE_SIZES = {'full': [256, 1024], 'quick': [256]}
+HISTORY_STEPS = {'full': [1_000, 10_000, 100_000], 'quick': [1_000, 10_000]}
+
+# Spans of one non-resident next_gen: uploads, the dispatch, reading the
+# results back and the host-side humidity update
+STAGES = ('update_humidity', 'update_grid', 'update_step', 'update_wind', 'dispatch', 'read_results',
+          'humidity_clip', 'next_gen')
+
+Result = tuple[str, dict]
+
+
+def summary(samples: list[float], **extra) -> dict:
+    return {
+        'median_s': float(np.median(samples)),
+        'min_s': float(np.min(samples)),
+        'mean_s': float(np.mean(samples)),
+        'samples': [float(s) for s in samples],
+        **extra
+    }
+
+
+def measure(run: Callable[[], object], repeat: int, warmup: int = 1, **extra) -> dict:
+    for _ in range(warmup):
+        run()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        samples.append(time.perf_counter() - start)
+    return summary(samples, **extra)
+
+
+def bench_terrain(args) -> Iterator[Result]:
+    for size in SIZES[args.mode]:
+        yield f'terrain/cluster_map/{size}', measure(
+            lambda: generate_cluster_map(np.random.default_rng(args.seed), size, workers=TERRAIN_WORKERS),
+            args.repeat)
+        yield f'terrain/forest_init/{size}', measure(
+            lambda: create_forest(backend='cpu', size=size, seed=args.seed), args.repeat)
+
+
+def bench_stages(args) -> Iterator[Result]:
+    # The GPU runs on whatever device compushady picks, a software Vulkan
+    # driver such as lavapipe is selected through the Vulkan loader, e.g.
+    # VK_ICD_FILENAMES. Without a usable device the cases are skipped.
+    for backend in ('cpu', 'gpu'):
+        for size in STAGE_SIZES[args.mode]:
+            try:
+                forest = create_forest(backend=backend, size=size, seed=args.seed)
+            except Exception as error:
+                yield f'stages/{backend}/{size}', {'skipped': f'{type(error).__name__}: {error}'}
+                continue
+            for frame in range(args.warmup):
+                forest.next_gen(frame)
+
+            PROFILER.reset()
+            PROFILER.enable()
+            try:
+                for frame in range(args.steps):
+                    forest.next_gen(frame)
+            finally:
+                PROFILER.disable()
+                forest.close()
+
+            stats = PROFILER.stats()
+            for stage in STAGES:
+                if stage in stats:
+                    values = stats[stage]
+                    yield f'stages/{backend}/{size}/{stage}', {
+                        'median_s': values['p50_ms'] / 1e3,
+                        'mean_s': values['mean_ms'] / 1e3,
+                        'p95_s': values['p95_ms'] / 1e3,
+                        'count': values['count'],
+                    }
+
+
+def bench_history(args) -> Iterator[Result]:
+    # A small world so the statistics kept per step show next to the step.
+    # Only the steps are timed, history_s is the time in the history span.
+    for steps in HISTORY_STEPS[args.mode]:
+        samples, spent = [], []
+        for _ in range(max(1, args.repeat // 2)):
+            forest = create_forest(backend='cpu', size=32, seed=args.seed)
+            PROFILER.reset()
+            PROFILER.enable()
+            start = time.perf_counter()
+            try:
+                for frame in range(steps):
+                    forest.next_gen(frame)
+            finally:
+                PROFILER.disable()
+                forest.close()
+            samples.append(time.perf_counter() - start)
+            spent.append(PROFILER.stats()['history']['total_ms'] / 1e3)
+
+        result = summary(samples, steps=steps)
+        result['per_step_s'] = result['median_s'] / steps
+        result['history_s'] = float(np.median(spent))
+        result['history_per_step_s'] = result['history_s'] / steps
+        yield f'history/{steps}', result
+
+
+def bench_reset(args) -> Iterator[Result]:
+    for size in SIZES[args.mode]:
+        forest = create_forest(backend='cpu', size=size, seed=args.seed)
+        yield f'reset/{size}', measure(lambda: forest.simulation_reset(args.seed), args.repeat)
+        forest.close()
+
+
+def bench_render(args) -> Iterator[Result]:
+    import pygame
+
+    from src.game.grid_renderer import GridRenderer
+    from src.game.ui_components import HumidityHeatmap
+    from src.game.viewport import ViewportRenderer, changed_tiles
+
+    pygame.display.init()
+    window = pygame.display.set_mode((1234, 900))
+
+    for size in SIZES[args.mode]:
+        # Two consecutive generations, alternated so every frame has changes
+        forest = create_forest(backend='cpu', size=size, seed=args.seed)
+        frames = [(forest.grid.copy(), forest.humidity.copy())]
+        forest.next_gen()
+        forest.sync_to_host()
+        frames.append((forest.grid.copy(), forest.humidity.copy()))
+        forest.close()
+        counter = itertools.count()
+        changed = changed_tiles(frames[1][0], frames[0][0])
+
+        def frame() -> tuple[np.ndarray, np.ndarray]:
+            return frames[next(counter) % 2]
+
+        grid_renderer = GridRenderer(forest.shape, max(1, 900 // size))
+        yield f'render/grid/{size}', measure(lambda: grid_renderer.render(*frame()), args.repeat)
+
+        viewport = ViewportRenderer(forest.shape, (400, 66, 834, 834))
+
+        def draw_viewport() -> None:
+            viewport.update(*frame(), changed)
+            viewport.draw(window)
+
+        yield f'render/viewport/{size}', measure(draw_viewport, args.repeat)
+
+        heatmap = HumidityHeatmap((47, 548, 308, 308))
+
+        def draw_heatmap() -> None:
+            heatmap.update(frame()[1], force=True)
+            heatmap.draw(window)
+
+        yield f'render/heatmap/{size}', measure(draw_heatmap, args.repeat)
+    pygame.display.quit()
+
+
+BENCHMARKS = {
+    'terrain': bench_terrain,
+    'stages': bench_stages,
+    'history': bench_history,
+    'reset': bench_reset,
+    'render': bench_render,
+}
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(args) -> None:
+    results = {}
+    for group in args.groups:
+        for name, result in BENCHMARKS[group](args):
+            results[name] = result
+            if 'skipped' in result:
+                print(f"{name:<40} skipped: {result['skipped']}")
+            else:
+                print(f"{name:<40} {result['median_s'] * 1e3:12.3f} ms")
+
+    document = {
+        'meta': {
+            'created': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'mode': args.mode,
+            'seed': args.seed,
+            'repeat': args.repeat,
+        },
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(document, file, indent=2)
+    print(f"Wrote {len(results)} results to {args.output}")
+
+
+def compare(baseline: dict, current: dict, threshold: float, min_delta: float) -> list[tuple[str, str, float | None]]:
+    # (name, status, current / baseline median) for every case of either
+    # file. A case regresses when it is slower by more than threshold and
+    # by more than min_delta seconds, which keeps microsecond stages from
+    # flagging on noise.
+    rows = []
+    for name in sorted(set(baseline) | set(current)):
+        before, after = baseline.get(name), current.get(name)
+        if before is None:
+            rows.append((name, 'new', None))
+        elif after is None:
+            rows.append((name, 'missing', None))
+        elif 'skipped' in before or 'skipped' in after:
+            rows.append((name, 'skipped', None))
+        else:
+            ratio = after['median_s'] / before['median_s'] if before['median_s'] > 0 else float('inf')
+            delta = after['median_s'] - before['median_s']
+            if ratio > 1 + threshold and delta > min_delta:
+                status = 'REGRESSION'
+            elif ratio < 1 / (1 + threshold) and -delta > min_delta:
+                status = 'faster'
+            else:
+                status = 'ok'
+            rows.append((name, status, ratio))
+    return rows
+
+
+def compare_files(args) -> None:
+    with open(args.baseline, encoding='utf-8') as file:
+        baseline = json.load(file)
+    with open(args.current, encoding='utf-8') as file:
+        current = json.load(file)
+
+    rows = compare(baseline['results'], current['results'], args.threshold, args.min_delta)
+    print(f"baseline {baseline['meta'].get('commit')}, current {current['meta'].get('commit')}")
+    print(f"{'case':<40} {'baseline ms':>12} {'current ms':>12} {'ratio':>7}  status")
+    for name, status, ratio in rows:
+        before = baseline['results'].get(name, {}).get('median_s')
+        after = current['results'].get(name, {}).get('median_s')
+        before = f"{before * 1e3:12.3f}" if before is not None else f"{'-':>12}"
+        after = f"{after * 1e3:12.3f}" if after is not None else f"{'-':>12}"
+        ratio = f"{ratio:7.2f}" if ratio is not None else f"{'-':>7}"
+        print(f"{name:<40} {before} {after} {ratio}  {status}")
+
+    regressions = [name for name, status, _ in rows if status == 'REGRESSION']
+    if regressions:
+        print(f"{len(regressions)} regressions beyond {args.threshold:.0%}")
+        sys.exit(1)
+    print("No regressions")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Reproducible benchmark suite with JSON results")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help='run the benchmarks and write their results')
+    run.add_argument('--output', '-o', default='benchmark_results.json')
+    run.add_argument('--groups', nargs='+', default=list(GROUPS), choices=GROUPS)
+    run.add_argument('--quick', dest='mode', action='store_const', const='quick', default='full',
+                     help='smaller sizes and step counts')
+    run.add_argument('--repeat', type=int, default=5, help='timed samples per case')
+    run.add_argument('--warmup', type=int, default=5, help='untimed generations before stage timings')
+    run.add_argument('--steps', type=int, default=100, help='generations timed per stage case')
+    run.add_argument('--seed', type=int, default=1234)
+    run.set_defaults(handler=run_suite)
+
+    comparison = commands.add_parser('compare', help='flag regressions of current against baseline')
+    comparison.add_argument('baseline')
+    comparison.add_argument('current')
+    comparison.add_argument('--threshold', type=float, default=0.10, help='relative slowdown flagged')
+    comparison.add_argument('--min-delta', type=float, default=1e-4, help='seconds a slowdown must exceed')
+    comparison.set_defaults(handler=compare_files)
+
+    args = parser.parse_args()
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
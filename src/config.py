@@ -2,6 +2,9 @@ import json
 import os
 from typing import Dict, Any
 
+# Keys read by Game rather than Forest
+DISPLAY_KEYS = ('fps', 'humidity_refresh_every', 'humidity_threshold', 'steps_per_second', 'profile')
+
 
 def load_config() -> Dict[str, Any]:
     config_path = os.path.join(
@@ -16,3 +19,10 @@ def load_config() -> Dict[str, Any]:
     with open(config_path, 'r', encoding='utf-8') as file:
         config_data = json.load(file)
     return config_data
+
+
+def load_forest_config() -> Dict[str, Any]:
+    config_data = load_config()
+    for key in DISPLAY_KEYS:
+        config_data.pop(key, None)
+    return config_data
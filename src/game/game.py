@@ -1,21 +1,27 @@
-from src.simulation.forest import Forest, Type
-from .ui_components import LeftPanel, HumidityRenderer
+from src.simulation.forest import Forest
+from src.simulation.recording import Recording
+from src.simulation.profiler import PROFILER, span
+from .ui_components import LeftPanel, HumidityHeatmap, ProfilerOverlay
+from .viewport import ViewportRenderer
+from .replay import ReplayPlayer, SEEK
+from .simulation_worker import SimulationWorker, RESET, SET_RATE
 
 import pygame
 import pygame_gui
-import numpy as np
 
-import matplotlib
-
-matplotlib.use("Agg")
+VIEW_KEYS = (pygame.K_PLUS, pygame.K_EQUALS, pygame.K_KP_PLUS, pygame.K_MINUS, pygame.K_KP_MINUS, pygame.K_0)
 
 
 class Game:
     def __init__(self,
-                 forest: Forest,
+                 forest: Forest | Recording,
                  width: int = 1234,
                  height: int = 900,
-                 fps: int = 60) -> None:
+                 fps: int = 60,
+                 humidity_refresh_every: int = 1,
+                 humidity_threshold: float = 0.0,
+                 steps_per_second: float = None,
+                 profile: bool = False) -> None:
         pygame.init()
         pygame.display.set_caption("Symulacja Pożaru Lasu")
 
@@ -29,17 +35,37 @@ class Game:
         self.clock = pygame.time.Clock()
 
         self.forest = forest
-        self.single_block_size = self.height // self.forest.size
 
         # UI Components
         self.left_panel = LeftPanel(self.manager, self.width, self.height)
-        self.humidity_renderer = HumidityRenderer(size=(4, 4), dpi=100)
-
-        self.grid_surface = pygame.Surface((self.forest.size, self.forest.size))
-        self.humidity_surface = self.update_humidity_surface()
-
-    def update_humidity_surface(self):
-        return self.humidity_renderer.draw_humidity(self.forest.humidity)
+        self.humidity_heatmap = HumidityHeatmap((47, 548, 308, 308), humidity_refresh_every, humidity_threshold)
+
+        # The mouse wheel zooms, dragging pans, + and - zoom on the centre
+        # and 0 fits the whole grid again
+        self.viewport = ViewportRenderer(self.forest.shape, (400, 66, self.width - 400, self.height - 66))
+        self.dragging = False
+
+        # F3 shows per-stage timings. The profiler only runs while the
+        # overlay is shown, or all the time with profile.
+        self.profile = profile
+        if profile:
+            PROFILER.enable()
+        self.profiler_overlay = ProfilerOverlay((408, 74, 380, 420))
+
+        # The simulation steps on its own thread at steps_per_second (as fast
+        # as it can when None), frames are picked up here at display fps.
+        # A recording is played back instead at steps_per_second frames per
+        # second, controlled from the keyboard.
+        self.replay = isinstance(forest, Recording)
+        if self.replay:
+            self.worker = ReplayPlayer(self.forest, steps_per_second or 30.0)
+            self.replay_speed = self.worker.speed
+        else:
+            self.worker = SimulationWorker(self.forest, steps_per_second)
+        self.frame = self.worker.take_frame()
+        self.viewport.update(self.frame.grid, self.frame.humidity, self.frame.changed)
+        self.humidity_heatmap.update(self.frame.humidity, force=True)
+        self.stats_time = 0.0
 
     def process_events(self):
         for event in pygame.event.get():
@@ -49,14 +75,88 @@ class Game:
             if event.type == pygame.USEREVENT:
                 if (event.user_type == pygame_gui.UI_BUTTON_PRESSED
                         and event.ui_element == self.left_panel.restart_button):
-                    self.forest = self.forest.simulation_reset()
+                    self.worker.send(RESET)
+
+            if event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                self.toggle_profiler()
+            elif event.type == pygame.KEYDOWN and event.key in VIEW_KEYS:
+                self.process_view_key(event.key)
+            elif event.type == pygame.KEYDOWN and self.replay:
+                self.process_replay_key(event.key)
+            else:
+                self.process_view_mouse(event)
 
             self.manager.process_events(event)
 
+    def process_view_key(self, key):
+        if key == pygame.K_0:
+            self.viewport.fit()
+        else:
+            self.viewport.zoom(2.0 if key in (pygame.K_PLUS, pygame.K_EQUALS, pygame.K_KP_PLUS) else 0.5)
+
+    def process_view_mouse(self, event):
+        if event.type == pygame.MOUSEWHEEL:
+            position = pygame.mouse.get_pos()
+            if self.viewport.rect.collidepoint(position):
+                self.viewport.zoom(2.0 ** event.y, position)
+        elif event.type == pygame.MOUSEBUTTONDOWN and event.button in (1, 3):
+            self.dragging = self.viewport.rect.collidepoint(event.pos)
+        elif event.type == pygame.MOUSEBUTTONUP and event.button in (1, 3):
+            self.dragging = False
+        elif event.type == pygame.MOUSEMOTION and self.dragging:
+            self.viewport.pan(*event.rel)
+
+    def toggle_profiler(self):
+        self.profiler_overlay.toggle()
+        if self.profiler_overlay.visible:
+            PROFILER.enable(PROFILER.tracing)
+        elif not self.profile:
+            PROFILER.disable()
+
+    def process_replay_key(self, key):
+        # Space pauses, arrows step or change speed, R reverses,
+        # Home and End jump to the first and last frame
+        player = self.worker
+        if key == pygame.K_SPACE:
+            if player.speed:
+                self.replay_speed = player.speed
+                player.send(SET_RATE, 0.0)
+            else:
+                player.send(SET_RATE, self.replay_speed)
+        elif key in (pygame.K_LEFT, pygame.K_RIGHT):
+            player.send(SET_RATE, 0.0)
+            player.send(SEEK, player.index + (1 if key == pygame.K_RIGHT else -1))
+        elif key in (pygame.K_UP, pygame.K_DOWN):
+            speed = player.speed or self.replay_speed
+            player.send(SET_RATE, speed * 2 if key == pygame.K_UP else speed / 2)
+        elif key == pygame.K_r:
+            player.send(SET_RATE, -(player.speed or self.replay_speed))
+        elif key == pygame.K_HOME:
+            player.send(RESET)
+        elif key == pygame.K_END:
+            player.send(SEEK, len(self.forest) - 1)
+
     def update(self, time_delta):
-        self.forest.next_gen(pygame.time.get_ticks())
-        self.humidity_surface = self.update_humidity_surface()
-        self.manager.update(time_delta)
+        if self.worker.error is not None:
+            raise RuntimeError("Simulation worker failed") from self.worker.error
+
+        with span('take_frame'):
+            frame = self.worker.take_frame()
+        if frame is not None:
+            self.frame = frame
+            with span('render_grid'):
+                self.viewport.update(frame.grid, frame.humidity, frame.changed)
+            with span('heatmap'):
+                self.humidity_heatmap.update(frame.humidity)
+
+        self.stats_time += time_delta
+        if self.stats_time >= 0.5:
+            self.left_panel.update_stats(self.worker.rate, self.clock.get_fps())
+            self.stats_time = 0.0
+
+        self.profiler_overlay.update(time_delta, PROFILER)
+        with span('ui_update'):
+            self.manager.update(time_delta)
 
     def render(self):
         self.window_surface.fill((24, 24, 24))
@@ -65,61 +165,30 @@ class Game:
 
         self.render_left_panel()
 
-        self.manager.draw_ui(self.window_surface)
+        with span('ui_draw'):
+            self.manager.draw_ui(self.window_surface)
+        self.profiler_overlay.draw(self.window_surface)
 
-        pygame.display.flip()
+        with span('flip'):
+            pygame.display.flip()
 
     def render_forest_grid(self):
-        color_array = self.get_color_array()
-        pygame.surfarray.blit_array(self.grid_surface, color_array)
-        scaled_size = (self.forest.size * self.single_block_size,
-                       self.forest.size * self.single_block_size)
-        scaled_grid = pygame.transform.scale(self.grid_surface, scaled_size)
-        self.window_surface.blit(scaled_grid, (400, 66))
+        with span('blit_grid'):
+            self.viewport.draw(self.window_surface)
 
     def render_left_panel(self):
-        self.window_surface.blit(self.humidity_surface, (-4, 500))
-        self.left_panel.draw_wind_compass(self.window_surface, self.forest)
-
-    def get_color_array(self) -> np.ndarray:
-        grid_flat = self.forest.grid.flatten()
-        humidity_flat = self.forest.humidity.flatten()
-        size = self.forest.size
-
-        colors = np.zeros((size ** 2, 3), dtype=np.uint8)
-
-        # Type.EMPTY
-        colors[grid_flat == Type.EMPTY] = [220, 220, 220]
-
-        # Type.TREE
-        green_intensity = np.clip(
-            (120 / humidity_flat[grid_flat == Type.TREE]).astype(np.uint8),
-            0, 255
-        )
-        colors[grid_flat == Type.TREE] = np.stack([
-            np.zeros_like(green_intensity),
-            green_intensity,
-            np.zeros_like(green_intensity)
-        ], axis=1)
-
-        # Type.BURNING
-        colors[grid_flat == Type.BURNING] = [220, 0, 0]
-
-        # Type.LIGHTNING
-        colors[grid_flat == Type.LIGHTNING] = [100, 100, 220]
-
-        # Type.ASH
-        colors[grid_flat == Type.ASH] = [50, 50, 50]
-
-        # Type.WATER
-        colors[grid_flat == Type.WATER] = [150, 150, 250]
-
-        return colors.reshape((size, size, 3))
+        self.humidity_heatmap.draw(self.window_surface)
+        self.left_panel.draw_wind_compass(self.window_surface, self.frame)
 
     def start(self) -> None:
-        while self.running:
-            time_delta = self.clock.tick(self.fps) / 1000.0
-
-            self.process_events()
-            self.update(time_delta)
-            self.render()
+        self.worker.start()
+        try:
+            while self.running:
+                time_delta = self.clock.tick(self.fps) / 1000.0
+
+                with span('frame'):
+                    self.process_events()
+                    self.update(time_delta)
+                    self.render()
+        finally:
+            self.worker.close()
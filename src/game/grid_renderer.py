@@ -0,0 +1,69 @@
+from src.simulation.types import Type
+
+import pygame
+import numpy as np
+
+# Trees are shaded by humidity, every type gets HUMIDITY_BANDS palette
+# entries so a cell's index is type * HUMIDITY_BANDS + band
+HUMIDITY_BANDS = 32
+
+TYPE_COLORS = {
+    Type.EMPTY: (220, 220, 220),
+    Type.BURNING: (220, 0, 0),
+    Type.LIGHTNING: (100, 100, 220),
+    Type.ASH: (50, 50, 50),
+    Type.WATER: (150, 150, 250),
+}
+
+
+def build_palette() -> list[tuple[int, int, int]]:
+    palette = [(0, 0, 0)] * 256
+    centres = 0.5 + (np.arange(HUMIDITY_BANDS) + 0.5) / HUMIDITY_BANDS
+    for cell_type in Type:
+        for band, humidity in enumerate(centres):
+            if cell_type == Type.TREE:
+                color = (0, int(np.clip(120 / humidity, 0, 255)), 0)
+            else:
+                color = TYPE_COLORS[cell_type]
+            palette[cell_type * HUMIDITY_BANDS + band] = color
+    return palette
+
+
+PALETTE = build_palette()
+
+
+class GridRenderer:
+    def __init__(self, shape, block_size):
+        # The grid is drawn transposed, grid rows run along the screen x axis
+        self.shape = shape
+        height, width = shape
+
+        self.surface = pygame.Surface((height, width), depth=8)
+        self.surface.set_palette(PALETTE)
+        self.scaled = pygame.Surface((height * block_size, width * block_size), depth=8)
+        self.scaled.set_palette(PALETTE)
+
+        # Persistent per-frame buffers, nothing grid sized is allocated in render
+        self.bands = np.empty(shape, dtype=np.float32)
+        self.indices = np.empty(shape, dtype=np.uint8)
+        self.band_indices = np.empty(shape, dtype=np.uint8)
+
+    def fill_indices(self, grid, humidity):
+        # band = clip((humidity - 0.5) * BANDS, 0, BANDS - 1)
+        np.subtract(humidity, 0.5, out=self.bands)
+        np.multiply(self.bands, HUMIDITY_BANDS, out=self.bands)
+        np.clip(self.bands, 0, HUMIDITY_BANDS - 1, out=self.bands)
+        np.copyto(self.band_indices, self.bands, casting='unsafe')
+
+        np.multiply(grid, HUMIDITY_BANDS, out=self.indices, casting='unsafe')
+        np.add(self.indices, self.band_indices, out=self.indices)
+        return self.indices
+
+    def render(self, grid, humidity):
+        pygame.surfarray.blit_array(self.surface, self.fill_indices(grid, humidity))
+        pygame.transform.scale(self.surface, self.scaled.get_size(), self.scaled)
+        return self.scaled
+
+    def colors(self, grid, humidity):
+        # RGB array of the grid, for exporting frames without a display
+        return np.asarray(PALETTE, dtype=np.uint8)[self.fill_indices(grid, humidity)]
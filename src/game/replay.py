@@ -0,0 +1,128 @@
+from src.simulation.recording import Recording
+
+import os
+import shutil
+import subprocess
+import time
+
+import numpy as np
+import pygame
+
+from .grid_renderer import GridRenderer
+from .simulation_worker import Frame, RESET, SET_RATE
+from .viewport import changed_tiles
+
+# Replay-only command: jump to a frame index
+SEEK = 'seek'
+
+
+class ReplayPlayer:
+    def __init__(self, recording: Recording, frames_per_second: float = 30.0) -> None:
+        # Stands in for SimulationWorker when Game shows a recording. Frames
+        # are decoded on the caller's thread when they are taken, no compute
+        # engine is involved. A negative rate plays backward, 0 pauses.
+        self.recording = recording
+        self.speed = frames_per_second
+        self.position = 0.0
+        self.shown = None
+        self.shown_grid = None
+        self.last_time = None
+        self.error: BaseException | None = None
+        self.rate = 0.0
+
+    @property
+    def index(self) -> int:
+        return int(self.position)
+
+    def start(self) -> None:
+        self.last_time = time.perf_counter()
+
+    def stop(self) -> None:
+        self.last_time = None
+
+    def close(self) -> None:
+        self.stop()
+        self.recording.close()
+
+    def send(self, command: str, *args) -> None:
+        if command == RESET:
+            self.seek(0)
+        elif command == SEEK:
+            self.seek(args[0])
+        elif command == SET_RATE:
+            self.speed = args[0]
+
+    def seek(self, index: int) -> None:
+        self.position = float(np.clip(index, 0, len(self.recording) - 1))
+
+    def take_frame(self) -> Frame | None:
+        now = time.perf_counter()
+        if self.last_time is not None:
+            self.position += self.speed * (now - self.last_time)
+            self.last_time = now
+        last = len(self.recording) - 1
+        if not 0 <= self.position <= last:
+            self.position = float(np.clip(self.position, 0, last))
+            self.speed = 0.0
+        self.rate = abs(self.speed)
+
+        if self.index == self.shown:
+            return None
+        self.shown = self.index
+        step, grid, humidity, wind = self.recording.frame(self.index)
+        grid = grid.copy()
+        changed = changed_tiles(grid, self.shown_grid)
+        self.shown_grid = grid
+        return Frame(step, grid, humidity, pygame.Vector2(wind), changed)
+
+
+def export_frames(recording: Recording,
+                  output: str,
+                  start: int = 0,
+                  stop: int = None,
+                  every: int = 1,
+                  scale: int = 1,
+                  fps: int = 30) -> int:
+    # Writes frames start:stop:every as numbered PNGs into the directory
+    # output, or as a video through ffmpeg when output has a video suffix.
+    # Frames are drawn like the game draws them, transposed. Returns the
+    # number of frames written.
+    renderer = GridRenderer(recording.shape, 1)
+    indices = range(start, len(recording) if stop is None else min(stop, len(recording)), every)
+    height, width = recording.shape
+
+    video = os.path.splitext(output)[1].lower() in ('.mp4', '.mkv', '.webm', '.avi', '.gif')
+    if video:
+        ffmpeg = shutil.which('ffmpeg')
+        if ffmpeg is None:
+            raise RuntimeError("Exporting video needs ffmpeg on PATH, export PNG frames to a directory instead")
+        encoder = subprocess.Popen(
+            [ffmpeg, '-loglevel', 'error', '-y',
+             '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f'{height * scale}x{width * scale}',
+             '-r', str(fps), '-i', '-',
+             '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', '-pix_fmt', 'yuv420p', output],
+            stdin=subprocess.PIPE
+        )
+    else:
+        os.makedirs(output, exist_ok=True)
+
+    written = 0
+    try:
+        for index in indices:
+            _, grid, humidity, _ = recording.frame(index)
+            # colors is indexed [row, column], the screen shows rows along x
+            rgb = renderer.colors(grid, humidity)
+            if scale > 1:
+                rgb = rgb.repeat(scale, axis=0).repeat(scale, axis=1)
+            if video:
+                encoder.stdin.write(np.ascontiguousarray(rgb.transpose(1, 0, 2)).tobytes())
+            else:
+                surface = pygame.surfarray.make_surface(rgb)
+                pygame.image.save(surface, os.path.join(output, f"frame_{index:06d}.png"))
+            written += 1
+    finally:
+        if video:
+            encoder.stdin.close()
+            if encoder.wait() != 0:
+                raise RuntimeError(f"ffmpeg failed writing {output}")
+    return written
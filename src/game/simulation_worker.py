@@ -0,0 +1,140 @@
+from src.simulation.forest import Forest
+
+import queue
+import threading
+import time
+from typing import NamedTuple
+
+import numpy as np
+import pygame
+
+from .viewport import changed_tiles
+
+# Commands accepted by SimulationWorker.send
+RESET = 'reset'
+SET_RATE = 'set_rate'
+STOP = 'stop'
+
+
+class Frame(NamedTuple):
+    step: int
+    grid: np.ndarray
+    humidity: np.ndarray
+    wind: pygame.Vector2
+    # Tiles whose cells changed since the previous frame, see changed_tiles
+    changed: tuple[np.ndarray, np.ndarray] | None = None
+
+
+class SimulationWorker:
+    def __init__(self, forest: Forest, steps_per_second: float = None) -> None:
+        # The forest is only touched from the worker thread once it runs,
+        # which also keeps all device work on a single thread. The renderer
+        # talks to it through the command queue and the latest-frame slot.
+        self.forest = forest
+        self.steps_per_second = steps_per_second
+        self.commands = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name="simulation", daemon=True)
+
+        # One frame slot: the worker only copies the state out when the
+        # renderer has taken the previous frame, so copies are bounded by
+        # the display rate rather than the step rate
+        self.lock = threading.Lock()
+        self.latest: Frame | None = None
+        self.wanted = True
+        self.error: BaseException | None = None
+        self.rate = 0.0
+        # Grid of the last frame taken
+        self.shown = None
+
+        self.publish()
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def send(self, command: str, *args) -> None:
+        self.commands.put((command, args))
+
+    def stop(self) -> None:
+        if self.thread.is_alive():
+            self.send(STOP)
+            self.thread.join()
+
+    def close(self) -> None:
+        self.stop()
+        self.forest.close()
+
+    def take_frame(self) -> Frame | None:
+        with self.lock:
+            frame, self.latest = self.latest, None
+            self.wanted = True
+            if frame is not None:
+                self.shown = frame.grid
+        return frame
+
+    def publish(self, force: bool = False) -> None:
+        with self.lock:
+            if not (self.wanted or force):
+                return
+        # Resident state is only copied back for frames that are taken
+        forest = self.forest
+        forest.sync_to_host()
+        # Changes are against the last frame taken, so a forced frame that
+        # replaces one never taken includes that one's changes too
+        with self.lock:
+            shown = self.shown
+        grid = forest.grid.copy()
+        frame = Frame(forest.step, grid, forest.humidity.copy(), pygame.Vector2(forest.wind),
+                      changed_tiles(grid, shown))
+        with self.lock:
+            self.latest = frame
+            self.wanted = False
+
+    def handle(self, command: str, args: tuple) -> bool:
+        if command == STOP:
+            return False
+        if command == RESET:
+            self.forest = self.forest.simulation_reset()
+            self.publish(force=True)
+        elif command == SET_RATE:
+            self.steps_per_second = args[0]
+        return True
+
+    def wait_commands(self, timeout: float) -> bool:
+        # Runs queued commands, blocking up to timeout for the first one.
+        # Returns False once STOP was received.
+        try:
+            while True:
+                if timeout > 0:
+                    command, args = self.commands.get(timeout=timeout)
+                    timeout = 0
+                else:
+                    command, args = self.commands.get_nowait()
+                if not self.handle(command, args):
+                    return False
+        except queue.Empty:
+            return True
+
+    def run(self) -> None:
+        try:
+            deadline = time.perf_counter()
+            window_start = deadline
+            window_steps = 0
+            while self.wait_commands(0):
+                self.forest.next_gen(pygame.time.get_ticks())
+                self.publish()
+
+                window_steps += 1
+                now = time.perf_counter()
+                if now - window_start >= 1.0:
+                    self.rate = window_steps / (now - window_start)
+                    window_start = now
+                    window_steps = 0
+
+                if self.steps_per_second:
+                    # A slow step does not build up a backlog of fast ones
+                    deadline = max(deadline + 1 / self.steps_per_second, now)
+                    if deadline > now and not self.wait_commands(deadline - now):
+                        break
+        except BaseException as error:
+            self.error = error
+            raise
@@ -3,11 +3,19 @@ from .arrow import draw_arrow
 import pygame
 import pygame_gui
 import numpy as np
-import pylab
-import matplotlib.backends.backend_agg as agg
-import matplotlib
 
-matplotlib.use("Agg")
+# matplotlib's viridis sampled at nine evenly spaced points
+VIRIDIS_STOPS = [
+    (68, 1, 84), (71, 44, 122), (59, 81, 139), (44, 113, 142), (33, 144, 141),
+    (39, 173, 129), (92, 200, 99), (170, 220, 50), (253, 231, 37)
+]
+
+
+def viridis_palette() -> list[tuple[int, int, int]]:
+    stops = np.linspace(0, 255, len(VIRIDIS_STOPS))
+    channels = np.array(VIRIDIS_STOPS, dtype=np.float64).T
+    lut = np.stack([np.interp(np.arange(256), stops, c) for c in channels], axis=1)
+    return [tuple(color) for color in np.rint(lut).astype(int)]
 
 
 class LeftPanel:
@@ -31,14 +39,22 @@ class LeftPanel:
             text="Restart",
             manager=manager
         )
+        self.stats_label = pygame_gui.elements.UILabel(
+            relative_rect=pygame.Rect((10, 295), (380, 30)),
+            text="",
+            manager=manager
+        )
+
+    def update_stats(self, steps_per_second, fps):
+        self.stats_label.set_text(f"Symulacja: {steps_per_second:.1f} kroków/s   Render: {fps:.1f} fps")
 
-    def draw_wind_compass(self, window_surface, forest):
+    def draw_wind_compass(self, window_surface, frame):
         wind_surface = pygame.surface.Surface((150, 150))
         wind_surface.fill(pygame.Color(24, 24, 24))
 
         wind_center = pygame.Vector2(wind_surface.get_width() / 2,
                                      wind_surface.get_height() / 2)
-        wind_vector = -pygame.Vector2(forest.wind.y, forest.wind.x) * 125
+        wind_vector = -pygame.Vector2(frame.wind.y, frame.wind.x) * 125
 
         pygame.draw.circle(wind_surface, pygame.Color(50, 50, 50), wind_center, 75)
 
@@ -49,31 +65,107 @@ class LeftPanel:
         window_surface.blit(wind_surface, (124, self.height / 2 - 100))
 
 
-class HumidityRenderer:
-    def __init__(self, size=(4, 4), dpi=100):
-        self.figure = pylab.figure(figsize=size, dpi=dpi)
-        self.figure.patch.set_alpha(0)
-        self.ax = self.figure.gca()
-        self.setup_plot()
-
-    def setup_plot(self):
-        self.ax.set_facecolor((24/255, 24/255, 24/255))
-        for axis in ['top', 'bottom', 'left', 'right']:
-            self.ax.spines[axis].set_linewidth(0)
-        self.ax.axes.get_xaxis().set_ticks([])
-        self.ax.axes.get_yaxis().set_ticks([])
-
-    def draw_humidity(self, humidity):
-        self.ax.clear()
-        self.setup_plot()
-        self.ax.imshow(
-            np.flipud(np.rot90(2 - humidity)),
-            cmap="viridis"
-        )
+class HumidityHeatmap:
+    def __init__(self, rect, refresh_every=1, threshold=0.0):
+        # Humidity drawn through an 8-bit viridis palette, dry cells are
+        # yellow like imshow(2 - humidity) used to draw them. The map is
+        # redrawn at most every `refresh_every` frames and, with a threshold,
+        # only once some cell has changed by more than it.
+        self.rect = pygame.Rect(rect)
+        self.refresh_every = max(1, refresh_every)
+        self.threshold = threshold
+        self.palette = viridis_palette()
+        self.shape = None
+        self.frames = 0
+        self.surface = pygame.Surface(self.rect.size, pygame.SRCALPHA)
+
+    def resize(self, shape):
+        # Grids larger than the widget are drawn from a strided view, so a
+        # refresh costs the widget's pixels rather than the grid's cells
+        self.shape = shape
+        height, width = shape
+        self.stride = max(1, min(height // self.rect.width, width // self.rect.height))
+        sampled = (-(-height // self.stride), -(-width // self.stride))
+
+        self.source = pygame.Surface(sampled, depth=8)
+        self.source.set_palette(self.palette)
+        scale = min(self.rect.width / sampled[0], self.rect.height / sampled[1])
+        self.scaled = pygame.Surface((max(1, int(sampled[0] * scale)), max(1, int(sampled[1] * scale))), depth=8)
+        self.scaled.set_palette(self.palette)
+
+        self.values = np.empty(sampled, dtype=np.float32)
+        self.indices = np.empty(sampled, dtype=np.uint8)
+        self.drawn = np.full(sampled, np.nan, dtype=np.float32)
+
+    def update(self, humidity, force=False):
+        if humidity.shape != self.shape:
+            self.resize(humidity.shape)
+            force = True
+
+        self.frames += 1
+        if not force and self.frames < self.refresh_every:
+            return False
+
+        # Arrays index surfaces as [x, y], so the grid rows along the screen
+        # x axis need no transpose
+        sampled = humidity[::self.stride, ::self.stride]
+        if not force and self.threshold > 0:
+            if np.nanmax(np.abs(sampled - self.drawn)) <= self.threshold:
+                return False
+
+        self.frames = 0
+        np.copyto(self.drawn, sampled, casting='unsafe')
+        low, high = float(self.drawn.min()), float(self.drawn.max())
+        np.subtract(high, self.drawn, out=self.values)
+        np.multiply(self.values, 255 / max(high - low, 1e-6), out=self.values)
+        np.copyto(self.indices, self.values, casting='unsafe')
+
+        pygame.surfarray.blit_array(self.source, self.indices)
+        pygame.transform.scale(self.source, self.scaled.get_size(), self.scaled)
+        self.surface.fill((0, 0, 0, 0))
+        self.surface.blit(self.scaled, self.scaled.get_rect(center=self.surface.get_rect().center))
+        return True
+
+    def draw(self, window_surface):
+        window_surface.blit(self.surface, self.rect)
+
+
+class ProfilerOverlay:
+    def __init__(self, rect, refresh_seconds=0.5):
+        # Table of the profiler's rolling percentiles drawn over the grid,
+        # rebuilt every refresh_seconds rather than every frame
+        self.rect = pygame.Rect(rect)
+        self.refresh_seconds = refresh_seconds
+        self.visible = False
+        self.font = pygame.font.Font(None, 18)
+        self.surface = pygame.Surface(self.rect.size, pygame.SRCALPHA)
+        self.elapsed = refresh_seconds
+
+    def toggle(self):
+        self.visible = not self.visible
+        self.elapsed = self.refresh_seconds
+
+    def update(self, time_delta, profiler):
+        self.elapsed += time_delta
+        if not self.visible or self.elapsed < self.refresh_seconds:
+            return
+        self.elapsed = 0.0
+        stats = profiler.stats()
+
+        self.surface.fill((0, 0, 0, 190))
+        rows = [("etap", "p50 ms", "p95 ms", "p99 ms")]
+        for name, values in sorted(stats.items(), key=lambda item: -item[1]['p50_ms']):
+            rows.append((name, *(f"{values[key]:.3f}" for key in ('p50_ms', 'p95_ms', 'p99_ms'))))
+
+        # Name left aligned, the percentiles right aligned in their columns
+        y = 6
+        for row in rows[:self.rect.height // self.font.get_linesize()]:
+            self.surface.blit(self.font.render(row[0], True, (230, 230, 230)), (8, y))
+            for column, text in enumerate(row[1:]):
+                label = self.font.render(text, True, (230, 230, 230))
+                self.surface.blit(label, (self.rect.width - 8 - (2 - column) * 75 - label.get_width(), y))
+            y += self.font.get_linesize()
 
-        canvas = agg.FigureCanvasAgg(self.figure)
-        canvas.draw()
-        renderer = canvas.get_renderer()
-        raw_data = renderer.tostring_argb()
-        size = canvas.get_width_height()
-        return pygame.image.frombytes(raw_data, size, "ARGB")
+    def draw(self, window_surface):
+        if self.visible:
+            window_surface.blit(self.surface, self.rect)
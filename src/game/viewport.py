@@ -0,0 +1,329 @@
+import math
+
+import numpy as np
+import pygame
+from numpy.lib.stride_tricks import sliding_window_view
+
+from src.simulation.types import Type
+from .grid_renderer import HUMIDITY_BANDS, PALETTE
+
+# Change tracking granularity of the pyramid, in cells of each level
+TILE = 16
+
+# Humidity drifts everywhere without changing cell types. Every new frame
+# recolours this many visible level 0 tiles in turn so shading catches up.
+HUMIDITY_TILES = 256
+
+# Past this share of dirty tiles in view a level is recomputed over the
+# whole view in one go
+REBUILD_SHARE = 0.25
+
+# Most pixels per cell when zoomed in
+MAX_SCALE = 32.0
+
+# Downsampled cells take the most common type of their 2x2 block, ties go to
+# the earlier type here. Burning and lightning win with a single cell so
+# small fires stay visible at any zoom.
+PRIORITY = (Type.BURNING, Type.LIGHTNING, Type.ASH, Type.TREE, Type.EMPTY, Type.WATER)
+ALWAYS_SHOWN = 2
+
+
+def palette_indices(grid: np.ndarray, humidity: np.ndarray) -> np.ndarray:
+    # Same indices as GridRenderer.fill_indices
+    bands = np.clip((humidity - np.float32(0.5)) * np.float32(HUMIDITY_BANDS), 0, HUMIDITY_BANDS - 1)
+    return (grid.astype(np.uint8) * np.uint8(HUMIDITY_BANDS) + bands.astype(np.uint8)).astype(np.uint8)
+
+
+def build_downsample_table() -> np.ndarray:
+    # Type of a 2x2 block for every combination of its four types, indexed
+    # by the types as digits of a base len(Type) number
+    types = len(Type)
+    combinations = np.indices((types,) * 4).reshape(4, -1)
+    counts = np.stack([(combinations == cell_type).sum(axis=0) for cell_type in PRIORITY])
+    counts[:ALWAYS_SHOWN] *= 5
+    return np.asarray(PRIORITY, dtype=np.uint8)[np.argmax(counts, axis=0)]
+
+
+DOWNSAMPLE_TABLE = build_downsample_table()
+
+# Palette indices are type << BAND_BITS | band
+BAND_BITS = HUMIDITY_BANDS.bit_length() - 1
+BAND_MASK = np.uint8(HUMIDITY_BANDS - 1)
+assert HUMIDITY_BANDS == 1 << BAND_BITS
+
+
+def downsample(indices: np.ndarray) -> np.ndarray:
+    # Palette indices of 2x2 blocks over the last two axes, the humidity band
+    # is the blocks' mean. An odd last row or column is paired with itself.
+    height, width = indices.shape[-2:]
+    if height % 2 or width % 2:
+        padding = [(0, 0)] * (indices.ndim - 2) + [(0, height % 2), (0, width % 2)]
+        indices = np.pad(indices, padding, mode='edge')
+    quads = (indices[..., 0::2, 0::2], indices[..., 1::2, 0::2], indices[..., 0::2, 1::2], indices[..., 1::2, 1::2])
+
+    combination = (quads[0] >> BAND_BITS).astype(np.uint16)
+    bands = (quads[0] & BAND_MASK).astype(np.uint16)
+    for quad in quads[1:]:
+        combination *= len(Type)
+        combination += quad >> BAND_BITS
+        bands += quad & BAND_MASK
+    bands >>= 2
+
+    chosen = DOWNSAMPLE_TABLE[combination]
+    chosen <<= BAND_BITS
+    chosen += bands.astype(np.uint8)
+    return chosen
+
+
+def tile_any(mask: np.ndarray, tile: int) -> np.ndarray:
+    # Whether any cell of each tile x tile block is set, partial blocks at
+    # the end included
+    height, width = mask.shape
+    whole = height - height % tile
+    rows = mask[:whole].reshape(-1, tile, width).any(axis=1)
+    if whole < height:
+        rows = np.vstack([rows, mask[whole:].any(axis=0)])
+    whole = width - width % tile
+    tiles = rows[:, :whole].reshape(len(rows), -1, tile).any(axis=2)
+    if whole < width:
+        tiles = np.hstack([tiles, rows[:, whole:].any(axis=1, keepdims=True)])
+    return tiles
+
+
+def changed_tiles(grid: np.ndarray, previous: np.ndarray | None) -> tuple[np.ndarray, np.ndarray] | None:
+    # (rows, columns) of the pyramid's level 0 tiles whose cell types differ
+    # between two frames, None when there is nothing to compare with
+    if previous is None or previous.shape != grid.shape:
+        return None
+    return np.nonzero(tile_any(grid != previous, TILE))
+
+
+def blocks(array: np.ndarray, size: int) -> np.ndarray:
+    # (rows, columns, size, size) view of the size x size blocks of array
+    height, width = array.shape
+    return array.reshape(height // size, size, width // size, size).swapaxes(1, 2)
+
+
+class MipPyramid:
+    def __init__(self, shape: tuple[int, int], depth: int) -> None:
+        # Palette indices of the grid at full resolution and halved per
+        # level up to depth. Every level is split into TILE x TILE tiles with
+        # a dirty flag each, and below the top rounded up to an even number
+        # of tiles so every tile has 2x2 tiles under it. Frames are only
+        # kept by update, prepare recomputes the dirty tiles a view needs.
+        self.shape = tuple(shape)
+        tiles = [(-(-self.shape[0] // TILE), -(-self.shape[1] // TILE))]
+        for _ in range(depth):
+            tiles.append((-(-tiles[-1][0] // 2), -(-tiles[-1][1] // 2)))
+        sizes = [(2 * above[0], 2 * above[1]) for above in tiles[1:]] + tiles[-1:]
+
+        self.levels = [np.zeros((tiles_y * TILE, tiles_x * TILE), dtype=np.uint8) for tiles_y, tiles_x in sizes]
+        self.dirty = [np.ones(level_tiles, dtype=bool) for level_tiles in tiles]
+        self.grid = None
+        self.humidity = None
+        self.sweep = 0
+        self.version = 0
+        self.refreshed = 0
+
+    def extent(self, level: int) -> tuple[int, int]:
+        # Cells of level covering the grid, the rest is padding
+        size = 2 ** level
+        return -(-self.shape[0] // size), -(-self.shape[1] // size)
+
+    def update(self, grid: np.ndarray, humidity: np.ndarray, changed: tuple[np.ndarray, np.ndarray] = None) -> None:
+        # changed holds the level 0 tiles whose cell types differ from the
+        # previous frame, None all of them. The arrays are kept, not copied,
+        # and must not be modified afterwards.
+        self.grid = grid
+        self.humidity = humidity
+        if changed is None:
+            for dirty in self.dirty:
+                dirty.fill(True)
+        else:
+            self.mark(*changed)
+        self.version += 1
+
+    def mark(self, ys: np.ndarray, xs: np.ndarray) -> None:
+        # Marks level 0 tiles dirty along with the tiles above them
+        for dirty in self.dirty:
+            dirty[ys, xs] = True
+            ys, xs = ys // 2, xs // 2
+
+    def prepare(self, level: int, rows: tuple[int, int], columns: tuple[int, int]) -> None:
+        # Brings the cells rows x columns of level up to date with the last
+        # frame, along with the tiles under them on every level below
+        spans = []
+        ty0, ty1 = rows[0] // TILE, -(-rows[1] // TILE)
+        tx0, tx1 = columns[0] // TILE, -(-columns[1] // TILE)
+        for below in range(level, -1, -1):
+            tiles_y, tiles_x = self.dirty[below].shape
+            ty1, tx1 = min(ty1, tiles_y), min(tx1, tiles_x)
+            spans.append((ty0, ty1, tx0, tx1))
+            ty0, ty1, tx0, tx1 = 2 * ty0, 2 * ty1, 2 * tx0, 2 * tx1
+        spans.reverse()
+
+        if self.refreshed != self.version:
+            self.refresh_humidity(*spans[0])
+            self.refreshed = self.version
+        for below, span in enumerate(spans):
+            self.clean(below, *span)
+
+    def refresh_humidity(self, ty0: int, ty1: int, tx0: int, tx1: int) -> None:
+        # Marks the next HUMIDITY_TILES level 0 tiles of the span dirty
+        count = (ty1 - ty0) * (tx1 - tx0)
+        if count == 0:
+            return
+        picks = (self.sweep + np.arange(min(HUMIDITY_TILES, count))) % count
+        self.sweep = (self.sweep + len(picks)) % count
+        self.mark(ty0 + picks // (tx1 - tx0), tx0 + picks % (tx1 - tx0))
+
+    def clean(self, level: int, ty0: int, ty1: int, tx0: int, tx1: int) -> None:
+        dirty = self.dirty[level][ty0:ty1, tx0:tx1]
+        ys, xs = np.nonzero(dirty)
+        if len(ys) == 0:
+            return
+        if len(ys) > REBUILD_SHARE * dirty.size:
+            self.recompute(level, ty0 * TILE, ty1 * TILE, tx0 * TILE, tx1 * TILE)
+            dirty.fill(False)
+            return
+
+        ys += ty0
+        xs += tx0
+        tiles = blocks(self.levels[level], TILE)
+        if level == 0:
+            # Whole tiles are read through views of the frame, on the partial
+            # tiles of the grid's edge its last row and column repeat
+            height, width = self.shape
+            whole = (ys < height // TILE) & (xs < width // TILE)
+            inner = ys[whole], xs[whole]
+            tiles[inner] = palette_indices(sliding_window_view(self.grid, (TILE, TILE))[::TILE, ::TILE][inner],
+                                           sliding_window_view(self.humidity, (TILE, TILE))[::TILE, ::TILE][inner])
+            edge = ys[~whole], xs[~whole]
+            cells = np.arange(TILE)
+            rows = np.minimum(edge[0][:, None] * TILE + cells, height - 1)[:, :, None]
+            columns = np.minimum(edge[1][:, None] * TILE + cells, width - 1)[:, None, :]
+            tiles[edge] = palette_indices(self.grid[rows, columns], self.humidity[rows, columns])
+        else:
+            tiles[ys, xs] = downsample(blocks(self.levels[level - 1], 2 * TILE)[ys, xs])
+        self.dirty[level][ys, xs] = False
+
+    def recompute(self, level: int, y0: int, y1: int, x0: int, x1: int) -> None:
+        target = self.levels[level]
+        if level:
+            target[y0:y1, x0:x1] = downsample(self.levels[level - 1][2 * y0:2 * y1, 2 * x0:2 * x1])
+            return
+        height, width = min(y1, self.shape[0]), min(x1, self.shape[1])
+        target[y0:height, x0:width] = palette_indices(self.grid[y0:height, x0:width],
+                                                      self.humidity[y0:height, x0:width])
+        target[y0:height, width:x1] = target[y0:height, width - 1:width]
+        target[height:y1, x0:x1] = target[height - 1:height, x0:x1]
+
+
+class ViewportRenderer:
+    def __init__(self, shape: tuple[int, int], rect) -> None:
+        # Draws the part of the grid inside rect at any zoom. The grid is
+        # drawn transposed like GridRenderer, grid rows run along the screen
+        # x axis. Only the visible cells of the pyramid level nearest to one
+        # cell per pixel are brought up to date, coloured and scaled, so a
+        # frame costs the view's cells plus the tiles that changed under it.
+        self.shape = tuple(shape)
+        self.rect = pygame.Rect(rect)
+
+        # Fit the whole grid, with whole pixels per cell when they are larger
+        # than one
+        height, width = self.shape
+        fit = min(self.rect.width / height, self.rect.height / width)
+        self.fit_scale = float(math.floor(fit)) if fit >= 1 else fit
+        self.min_scale = min(self.fit_scale, 1.0)
+        self.pyramid = MipPyramid(self.shape, self.level_for(self.min_scale))
+
+        # scale is pixels per cell, origin the (row, column) at the rect's
+        # top left corner
+        self.scale = self.fit_scale
+        self.origin = [0.0, 0.0]
+
+        # The visible cells and the same scaled to the screen, allocated
+        # once. A view spans at most one cell per pixel plus a partial cell
+        # at each edge, scaled up to MAX_SCALE pixels each.
+        self.cells = pygame.Surface((self.rect.width + 2, self.rect.height + 2), depth=8)
+        self.cells.set_palette(PALETTE)
+        margin = 2 * math.ceil(MAX_SCALE) + 1
+        self.image = pygame.Surface((self.rect.width + margin, self.rect.height + margin), depth=8)
+        self.image.set_palette(PALETTE)
+        self.area = pygame.Rect(0, 0, 0, 0)
+        self.position = self.rect.topleft
+        self.drawn = None
+
+    def update(self, grid: np.ndarray, humidity: np.ndarray, changed: tuple[np.ndarray, np.ndarray] = None) -> None:
+        # changed comes from changed_tiles, see MipPyramid.update
+        self.pyramid.update(grid, humidity, changed)
+
+    def fit(self) -> None:
+        self.scale = self.fit_scale
+        self.origin = [0.0, 0.0]
+        self.clamp()
+
+    def zoom(self, factor: float, anchor=None) -> None:
+        # Keeps the cell under anchor (screen position, the rect's centre by
+        # default) in place
+        anchor = self.rect.center if anchor is None else anchor
+        offset_x = anchor[0] - self.rect.x
+        offset_y = anchor[1] - self.rect.y
+        row = self.origin[0] + offset_x / self.scale
+        column = self.origin[1] + offset_y / self.scale
+        self.scale = float(np.clip(self.scale * factor, self.min_scale, MAX_SCALE))
+        self.origin = [row - offset_x / self.scale, column - offset_y / self.scale]
+        self.clamp()
+
+    def pan(self, dx: float, dy: float) -> None:
+        # Moves the view by screen pixels, the grid follows the mouse
+        self.origin[0] -= dx / self.scale
+        self.origin[1] -= dy / self.scale
+        self.clamp()
+
+    def clamp(self) -> None:
+        # The grid starts at the rect's top left corner and never leaves it
+        # with an empty band when it is larger than the view
+        height, width = self.shape
+        self.origin[0] = float(np.clip(self.origin[0], 0, max(0.0, height - self.rect.width / self.scale)))
+        self.origin[1] = float(np.clip(self.origin[1], 0, max(0.0, width - self.rect.height / self.scale)))
+
+    @staticmethod
+    def level_for(scale: float) -> int:
+        # Finest level whose cells cover at least one pixel, scaling up never
+        # drops a cell so a single burning one always shows
+        return math.ceil(math.log2(1 / scale) - 1e-9) if scale < 1 else 0
+
+    def level(self) -> int:
+        return min(self.level_for(self.scale), len(self.pyramid.levels) - 1)
+
+    def render(self) -> None:
+        level = self.level()
+        size = 2 ** level
+        pixels = self.scale * size
+        height, width = self.pyramid.extent(level)
+
+        rows = self.origin[0] / size, (self.origin[0] + self.rect.width / self.scale) / size
+        columns = self.origin[1] / size, (self.origin[1] + self.rect.height / self.scale) / size
+        r0, r1 = int(rows[0]), min(height, int(math.ceil(rows[1])))
+        c0, c1 = int(columns[0]), min(width, int(math.ceil(columns[1])))
+
+        self.pyramid.prepare(level, (r0, r1), (c0, c1))
+        visible = self.pyramid.levels[level][r0:r1, c0:c1]
+        cells = self.cells.subsurface((0, 0) + visible.shape)
+        pygame.surfarray.blit_array(cells, visible)
+        self.area = pygame.Rect(0, 0, round(visible.shape[0] * pixels), round(visible.shape[1] * pixels))
+        pygame.transform.scale(cells, self.area.size, self.image.subsurface(self.area))
+        self.position = (self.rect.x + round((r0 - rows[0]) * pixels),
+                         self.rect.y + round((c0 - columns[0]) * pixels))
+
+    def draw(self, window_surface: pygame.Surface) -> None:
+        # The image is only rebuilt when the grid or the view changed
+        view = (self.pyramid.version, self.scale, tuple(self.origin))
+        if view != self.drawn:
+            self.render()
+            self.drawn = view
+        clip = window_surface.get_clip()
+        window_surface.set_clip(self.rect)
+        window_surface.blit(self.image, self.position, self.area)
+        window_surface.set_clip(clip)
@@ -11,6 +11,10 @@ class Main:
             params = load_config()
 
             self.fps = params.get('fps')
+            self.humidity_refresh_every = params.get('humidity_refresh_every', 1)
+            self.humidity_threshold = params.get('humidity_threshold', 0.0)
+            self.steps_per_second = params.get('steps_per_second')
+            self.profile = params.get('profile', False)
             self.tree_density = params.get('tree_density')
             self.lightning_prob = params.get('lightning_prob')
             self.growth_prob = params.get('growth_prob')
@@ -22,6 +26,17 @@ class Main:
             self.wind = params.get('wind')
             self.wind_change = params.get('wind_change')
             self.radius = params.get('radius')
+            self.backend = params.get('backend', 'auto')
+            self.double_buffered = params.get('double_buffered', False)
+            self.resident = params.get('resident', False)
+            self.sparse = params.get('sparse', False)
+            self.workers = params.get('workers')
+            self.history_limit = params.get('history_limit')
+            self.terrain_cache = params.get('terrain_cache')
+            self.checkpoint_every = params.get('checkpoint_every')
+            self.checkpoint_path = params.get('checkpoint_path', 'checkpoints')
+            self.record_path = params.get('record_path')
+            self.record_keyframe_every = params.get('record_keyframe_every', 100)
 
             self.forest = Forest(tree_density=self.tree_density,
                                  lightning_prob=self.lightning_prob,
@@ -32,14 +47,30 @@ class Main:
                                  water_threshold=self.water_threshold,
                                  wind=self.wind,
                                  wind_change=self.wind_change,
-                                 radius=self.radius)
+                                 radius=self.radius,
+                                 backend=self.backend,
+                                 double_buffered=self.double_buffered,
+                                 resident=self.resident,
+                                 sparse=self.sparse,
+                                 workers=self.workers,
+                                 history_limit=self.history_limit,
+                                 terrain_cache=self.terrain_cache,
+                                 checkpoint_every=self.checkpoint_every,
+                                 checkpoint_path=self.checkpoint_path,
+                                 record_path=self.record_path,
+                                 record_keyframe_every=self.record_keyframe_every)
 
         except Exception:
             print(f"An error occurred during initialization: {traceback.print_exc()}")
 
     def run(self) -> None:
         try:
-            game = Game(self.forest, fps=self.fps)
+            game = Game(self.forest,
+                        fps=self.fps,
+                        humidity_refresh_every=self.humidity_refresh_every,
+                        humidity_threshold=self.humidity_threshold,
+                        steps_per_second=self.steps_per_second,
+                        profile=self.profile)
             game.start()
         except Exception:
             print(f"An error occurred during game execution: {traceback.print_exc()}")
@@ -0,0 +1,38 @@
+import argparse
+
+from src.config import load_config
+from src.game.game import Game
+from src.game.replay import export_frames
+from src.simulation.recording import Recording
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay or export a recorded Forest run")
+    parser.add_argument('recording', help='file written with record_path')
+    parser.add_argument('--export', default=None,
+                        help='directory for PNG frames, or a video file (needs ffmpeg)')
+    parser.add_argument('--start', type=int, default=0, help='first frame index')
+    parser.add_argument('--stop', type=int, default=None, help='frame index to stop before')
+    parser.add_argument('--every', type=int, default=1, help='export every n-th frame')
+    parser.add_argument('--scale', type=int, default=1, help='pixels per cell in exported frames')
+    parser.add_argument('--fps', type=float, default=30.0, help='playback or video frame rate')
+    args = parser.parse_args()
+
+    recording = Recording(args.recording)
+    if args.export is not None:
+        try:
+            written = export_frames(recording, args.export, args.start, args.stop, args.every,
+                                    args.scale, args.fps)
+        finally:
+            recording.close()
+        print(f"Wrote {written} frames to {args.export}")
+        return
+
+    params = load_config()
+    game = Game(recording,
+                fps=params.get('fps'),
+                humidity_refresh_every=params.get('humidity_refresh_every', 1),
+                humidity_threshold=params.get('humidity_threshold', 0.0),
+                steps_per_second=args.fps)
+    game.worker.seek(args.start)
+    game.start()
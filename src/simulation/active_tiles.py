@@ -0,0 +1,233 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from src.simulation.cpu_compute import OUTSIDE, NEIGHBOR_OFFSETS, dilate, next_state, shifted
+from src.simulation.philox import noise_at
+from src.simulation.profiler import span
+from src.simulation.stats import StepStats
+from src.simulation.types import Type, TRANSITIONS
+
+TILE = 16
+
+
+class ActiveTiles:
+    # Sparse stepping for the CPU engine. The world is split into TILE x TILE
+    # tiles and a tile is active when it holds fire, lightning, ash or an
+    # empty cell next to a tree. Only active tiles and their neighbours are
+    # run through next_state, with the same Philox draws as a dense step.
+    # Every other tile is quiescent: it can only change by a lightning
+    # strike, drawn per tile from a binomial instead of per cell.
+    def __init__(self,
+                 width: int,
+                 height: int,
+                 growth_prob: float,
+                 spread_prob: float,
+                 lightning_prob: float,
+                 humidity_change: float,
+                 humidity_change_fire: float,
+                 seed: int) -> None:
+
+        self.width = width
+        self.height = height
+        self.growth_prob = growth_prob
+        self.spread_prob = spread_prob
+        self.lightning_prob = lightning_prob
+        self.humidity_change = humidity_change
+        self.humidity_change_fire = humidity_change_fire
+        self.seed = seed
+
+        self.tiles_y = -(-height // TILE)
+        self.tiles_x = -(-width // TILE)
+        padded = (self.tiles_y * TILE + 2, self.tiles_x * TILE + 2)
+
+        # State padded by one cell and rounded up to whole tiles, cells
+        # outside the world hold OUTSIDE and are never written back
+        self.grid = np.full(padded, OUTSIDE, dtype=np.uint8)
+        self.humidity = np.ones(padded, dtype=np.float32)
+        self.delta = np.zeros(padded, dtype=np.float16)
+        self.inside = np.zeros(padded, dtype=bool)
+        self.inside[1:height + 1, 1:width + 1] = True
+        self.grown = np.zeros(padded, dtype=bool)
+        self.ignited = np.zeros(padded, dtype=bool)
+
+        tiles = (self.tiles_y, self.tiles_x)
+        self.active = np.zeros(tiles, dtype=bool)
+        self.land = np.zeros(tiles, dtype=np.int64)
+        # Step each tile's humidity is current for. The sticky delta keeps
+        # drifting humidity, quiescent tiles catch up when they are next run.
+        # None until the first step after a load, loaded humidity is current
+        # for whatever step comes next.
+        self.humidity_step = np.zeros(tiles, dtype=np.int64)
+        self.step_index = None
+
+        # Transition counts and fire bounding box of the last step
+        self.transitions = np.zeros(len(TRANSITIONS), dtype=np.int64)
+        self.fire_box = None
+
+        cells = np.arange(TILE)
+        self.cell_x = cells[None, None, :]
+        self.cell_y = cells[None, :, None]
+
+    def windows(self, array: np.ndarray) -> np.ndarray:
+        # (tiles_y, tiles_x, TILE + 2, TILE + 2) view of every tile with its halo
+        return sliding_window_view(array, (TILE + 2, TILE + 2))[::TILE, ::TILE]
+
+    def interiors(self, array: np.ndarray) -> np.ndarray:
+        # (tiles_y, tiles_x, TILE, TILE) view of every tile
+        inner = array[1:-1, 1:-1].reshape(self.tiles_y, TILE, self.tiles_x, TILE)
+        return inner.transpose(0, 2, 1, 3)
+
+    def load(self, grid: np.ndarray, humidity: np.ndarray) -> None:
+        world = (slice(1, self.height + 1), slice(1, self.width + 1))
+        np.copyto(self.grid[world], grid.reshape(self.height, self.width), casting='unsafe')
+        np.copyto(self.humidity[world], humidity.reshape(self.height, self.width), casting='unsafe')
+        self.step_index = None
+
+        # Water never changes, so the number of cells lightning can hit in a
+        # tile is fixed
+        land = self.interiors((self.grid != Type.WATER) & self.inside)
+        self.land = land.sum(axis=(2, 3))
+        self.active = self.liveness(np.ones_like(self.active))
+
+    def liveness(self, tiles: np.ndarray) -> np.ndarray:
+        ty, tx = np.nonzero(tiles)
+        grid = self.windows(self.grid)[ty, tx]
+        inner = grid[:, 1:-1, 1:-1]
+
+        tree_nearby = np.zeros(inner.shape, dtype=bool)
+        for dx, dy in NEIGHBOR_OFFSETS:
+            tree_nearby |= shifted(grid, dx, dy) == Type.TREE
+        live = ((inner == Type.BURNING) | (inner == Type.LIGHTNING) | (inner == Type.ASH)
+                | ((inner == Type.EMPTY) & tree_nearby))
+
+        result = np.zeros_like(tiles)
+        result[ty, tx] = live.any(axis=(1, 2))
+        return result
+
+    def catch_up(self, ty: np.ndarray, tx: np.ndarray, step: int) -> None:
+        # clip(h + d) applied n times equals clip(h + n * d) while d is fixed
+        missing = step - self.humidity_step[ty, tx]
+        stale = missing > 0
+        if np.any(stale):
+            ty, tx, missing = ty[stale], tx[stale], missing[stale]
+            humidity = self.interiors(self.humidity)
+            drift = self.interiors(self.delta)[ty, tx].astype(np.float32)
+            humidity[ty, tx] = np.clip(
+                humidity[ty, tx] + missing[:, None, None].astype(np.float32) * drift, 0.5, 1.5)
+        self.humidity_step[ty, tx] = step
+
+    def state(self) -> tuple[np.ndarray, np.ndarray]:
+        if self.step_index is not None:
+            ty, tx = np.nonzero(np.ones_like(self.active))
+            self.catch_up(ty, tx, self.step_index)
+        world = (slice(1, self.height + 1), slice(1, self.width + 1))
+        return self.grid[world].copy(), self.humidity[world].copy()
+
+    def spread_delta(self, mask: np.ndarray, value: float, ty: np.ndarray, tx: np.ndarray,
+                     delta: np.ndarray) -> None:
+        if value == 0:
+            return
+        changed = dilate(self.windows(mask)[ty, tx])[:, 1:-1, 1:-1]
+        np.copyto(delta, np.float16(value), where=changed)
+
+    def step(self, step: int, wind: np.ndarray) -> np.ndarray:
+        # Advances the world by one generation and returns its transition
+        # counts in TRANSITIONS order
+        if self.step_index is None:
+            self.humidity_step[:] = step
+        run = dilate(self.active)
+        ty, tx = np.nonzero(run)
+        self.catch_up(ty, tx, step)
+
+        grid = self.windows(self.grid)[ty, tx]
+        humidity = self.windows(self.humidity)[ty, tx]
+        inside = self.windows(self.inside)[ty, tx]
+        # Halo results are thrown away, so noise is only drawn for interiors
+        noise = []
+        x = (tx * TILE)[:, None, None] + self.cell_x
+        y = (ty * TILE)[:, None, None] + self.cell_y
+        with span('noise'):
+            for values in noise_at(self.seed, step, x, y):
+                window = np.zeros(grid.shape, dtype=np.float32)
+                window[:, 1:-1, 1:-1] = values
+                noise.append(window)
+
+        # Deltas are gathered below from the grown and ignited masks of
+        # neighbouring tiles, so next_state must not write its own
+        with span('next_state'):
+            new_grid = next_state(
+                grid,
+                humidity,
+                noise,
+                wind,
+                np.zeros(grid.shape, dtype=np.float16),
+                self.growth_prob,
+                self.spread_prob,
+                self.lightning_prob,
+                0,
+                0
+            )
+        new_grid = np.where(inside, new_grid, grid)[:, 1:-1, 1:-1]
+        old_grid = grid[:, 1:-1, 1:-1]
+        self.interiors(self.grid)[ty, tx] = new_grid
+
+        grown = (old_grid == Type.EMPTY) & (new_grid == Type.TREE)
+        ignited = (old_grid == Type.TREE) & (new_grid == Type.BURNING)
+        counts = np.array([
+            np.count_nonzero(new_grid == Type.LIGHTNING),
+            np.count_nonzero(ignited),
+            np.count_nonzero((old_grid == Type.BURNING) & (new_grid == Type.ASH)),
+            np.count_nonzero(grown)
+        ], dtype=np.int64)
+
+        # Growth and ignitions only happen within a cell of an active tile,
+        # so every delta they write lands in a tile that was run
+        self.interiors(self.grown)[ty, tx] = grown
+        self.interiors(self.ignited)[ty, tx] = ignited
+        delta = self.interiors(self.delta)[ty, tx]
+        self.spread_delta(self.grown, self.humidity_change, ty, tx, delta)
+        self.spread_delta(self.ignited, self.humidity_change_fire, ty, tx, delta)
+        self.interiors(self.delta)[ty, tx] = delta
+        self.interiors(self.grown)[ty, tx] = False
+        self.interiors(self.ignited)[ty, tx] = False
+
+        tile_humidity = self.interiors(self.humidity)
+        tile_humidity[ty, tx] = np.clip(tile_humidity[ty, tx] + delta, 0.5, 1.5)
+        self.humidity_step[ty, tx] = step + 1
+
+        # Burning cells keep their tiles active, so all of them were run
+        tile, cell_y, cell_x = np.nonzero(new_grid == Type.BURNING)
+        self.fire_box = None
+        if len(tile):
+            xs = tx[tile] * TILE + cell_x
+            ys = ty[tile] * TILE + cell_y
+            self.fire_box = (int(xs.min()), int(ys.min()), int(xs.max()), int(ys.max()))
+
+        self.active = self.liveness(run)
+        counts[TRANSITIONS.index('lightning')] += self.strike_quiescent(step, ~run)
+
+        self.step_index = step + 1
+        self.transitions = counts
+        return counts
+
+    def stats(self) -> StepStats:
+        # Padding cells hold OUTSIDE and fall outside the first len(Type) bins
+        counts = np.bincount(self.grid.ravel(), minlength=len(Type))[:len(Type)]
+        return StepStats(counts.astype(np.int64), self.transitions.copy(), self.fire_box)
+
+    def strike_quiescent(self, step: int, quiescent: np.ndarray) -> int:
+        # Each land cell of a quiescent tile is hit with lightning_prob, so
+        # the number of strikes per tile is binomial and the cells uniform
+        rng = np.random.default_rng((self.seed & 0xFFFFFFFFFFFFFFFF, step))
+        strikes = np.zeros(quiescent.shape, dtype=np.int64)
+        strikes[quiescent] = rng.binomial(self.land[quiescent], self.lightning_prob)
+
+        grid = self.interiors(self.grid)
+        inside = self.interiors(self.inside)
+        for ty, tx in zip(*np.nonzero(strikes)):
+            tile = grid[ty, tx]
+            land = np.flatnonzero((tile != Type.WATER) & inside[ty, tx])
+            hit = rng.choice(land, size=strikes[ty, tx], replace=False)
+            tile[np.unravel_index(hit, tile.shape)] = Type.LIGHTNING
+            self.active[ty, tx] = True
+        return int(strikes.sum())
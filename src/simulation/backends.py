@@ -0,0 +1,32 @@
+from src.simulation.cpu_compute import CpuForestComputeEngine
+
+BACKENDS = ("gpu", "cpu", "partitioned", "auto")
+
+
+def create_compute_engine(backend: str, shader_path: str, **params):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown compute backend: {backend} (expected one of {BACKENDS})")
+
+    # Active-tile stepping is only implemented by the CPU engine
+    sparse = params.pop("sparse", False)
+    if sparse and backend in ("gpu", "partitioned"):
+        raise ValueError("Sparse stepping is only supported by the cpu backend")
+
+    # Worker processes sharing the state, each steps a block of the world
+    workers = params.pop("workers", None)
+    if backend == "partitioned":
+        from src.simulation.partitioned import PartitionedComputeEngine
+        return PartitionedComputeEngine(**params, workers=workers)
+
+    if backend == "cpu" or sparse:
+        return CpuForestComputeEngine(**params, sparse=sparse)
+
+    try:
+        # compushady needs a GPU driver and the HLSL compiler, import it lazily
+        from src.simulation.gpu_compute import ForestComputeEngine
+        return ForestComputeEngine(shader_path=shader_path, **params)
+    except Exception as error:
+        if backend == "gpu":
+            raise
+        print(f"GPU backend unavailable, falling back to CPU: {error!r}")
+        return CpuForestComputeEngine(**params)
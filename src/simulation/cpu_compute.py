@@ -0,0 +1,488 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
+
+from src.simulation.philox import cell_noise
+from src.simulation.profiler import span
+from src.simulation.stats import StepStats
+from src.simulation.types import Type, TRANSITIONS
+
+# Sentinel used to pad the grid, never equal to any Type
+OUTSIDE = 255
+
+SLOTS = 2
+
+# Neighbour offsets (dx, dy) in the same order as the loops in shader.hlsl
+NEIGHBOR_OFFSETS = [
+    (i, j)
+    for i in range(-1, 2)
+    for j in range(-1, 2)
+    if not (i == 0 and j == 0)
+]
+
+
+def pad_grid(grid: np.ndarray, radius: int = 1) -> np.ndarray:
+    pad_width = [(0, 0)] * (grid.ndim - 2) + [(radius, radius), (radius, radius)]
+    return np.pad(grid, pad_width, constant_values=OUTSIDE)
+
+
+def shifted(padded: np.ndarray, dx: int, dy: int, radius: int = 1) -> np.ndarray:
+    height = padded.shape[-2] - 2 * radius
+    width = padded.shape[-1] - 2 * radius
+    return padded[...,
+                  radius + dy:radius + dy + height,
+                  radius + dx:radius + dx + width]
+
+
+def dilate(mask: np.ndarray) -> np.ndarray:
+    padded = pad_grid(mask.view(np.uint8), 1) == 1
+    result = np.zeros_like(mask)
+    for i in range(-1, 2):
+        for j in range(-1, 2):
+            result |= shifted(padded, i, j)
+    return result
+
+
+def window_count(values: np.ndarray, radius: int, axis: int) -> np.ndarray:
+    # Sum of values over [i - radius, i + radius] along axis, clipped to the
+    # array, from one cumulative sum whatever the radius
+    size = values.shape[axis]
+    sums = np.cumsum(values, axis=axis, dtype=np.int32)
+    sums = np.concatenate([np.zeros_like(np.take(sums, [0], axis=axis)), sums], axis=axis)
+    index = np.arange(size)
+    upper = np.minimum(index + radius + 1, size)
+    lower = np.maximum(index - radius, 0)
+    return np.take(sums, upper, axis=axis) - np.take(sums, lower, axis=axis)
+
+
+def box_any(mask: np.ndarray, radius: int) -> np.ndarray:
+    # Whether the (2 * radius + 1)^2 box around each cell holds a True,
+    # separable box counts over the last two axes
+    if radius == 1:
+        return dilate(mask)
+    return window_count(window_count(mask, radius, -2), radius, -1) > 0
+
+
+def spread_factors(wind: np.ndarray) -> np.ndarray:
+    # acos(dot(normalize(position - fire_position), wind)) / PI for every offset
+    wind = np.asarray(wind, dtype=np.float32)
+    offsets = -np.array(NEIGHBOR_OFFSETS, dtype=np.float32)
+    directions = offsets / np.linalg.norm(offsets, axis=1, keepdims=True)
+    dots = np.einsum('...k,nk->...n', wind, directions).astype(np.float32)
+    with np.errstate(invalid='ignore'):
+        return (np.arccos(dots) / np.float32(np.pi)).astype(np.float32)
+
+
+def offset_factors(wind: np.ndarray, dx: np.ndarray, dy: np.ndarray) -> np.ndarray:
+    # spread_factors for a per-cell offset, same float32 operations
+    wind = np.asarray(wind, dtype=np.float32)
+    offset_x = -dx.astype(np.float32)
+    offset_y = -dy.astype(np.float32)
+    norm = np.sqrt(offset_x * offset_x + offset_y * offset_y)
+    # Cells without a source have a zero offset, their NaN is masked later
+    with np.errstate(invalid='ignore', divide='ignore'):
+        dots = (wind[..., 0, None, None] * (offset_x / norm)
+                + wind[..., 1, None, None] * (offset_y / norm)).astype(np.float32)
+        return (np.arccos(dots) / np.float32(np.pi)).astype(np.float32)
+
+
+def spread_chance(burning: np.ndarray,
+                  candidates: np.ndarray,
+                  base: np.ndarray,
+                  wind: np.ndarray,
+                  radius: int) -> np.ndarray:
+    # Chance that at least one burning cell within radius ignites each
+    # candidate, 1 - prod(1 - base * factor) over the sources with the wind
+    # factor of each one's offset, a source above 1 makes it certain. Multiplied in the shader's loop order, dx
+    # outer and dy inner, and only over columns holding fire. Returns the
+    # chances of the candidates in np.nonzero order.
+    shape = burning.shape
+    height, width = shape[-2:]
+    span_y, span_x = height + 2 * radius, width + 2 * radius
+    padded = (pad_grid(burning.view(np.uint8), radius) == 1).ravel()
+    column_hit = (pad_grid((window_count(burning, radius, -2) > 0).view(np.uint8), radius) == 1).ravel()
+
+    index = np.nonzero(candidates)
+    batch = np.ravel_multi_index(index[:-2], shape[:-2]) if len(shape) > 2 else np.zeros(len(index[-1]), np.intp)
+    cells = (batch * span_y + index[-2] + radius) * span_x + index[-1] + radius
+    base = np.broadcast_to(base, shape)[index]
+    winds = np.broadcast_to(np.asarray(wind, dtype=np.float32), shape[:-2] + (2,)).reshape(-1, 2)
+    keep = np.ones(len(cells), dtype=np.float32)
+
+    for dx in range(-radius, radius + 1):
+        hit = np.flatnonzero(column_hit[cells + dx])
+        if len(hit) == 0:
+            continue
+        column_cells = cells[hit] + dx
+        column_base = base[hit]
+        column_keep = keep[hit]
+        column_batch = batch[hit]
+        for dy in range(-radius, radius + 1):
+            if dx == 0 and dy == 0:
+                continue
+            sources = np.flatnonzero(padded[column_cells + dy * span_x])
+            if len(sources) == 0:
+                continue
+            factor = offset_factors(winds, np.array([dx]), np.array([dy])).reshape(-1)[column_batch[sources]]
+            column_keep[sources] *= np.maximum(np.float32(1) - column_base[sources] * factor, np.float32(0))
+        keep[hit] = column_keep
+
+    return np.float32(1) - keep
+
+
+def next_state(grid: np.ndarray,
+               humidity: np.ndarray,
+               noise: list[np.ndarray],
+               wind: np.ndarray,
+               delta_humidity: np.ndarray,
+               growth_prob,
+               spread_prob,
+               lightning_prob,
+               humidity_change,
+               humidity_change_fire,
+               radius: int = 1) -> np.ndarray:
+    # Leading dimensions are batch dimensions, the last two are (y, x).
+    # Per-batch parameters must broadcast against (..., 1, 1).
+    if radius != 1:
+        return next_state_wide(grid, humidity, noise, wind, delta_humidity, growth_prob, spread_prob,
+                               lightning_prob, humidity_change, humidity_change_fire, radius)
+
+    lightning_noise, burn_out_noise, growth_noise, spread_noise = noise
+    padded = pad_grid(grid)
+    new_grid = grid.copy()
+
+    strike = (lightning_noise < np.float32(lightning_prob)) & (grid != Type.WATER)
+
+    # Fire -> Ash
+    burn_out = np.float32(0.5) + np.float32(0.5) * (humidity - np.float32(0.5))
+    new_grid[(grid == Type.BURNING) & (burn_out_noise < burn_out)] = Type.ASH
+
+    # Lightning -> Fire, Ash -> Empty
+    new_grid[grid == Type.LIGHTNING] = Type.BURNING
+    new_grid[grid == Type.ASH] = Type.EMPTY
+
+    # Empty -> Plant
+    plant_nearby = np.zeros(grid.shape, dtype=bool)
+    for dx, dy in NEIGHBOR_OFFSETS:
+        plant_nearby |= shifted(padded, dx, dy) == Type.TREE
+    grown = ((grid == Type.EMPTY) & plant_nearby
+             & (growth_noise < np.float32(growth_prob)) & ~strike)
+    new_grid[grown] = Type.TREE
+
+    # Plant -> Fire, the first burning neighbour in loop order decides the angle
+    factors = spread_factors(wind)
+    factor = np.full(grid.shape, np.nan, dtype=np.float32)
+    for k in reversed(range(len(NEIGHBOR_OFFSETS))):
+        dx, dy = NEIGHBOR_OFFSETS[k]
+        factor = np.where(
+            shifted(padded, dx, dy) == Type.BURNING,
+            factors[..., k, None, None],
+            factor
+        )
+    threshold = (np.float32(spread_prob) * (np.float32(2) - humidity)) * factor
+    ignited = (grid == Type.TREE) & (spread_noise < threshold) & ~strike
+    new_grid[ignited] = Type.BURNING
+
+    # Any -> Lightning
+    new_grid[strike] = Type.LIGHTNING
+
+    # change_humidity writes, fire is written after growth
+    if np.any(humidity_change != 0):
+        changed = dilate(grown) & (np.float32(humidity_change) != 0)
+        np.copyto(delta_humidity, np.float16(humidity_change), where=changed)
+    if np.any(humidity_change_fire != 0):
+        changed = dilate(ignited) & (np.float32(humidity_change_fire) != 0)
+        np.copyto(delta_humidity, np.float16(humidity_change_fire), where=changed)
+
+    return new_grid
+
+
+def next_state_wide(grid: np.ndarray,
+                    humidity: np.ndarray,
+                    noise: list[np.ndarray],
+                    wind: np.ndarray,
+                    delta_humidity: np.ndarray,
+                    growth_prob,
+                    spread_prob,
+                    lightning_prob,
+                    humidity_change,
+                    humidity_change_fire,
+                    radius: int) -> np.ndarray:
+    # next_state with (2 * radius + 1)^2 neighbourhoods. Growth and humidity
+    # writes use box counts, a few passes for any radius. Only the spread
+    # loops over offsets, and only for plants with fire in reach.
+    lightning_noise, burn_out_noise, growth_noise, spread_noise = noise
+    new_grid = grid.copy()
+
+    strike = (lightning_noise < np.float32(lightning_prob)) & (grid != Type.WATER)
+
+    # Fire -> Ash
+    burn_out = np.float32(0.5) + np.float32(0.5) * (humidity - np.float32(0.5))
+    new_grid[(grid == Type.BURNING) & (burn_out_noise < burn_out)] = Type.ASH
+
+    # Lightning -> Fire, Ash -> Empty
+    new_grid[grid == Type.LIGHTNING] = Type.BURNING
+    new_grid[grid == Type.ASH] = Type.EMPTY
+
+    # Empty -> Plant, the cell itself is empty so counting it changes nothing
+    plant_nearby = box_any(grid == Type.TREE, radius)
+    grown = ((grid == Type.EMPTY) & plant_nearby
+             & (growth_noise < np.float32(growth_prob)) & ~strike)
+    new_grid[grown] = Type.TREE
+
+    # Plant -> Fire, every burning cell in reach is a separate chance to
+    # ignite, see spread_chance. next_state keeps the first burning
+    # neighbour's angle at radius 1.
+    burning = grid == Type.BURNING
+    candidates = (grid == Type.TREE) & box_any(burning, radius) & ~strike
+    base = np.float32(spread_prob) * (np.float32(2) - humidity)
+    ignited = np.zeros(grid.shape, dtype=bool)
+    ignited[candidates] = spread_noise[candidates] < spread_chance(burning, candidates, base, wind, radius)
+    new_grid[ignited] = Type.BURNING
+
+    # Any -> Lightning
+    new_grid[strike] = Type.LIGHTNING
+
+    # change_humidity writes within radius, fire is written after growth
+    if np.any(humidity_change != 0):
+        changed = box_any(grown, radius) & (np.float32(humidity_change) != 0)
+        np.copyto(delta_humidity, np.float16(humidity_change), where=changed)
+    if np.any(humidity_change_fire != 0):
+        changed = box_any(ignited, radius) & (np.float32(humidity_change_fire) != 0)
+        np.copyto(delta_humidity, np.float16(humidity_change_fire), where=changed)
+
+    return new_grid
+
+
+def transition_counts(previous: np.ndarray, current: np.ndarray) -> np.ndarray:
+    # Same order as TRANSITIONS
+    return np.array([
+        np.count_nonzero(current == Type.LIGHTNING),
+        np.count_nonzero((previous == Type.TREE) & (current == Type.BURNING)),
+        np.count_nonzero((previous == Type.BURNING) & (current == Type.ASH)),
+        np.count_nonzero((previous == Type.EMPTY) & (current == Type.TREE))
+    ], dtype=np.int64)
+
+
+def fire_box(grid: np.ndarray) -> tuple[int, int, int, int] | None:
+    burning = grid == Type.BURNING
+    rows = np.flatnonzero(burning.any(axis=1))
+    if len(rows) == 0:
+        return None
+    columns = np.flatnonzero(burning.any(axis=0))
+    return int(columns[0]), int(rows[0]), int(columns[-1]), int(rows[-1])
+
+
+def step_stats(previous: np.ndarray, current: np.ndarray) -> StepStats:
+    # One histogram of (previous, current) pairs gives both the population
+    # and the transitions, types fit in three bits
+    pairs = np.bincount((previous * np.uint8(8) + current).ravel(), minlength=64).reshape(8, 8)
+    counts = pairs.sum(axis=0)[:len(Type)].astype(np.int64)
+    transitions = np.array([
+        counts[Type.LIGHTNING],
+        pairs[Type.TREE, Type.BURNING],
+        pairs[Type.BURNING, Type.ASH],
+        pairs[Type.EMPTY, Type.TREE]
+    ], dtype=np.int64)
+    return StepStats(counts, transitions, fire_box(current))
+
+
+class CpuForestComputeEngine:
+    def __init__(self,
+                 width: int,
+                 height: int,
+                 growth_prob: float,
+                 spread_prob: float,
+                 lightning_prob: float,
+                 humidity_change: float,
+                 humidity_change_fire: float,
+                 seed: int,
+                 double_buffered: bool = False,
+                 resident: bool = False,
+                 sparse: bool = False,
+                 radius: int = 1) -> None:
+
+        self.width = width
+        self.height = height
+        shape = (height, width)
+        self.growth_prob = growth_prob
+        self.spread_prob = spread_prob
+        self.lightning_prob = lightning_prob
+        self.humidity_change = humidity_change
+        self.humidity_change_fire = humidity_change_fire
+        self.seed = seed
+        if radius < 1:
+            raise ValueError(f"Radius must be at least 1, got {radius}")
+        self.radius = radius
+
+        self.source = [np.zeros(shape, dtype=np.uint8) for _ in range(SLOTS)]
+        self.humidity = [np.zeros(shape, dtype=np.float32) for _ in range(SLOTS)]
+        self.steps = [0] * SLOTS
+        self.wind = [np.zeros(2, dtype=np.float32) for _ in range(SLOTS)]
+
+        # Like the shader's out_humidity texture, it is only written where
+        # humidity changes and keeps its values between dispatches
+        self.humidity_out = np.zeros(shape, dtype=np.float16)
+
+        # Resident state, the host is the device here so there is no ping-pong
+        self.resident = resident
+        self.state_grid = np.zeros(shape, dtype=np.uint8)
+        self.state_humidity = np.zeros(shape, dtype=np.float32)
+        self.previous_grid = self.state_grid
+
+        # Sparse stepping keeps the resident state in active tiles instead
+        self.tiles = None
+        if sparse:
+            if not resident:
+                raise ValueError("Sparse stepping needs resident state")
+            if radius != 1:
+                raise ValueError("Sparse stepping only supports radius 1")
+            from src.simulation.active_tiles import ActiveTiles
+            self.tiles = ActiveTiles(width, height, growth_prob, spread_prob, lightning_prob,
+                                     humidity_change, humidity_change_fire, seed)
+
+        # Same slot scheme as ForestComputeEngine, NumPy releases the GIL for
+        # the bulk of next_state so a worker thread overlaps with the caller
+        self.slot = 0
+        self.executor = ThreadPoolExecutor(max_workers=1) if double_buffered else None
+        self.pending: Future | None = None
+        self.results = None
+
+    def reset(self, seed: int) -> None:
+        self.wait()
+        self.results = None
+        self.seed = seed
+        self.humidity_out.fill(0)
+        if self.tiles is not None:
+            self.tiles.seed = seed
+            self.tiles.delta.fill(0)
+
+    def update_grid(self, grid: np.ndarray) -> None:
+        np.copyto(self.source[self.slot], grid.reshape(self.height, self.width), casting='unsafe')
+
+    def update_humidity(self, humidity: np.ndarray) -> None:
+        np.copyto(self.humidity[self.slot], humidity.reshape(self.height, self.width), casting='unsafe')
+
+    def update_step(self, step: int) -> None:
+        self.steps[self.slot] = step
+
+    def update_wind(self, wind_x: float, wind_y: float) -> None:
+        self.wind[self.slot][:] = (wind_x, wind_y)
+
+    def upload_state(self, grid: np.ndarray, humidity: np.ndarray) -> None:
+        self.wait()
+        if self.tiles is not None:
+            self.tiles.load(grid, humidity)
+            return
+        np.copyto(self.state_grid, grid.reshape(self.height, self.width), casting='unsafe')
+        np.copyto(self.state_humidity, humidity.reshape(self.height, self.width), casting='unsafe')
+        self.previous_grid = self.state_grid
+
+    def download_state(self) -> tuple[np.ndarray, np.ndarray]:
+        self.wait()
+        if self.tiles is not None:
+            return self.tiles.state()
+        return self.state_grid.copy(), self.state_humidity.copy()
+
+    def read_stats(self) -> StepStats:
+        # Statistics of the last resident step, computed where the state is
+        self.wait()
+        if self.tiles is not None:
+            return self.tiles.stats()
+        return step_stats(self.previous_grid, self.state_grid)
+
+    def download_delta(self) -> np.ndarray:
+        self.wait()
+        if self.tiles is not None:
+            return self.tiles.delta[1:self.height + 1, 1:self.width + 1].copy()
+        return self.humidity_out.copy()
+
+    def upload_delta(self, delta: np.ndarray) -> None:
+        self.wait()
+        if self.tiles is not None:
+            np.copyto(self.tiles.delta[1:self.height + 1, 1:self.width + 1],
+                      delta.reshape(self.height, self.width), casting='unsafe')
+            return
+        np.copyto(self.humidity_out, delta.reshape(self.height, self.width), casting='unsafe')
+
+    def advance_state(self, step: int, wind: np.ndarray) -> np.ndarray | None:
+        if self.tiles is not None:
+            return self.tiles.step(step, wind)
+        with span('noise'):
+            noise = cell_noise(self.seed, step, self.height, self.width)
+        self.previous_grid = self.state_grid
+        with span('next_state'):
+            self.state_grid = next_state(
+                self.state_grid,
+                self.state_humidity,
+                noise,
+                wind,
+                self.humidity_out,
+                self.growth_prob,
+                self.spread_prob,
+                self.lightning_prob,
+                self.humidity_change,
+                self.humidity_change_fire,
+                self.radius
+            )
+        with span('humidity_clip'):
+            np.clip(self.state_humidity + self.humidity_out, 0.5, 1.5, out=self.state_humidity)
+
+    def run_resident(self, slot: int) -> None:
+        self.advance_state(self.steps[slot], self.wind[slot])
+
+    def advance(self, base_step: int, winds: np.ndarray, counters: bool = False) -> np.ndarray | None:
+        self.wait()
+        totals = np.zeros(len(TRANSITIONS), dtype=np.int64)
+        for i, wind in enumerate(np.asarray(winds, dtype=np.float32)):
+            previous = self.state_grid
+            counts = self.advance_state(base_step + i, wind)
+            if counts is not None:
+                totals += counts
+            elif counters:
+                totals += transition_counts(previous, self.state_grid)
+        return totals if counters else None
+
+    def step(self) -> None:
+        self.wait()
+        if self.executor is None:
+            self.run_resident(self.slot)
+        else:
+            self.pending = self.executor.submit(self.run_resident, self.slot)
+        self.slot = (self.slot + 1) % SLOTS
+
+    def wait(self) -> None:
+        if self.pending is not None:
+            self.results = self.pending.result()
+            self.pending = None
+
+    def run(self, slot: int) -> tuple[np.ndarray, np.ndarray]:
+        with span('noise'):
+            noise = cell_noise(self.seed, self.steps[slot], self.height, self.width)
+        with span('next_state'):
+            new_grid = next_state(
+                self.source[slot],
+                self.humidity[slot],
+                noise,
+                self.wind[slot],
+                self.humidity_out,
+                self.growth_prob,
+                self.spread_prob,
+                self.lightning_prob,
+                self.humidity_change,
+                self.humidity_change_fire,
+                self.radius
+            )
+        return new_grid, self.humidity_out.copy()
+
+    def dispatch(self) -> None:
+        self.wait()
+        if self.executor is None:
+            self.results = self.run(self.slot)
+        else:
+            self.pending = self.executor.submit(self.run, self.slot)
+        self.slot = (self.slot + 1) % SLOTS
+
+    def read_results(self) -> tuple[np.ndarray, np.ndarray]:
+        self.wait()
+        return self.results
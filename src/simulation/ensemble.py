@@ -0,0 +1,135 @@
+import numpy as np
+
+from src.simulation.cpu_compute import next_state
+from src.simulation.forest import initial_terrain
+from src.simulation.philox import cell_noise
+from src.simulation.types import Type
+from src.simulation.wind import Wind
+
+# Parameters that may differ between members, the world size is shared
+MEMBER_PARAMS = (
+    'tree_density',
+    'lightning_prob',
+    'growth_prob',
+    'spread_prob',
+    'humidity_change',
+    'humidity_change_fire',
+    'water_threshold',
+    'wind',
+    'wind_change',
+)
+
+# Members are advanced in chunks of about this many cells, beyond it the
+# temporaries of next_state fall out of cache and throughput drops
+CHUNK_CELLS = 1 << 16
+
+
+class EnsembleForest:
+    def __init__(
+            self,
+            seeds: list[int],
+            members: list[dict] = None,
+            size: int = 256,
+            width: int = None,
+            height: int = None,
+            terrain_cache: str = None,
+            **params
+    ) -> None:
+        # Member k is the Forest built from params updated with members[k]
+        # and seeds[k]. Grid and humidity are stacked into (K, H, W) arrays
+        # and members advance in vectorised next_state calls over cache-sized
+        # chunks of the stack.
+        self.width = width or size
+        self.height = height or size
+        self.seeds = [int(seed) for seed in seeds]
+        # Number of members, size is the world size as for Forest
+        self.count = len(self.seeds)
+        self.shape = (self.count, self.height, self.width)
+
+        members = members or [{}] * self.count
+        if len(members) != self.count:
+            raise ValueError(f"Expected {self.count} member overrides, got {len(members)}")
+        self.params = [dict(params, **member) for member in members]
+        for member in self.params:
+            unknown = set(member) - set(MEMBER_PARAMS) - {'radius'}
+            if unknown:
+                raise ValueError(f"Unknown ensemble parameters: {sorted(unknown)}")
+
+        # Members step together, so they share the neighbourhood radius
+        radii = {member.get('radius', 1) for member in self.params}
+        if len(radii) != 1:
+            raise ValueError(f"Ensemble members must share one radius, got {sorted(radii)}")
+        self.radius = radii.pop()
+
+        # Same per-member draws as Forest: terrain first, then one wind
+        # rotation per step
+        self.rngs = [np.random.default_rng(seed) for seed in self.seeds]
+        self.winds = [Wind(member['wind']).normalize() for member in self.params]
+        self.wind_change = [member['wind_change'] for member in self.params]
+
+        humidity = []
+        grid = []
+        for rng, seed, member in zip(self.rngs, self.seeds, self.params):
+            member_humidity, member_grid = initial_terrain(rng, seed, self.shape[1:], member['tree_density'],
+                                                           member['water_threshold'], terrain_cache)
+            grid.append(member_grid)
+            humidity.append(member_humidity)
+        self.grid = np.stack(grid)
+        self.humidity = np.stack(humidity).astype(np.float32)
+        self.delta_humidity = np.zeros(self.shape, dtype=np.float16)
+
+        self.growth_prob = self.member_array('growth_prob')
+        self.spread_prob = self.member_array('spread_prob')
+        self.lightning_prob = self.member_array('lightning_prob')
+        self.humidity_change = self.member_array('humidity_change')
+        self.humidity_change_fire = self.member_array('humidity_change_fire')
+
+        self.step = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def member_array(self, name: str) -> np.ndarray:
+        return np.array([member[name] for member in self.params], dtype=np.float32).reshape(-1, 1, 1)
+
+    def wind_array(self) -> np.ndarray:
+        return np.array([(wind.x, wind.y) for wind in self.winds], dtype=np.float32)
+
+    def counts(self) -> np.ndarray:
+        # One bincount over all members, member k owns bins [k * T, (k + 1) * T)
+        types = len(Type)
+        offsets = (np.arange(self.count, dtype=np.intp) * types).reshape(-1, 1, 1)
+        return np.bincount((self.grid + offsets).ravel(), minlength=self.count * types).reshape(self.count, types)
+
+    def next_gen(self) -> None:
+        winds = self.wind_array()
+        chunk = max(1, CHUNK_CELLS // (self.height * self.width))
+        for start in range(0, self.count, chunk):
+            members = slice(start, start + chunk)
+            self.grid[members] = next_state(
+                self.grid[members],
+                self.humidity[members],
+                cell_noise(self.seeds[members], self.step, self.height, self.width),
+                winds[members],
+                self.delta_humidity[members],
+                self.growth_prob[members],
+                self.spread_prob[members],
+                self.lightning_prob[members],
+                self.humidity_change[members],
+                self.humidity_change_fire[members],
+                self.radius
+            )
+            np.clip(self.humidity[members] + self.delta_humidity[members], 0.5, 1.5, out=self.humidity[members])
+
+        self.step += 1
+        for k, rng in enumerate(self.rngs):
+            self.winds[k] = self.winds[k].rotate(
+                (2 * rng.random() - 1) * self.wind_change[k])
+
+    def run(self, n_steps: int) -> np.ndarray:
+        # Per-member type counts after every step, shaped (K, n_steps, types)
+        history = np.zeros((self.count, n_steps, len(Type)), dtype=np.int64)
+        for i in range(n_steps):
+            self.next_gen()
+            history[:, i] = self.counts()
+        return history
@@ -1,12 +1,87 @@
-from src.simulation.types import Type
-from src.simulation.helpers import generate_cluster_map
-from src.simulation.gpu_compute import ForestComputeEngine
+from src.simulation.types import Type, TRANSITIONS
+from src.simulation.helpers import generate_cluster_map, terrain_key, load_terrain, save_terrain
+from src.simulation.history import History
+from src.simulation.backends import create_compute_engine
+from src.simulation.cpu_compute import transition_counts, step_stats
+from src.simulation.snapshot import Snapshot, Checkpointer, read_snapshot, write_snapshot
+from src.simulation.recording import Recorder
+from src.simulation.profiler import span
+from src.simulation.stats import StepStats
+from src.simulation.wind import Wind
+
+import os
+from typing import Sequence
 
 from typing_extensions import Self
 
 import numpy as np
-import pandas as pd
-import pygame
+
+# Bands of the terrain generated in parallel, results do not depend on it
+TERRAIN_WORKERS = min(os.cpu_count() or 1, 8)
+
+
+def initial_humidity(rng: np.random.Generator, shape: tuple[int, int]) -> np.ndarray:
+    base = generate_cluster_map(
+        rng,
+        shape,
+        min_clusters=15,
+        max_clusters=20,
+        sigma_range=(20, 50),
+        noise_scale=25,
+        workers=TERRAIN_WORKERS
+    )
+    return np.float32(0.5) + base
+
+
+def initial_grid(rng: np.random.Generator,
+                 shape: tuple[int, int],
+                 humidity: np.ndarray,
+                 tree_density: float,
+                 water_threshold: float) -> np.ndarray:
+    cluster = generate_cluster_map(
+        rng,
+        shape,
+        min_clusters=15,
+        max_clusters=20,
+        sigma_range=(20, 50),
+        noise_scale=50,
+        workers=TERRAIN_WORKERS
+    )
+    trees = (
+            (cluster + rng.standard_normal(size=shape, dtype=np.float32) * np.float32(0.1))
+        >= 1 - tree_density
+    )
+
+    grid = np.zeros(shape, dtype=np.uint8)
+    grid[trees] = Type.TREE
+    grid[humidity >= water_threshold] = Type.WATER
+    return grid
+
+
+def initial_terrain(rng: np.random.Generator,
+                    seed: int,
+                    shape: tuple[int, int],
+                    tree_density: float,
+                    water_threshold: float,
+                    cache_dir: str = None) -> tuple[np.ndarray, np.ndarray]:
+    # Humidity and grid for a seed. With a cache directory the maps are
+    # stored under a key of everything they depend on, and a hit also
+    # restores the generator to where generating them would have left it.
+    if cache_dir is None:
+        humidity = initial_humidity(rng, shape)
+        return humidity, initial_grid(rng, shape, humidity, tree_density, water_threshold)
+
+    key = terrain_key(seed, shape, tree_density=tree_density, water_threshold=water_threshold)
+    cached = load_terrain(cache_dir, key)
+    if cached is not None:
+        humidity, grid, rng_state = cached
+        rng.bit_generator.state = rng_state
+        return humidity, grid
+
+    humidity = initial_humidity(rng, shape)
+    grid = initial_grid(rng, shape, humidity, tree_density, water_threshold)
+    save_terrain(cache_dir, key, humidity, grid, rng.bit_generator.state)
+    return humidity, grid
 
 
 class Forest:
@@ -19,16 +94,55 @@ class Forest:
             humidity_change: float,
             humidity_change_fire: float,
             water_threshold: float,
-            wind: pygame.Vector2,
+            wind: Sequence[float],
             wind_change: float,
             radius: int,
             # Parametry GPU
             size: int = 256,
+            width: int = None,
+            height: int = None,
             shader_path: str = "src/simulation/shader.hlsl",
+            backend: str = "auto",
+            double_buffered: bool = False,
+            resident: bool = False,
+            sparse: bool = False,
+            # Worker processes of the partitioned backend: a number of
+            # horizontal strips or (rows, columns) of blocks, one per core
+            # when None
+            workers: int | Sequence[int] = None,
+            # History, streamed to history_path when set. The file of an
+            # earlier run or of the run before simulation_reset is kept, the
+            # next one goes to name.1.ext, name.2.ext and so on.
+            history_limit: int = None,
+            history_path: str = None,
+            # Directory of generated terrain, keyed by seed
+            terrain_cache: str = None,
+            # Auto-checkpointing
+            checkpoint_every: int = None,
+            checkpoint_path: str = "checkpoints",
+            # Recording for replay
+            record_path: str = None,
+            record_keyframe_every: int = 100,
             # RNG seed
-            seed: int = None
+            seed: int = None,
+            # State to continue from instead of generating a world
+            snapshot: Snapshot = None
     ) -> None:
-        self.size = size
+        # size is the shorthand for a square world
+        self.width = width or size
+        self.height = height or size
+        self.shape = (self.height, self.width)
+        self.shader_path = shader_path
+        self.backend = backend
+        self.double_buffered = double_buffered
+        # Sparse stepping keeps its state in the engine's active tiles, the
+        # partitioned backend in memory shared by its workers
+        self.sparse = sparse
+        self.resident = resident or sparse or backend == "partitioned"
+        self.workers = workers
+        self.history_limit = history_limit
+        self.history_path = history_path
+        self.terrain_cache = terrain_cache
         self.tree_density = tree_density
         self.lightning_prob = lightning_prob
         self.growth_prob = growth_prob
@@ -37,106 +151,313 @@ class Forest:
         self.humidity_change_fire = humidity_change_fire
         self.water_threshold = water_threshold
 
-        self.wind = pygame.Vector2(wind).normalize()
+        self.wind = Wind(wind).normalize()
         self.wind_change = wind_change
         self.radius = radius
-        self.rng = np.random.default_rng(seed)
-
-        self.humidity = self.initialize_humidity()
-        self.grid = self.initialize_grid()
+        if snapshot is None:
+            self.initialize_state(seed)
+        else:
+            self.restore_state(snapshot, seed)
 
-        self.history = pd.DataFrame(
-            columns=['step', 'burning', 'tree', 'empty'])
-
-        self.compute_engine = ForestComputeEngine(
+        self.compute_engine = create_compute_engine(
+            self.backend,
             shader_path=shader_path,
-            size=self.size,
+            width=self.width,
+            height=self.height,
             growth_prob=self.growth_prob,
             spread_prob=self.spread_prob,
             lightning_prob=self.lightning_prob,
             humidity_change=self.humidity_change,
-            humidity_change_fire=self.humidity_change_fire
+            humidity_change_fire=self.humidity_change_fire,
+            seed=self.seed,
+            double_buffered=self.double_buffered,
+            resident=self.resident,
+            sparse=self.sparse,
+            workers=self.workers,
+            radius=self.radius
         )
+        # With double buffering the next generation is submitted at the end
+        # of next_gen, so it runs while the caller renders the current one
+        self.prefetched = False
 
-    def initialize_humidity(self):
-        base = generate_cluster_map(
-            self.rng,
-            self.size,
-            min_clusters=15,
-            max_clusters=20,
-            sigma_range=(20, 50),
-            noise_scale=25
-        )
-        return 0.5 + base
+        # In resident mode grid and humidity live in the engine, the host
+        # copies are only refreshed by sync_to_host
+        self.host_stale = False
+        if self.resident:
+            self.compute_engine.upload_state(self.grid, self.humidity)
+        if snapshot is not None:
+            self.compute_engine.upload_delta(snapshot.delta_humidity)
+
+        self.checkpointer = None
+        if checkpoint_every:
+            self.checkpointer = Checkpointer(checkpoint_path, checkpoint_every)
+
+        self.recorder = None
+        if record_path is not None:
+            self.recorder = Recorder(record_path, self.shape, record_keyframe_every)
+            self.record()
+
+    def initialize_state(self, seed: int = None) -> None:
+        # Both the host generator and the engine's per-cell generator are
+        # derived from the seed, so a run is reproducible from it alone
+        if seed is None:
+            seed = int(np.random.SeedSequence().generate_state(1, np.uint64)[0])
+        self.seed = seed
+        self.step = 0
+        self.rng = np.random.default_rng(seed)
 
-    def initialize_grid(self) -> np.ndarray:
-        cluster = generate_cluster_map(
+        self.humidity, self.grid = initial_terrain(
             self.rng,
-            self.size,
-            min_clusters=15,
-            max_clusters=20,
-            sigma_range=(20, 50),
-            noise_scale=50
+            self.seed,
+            self.shape,
+            self.tree_density,
+            self.water_threshold,
+            self.terrain_cache
         )
-        trees = (
-                (cluster + self.rng.normal(0, 0.1, size=(self.size, self.size)))
-            >= 1 - self.tree_density
+
+        self.history = History(limit=self.history_limit, path=self.history_path)
+        self.stats: StepStats | None = None
+
+    def restore_state(self, snapshot: Snapshot, seed: int = None) -> None:
+        # The snapshot arrays are used as they are, memory-mapped ones stay
+        # lazy: the host state is replaced by every step, never written to.
+        # A different seed continues from the same moment with new draws.
+        if seed is None:
+            self.seed = snapshot.seed
+            self.rng = np.random.default_rng(self.seed)
+            self.rng.bit_generator.state = snapshot.rng_state
+        else:
+            self.seed = seed
+            self.rng = np.random.default_rng(seed)
+        self.step = snapshot.step
+        self.wind = Wind(snapshot.wind)
+        self.grid = snapshot.grid
+        self.humidity = snapshot.humidity
+
+        self.history = History(limit=self.history_limit, path=self.history_path)
+        self.stats = None
+
+    def parameters(self) -> dict:
+        # Keyword arguments that rebuild this forest, without its state
+        return {
+            'tree_density': self.tree_density,
+            'lightning_prob': self.lightning_prob,
+            'growth_prob': self.growth_prob,
+            'spread_prob': self.spread_prob,
+            'humidity_change': self.humidity_change,
+            'humidity_change_fire': self.humidity_change_fire,
+            'water_threshold': self.water_threshold,
+            'wind': list(self.wind),
+            'wind_change': self.wind_change,
+            'radius': self.radius,
+            'width': self.width,
+            'height': self.height,
+            'shader_path': self.shader_path,
+            'backend': self.backend,
+            'double_buffered': self.double_buffered,
+            'resident': self.resident,
+            'sparse': self.sparse,
+            'workers': self.workers,
+            'history_limit': self.history_limit,
+        }
+
+    def snapshot(self) -> Snapshot:
+        self.sync_to_host()
+        # The host state may be mapped from the snapshot this forest was
+        # loaded from
+        return Snapshot(
+            grid=np.array(self.grid, dtype=np.uint8),
+            humidity=np.array(self.humidity, dtype=np.float32),
+            delta_humidity=self.compute_engine.download_delta(),
+            step=self.step,
+            seed=self.seed,
+            wind=(self.wind.x, self.wind.y),
+            rng_state=self.rng.bit_generator.state,
+            params=self.parameters()
         )
 
-        grid = np.zeros((self.size, self.size), dtype=np.uint8)
-        grid[trees] = Type.TREE
-        grid[self.humidity >= self.water_threshold] = Type.WATER
-        return grid
-
-    def simulation_reset(self) -> Self:
-        return Forest(tree_density=self.tree_density,
-                      lightning_prob=self.lightning_prob,
-                      growth_prob=self.growth_prob,
-                      spread_prob=self.spread_prob,
-                      humidity_change=self.humidity_change,
-                      humidity_change_fire=self.humidity_change_fire,
-                      water_threshold=self.water_threshold,
-                      wind=self.wind,
-                      wind_change=self.wind_change,
-                      radius=self.radius)
+    def save_snapshot(self, path: str) -> None:
+        write_snapshot(path, self.snapshot())
 
-    def compute_next_gen(self):
-        self.compute_engine.update_humidity(self.humidity)
-        self.compute_engine.update_grid(self.grid)
+    @classmethod
+    def load_snapshot(cls, path: str, mmap: bool = True, **overrides) -> Self:
+        # overrides replace stored parameters, e.g. backend or history_path
+        snapshot = read_snapshot(path, mmap=mmap)
+        return cls(**dict(snapshot.params, **overrides), snapshot=snapshot)
+
+    def fork(self, n: int, seeds: Sequence[int] = None, **overrides) -> list[Self]:
+        # n copies continuing from the current moment, each with its own
+        # seed so their fires diverge. They share one read-only copy of the
+        # state (or the mapped files of a loaded snapshot).
+        if seeds is None:
+            sequence = np.random.SeedSequence([self.seed, self.step])
+            seeds = [int(seed) for seed in sequence.generate_state(n, np.uint64)]
+        if len(seeds) != n:
+            raise ValueError(f"Expected {n} seeds, got {len(seeds)}")
+
+        base = self.snapshot()
+        for array in (base.grid, base.humidity, base.delta_humidity):
+            array.flags.writeable = False
+        params = dict(base.params, **overrides)
+        return [type(self)(**params, snapshot=base, seed=seed) for seed in seeds]
+
+    def checkpoint(self) -> None:
+        # The state is copied to the host here, the files are written by
+        # the checkpointer's thread while the simulation continues
+        if self.checkpointer is not None and self.checkpointer.due(self.step):
+            with span('checkpoint'):
+                self.checkpointer.submit(self.snapshot())
+
+    def record(self) -> None:
+        # Recording needs every frame on the host, the encoding and writing
+        # happen on the recorder's thread
+        if self.recorder is not None:
+            self.sync_to_host()
+            with span('record'):
+                self.recorder.record(self.step, self.grid, self.humidity, self.wind)
+
+    def close(self) -> None:
+        self.history.close()
+        if self.checkpointer is not None:
+            self.checkpointer.close()
+        if self.recorder is not None:
+            self.recorder.close()
+        # Only the partitioned engine holds processes and shared memory
+        if hasattr(self.compute_engine, 'close'):
+            self.compute_engine.close()
 
-        noise = self.rng.uniform(0, 1, size=(self.size**2))
-        self.compute_engine.update_noise(noise)
+    def simulation_reset(self, seed: int = None) -> Self:
+        # Regenerates the world in place with a new seed, the compute engine
+        # keeps its compiled shaders, textures and buffers
+        self.history.close()
+        self.initialize_state(seed)
+        if self.checkpointer is not None:
+            self.checkpointer.next_step = self.checkpointer.every
 
+        self.compute_engine.reset(self.seed)
+        self.prefetched = False
+        self.host_stale = False
+        if self.resident:
+            self.compute_engine.upload_state(self.grid, self.humidity)
+        if self.recorder is not None:
+            self.recorder.keyframe()
+            self.record()
+        return self
+
+    def submit_next_gen(self) -> None:
+        with span('update_humidity'):
+            self.compute_engine.update_humidity(self.humidity)
+        with span('update_grid'):
+            self.compute_engine.update_grid(self.grid)
+        with span('update_step'):
+            self.compute_engine.update_step(self.step)
+        with span('update_wind'):
+            self.compute_engine.update_wind(self.wind.x, self.wind.y)
+
+        with span('dispatch'):
+            self.compute_engine.dispatch()
+
+    def submit_resident_gen(self) -> None:
+        self.compute_engine.update_step(self.step)
         self.compute_engine.update_wind(self.wind.x, self.wind.y)
 
-        self.compute_engine.dispatch()
+        with span('step'):
+            self.compute_engine.step()
+        self.host_stale = True
 
-        new_grid, delta_humidity = self.compute_engine.read_results()
-        return new_grid, delta_humidity
+    def sync_to_host(self) -> None:
+        if self.host_stale:
+            with span('download_state'):
+                self.grid, self.humidity = self.compute_engine.download_state()
+            self.host_stale = False
 
-    def next_gen(self, current_frame: int = None) -> None:
-        new_grid, delta_humidity = self.compute_next_gen()
+    def read_stats(self, previous: np.ndarray) -> StepStats:
+        # Resident engines reduce the statistics where the state lives, so
+        # only a few dozen bytes come back instead of the grid
+        if self.resident:
+            return self.compute_engine.read_stats()
+        return step_stats(previous, self.grid)
 
-        self.grid = new_grid
-        self.humidity = np.clip(
-            self.humidity + delta_humidity,
-            0.5,
-            1.5
-        )
+    def compute_next_gen(self):
+        if self.prefetched:
+            self.prefetched = False
+        else:
+            self.submit_next_gen()
+
+        with span('read_results'):
+            new_grid, delta_humidity = self.compute_engine.read_results()
+        return new_grid, delta_humidity
 
-        burning_count = np.count_nonzero(self.grid == Type.BURNING)
-        tree_count = np.count_nonzero(self.grid == Type.TREE)
-        empty_count = np.count_nonzero(self.grid == Type.EMPTY)
+    def advance_gen(self) -> None:
+        # grid and humidity are replaced by every step, never written in
+        # place, so arrays taken from the forest keep their values. Engines
+        # hand over grids the forest owns; the humidity delta is consumed
+        # here before the next dispatch.
+        if self.resident:
+            self.submit_resident_gen()
+        else:
+            new_grid, delta_humidity = self.compute_next_gen()
 
-        if current_frame is not None:
-            new_row = pd.DataFrame({
-                'step': [current_frame],
-                'burning': [burning_count],
-                'tree': [tree_count],
-                'empty': [empty_count]
-            })
-            self.history = pd.concat(
-                [self.history, new_row], ignore_index=True)
+            self.grid = new_grid
+            with span('humidity_clip'):
+                self.humidity = np.clip(
+                    self.humidity + delta_humidity,
+                    0.5,
+                    1.5
+                )
 
+        self.step += 1
         self.wind = self.wind.rotate(
             (2 * self.rng.random() - 1) * self.wind_change)
+
+    def next_gen(self, current_frame: int = None) -> None:
+        with span('next_gen'):
+            previous = self.grid
+            self.advance_gen()
+
+            if current_frame is not None:
+                with span('history'):
+                    self.stats = self.read_stats(previous)
+                    self.history.append(current_frame, self.stats.counts)
+            self.checkpoint()
+            self.record()
+
+            if self.double_buffered and not self.resident:
+                self.submit_next_gen()
+                self.prefetched = True
+
+    def advance(self, n_steps: int, counters: bool = False) -> dict[str, int] | None:
+        # Fast-forward n_steps generations without recording history. The
+        # result equals n_steps calls of next_gen: the wind sequence is drawn
+        # from the same generator up front and the engine fuses the steps.
+        totals = np.zeros(len(TRANSITIONS), dtype=np.int64)
+
+        if self.prefetched and n_steps > 0:
+            previous = self.grid
+            self.advance_gen()
+            totals += transition_counts(previous, self.grid)
+            n_steps -= 1
+
+        if n_steps > 0:
+            winds = np.empty((n_steps, 2), dtype=np.float32)
+            for i in range(n_steps):
+                winds[i] = (self.wind.x, self.wind.y)
+                self.wind = self.wind.rotate(
+                    (2 * self.rng.random() - 1) * self.wind_change)
+
+            if not self.resident:
+                self.compute_engine.upload_state(self.grid, self.humidity)
+            with span('advance'):
+                block_totals = self.compute_engine.advance(self.step, winds, counters)
+            if counters:
+                totals += block_totals
+            self.step += n_steps
+            self.host_stale = True
+            if not self.resident:
+                self.sync_to_host()
+        self.checkpoint()
+        self.record()
+
+        if not counters:
+            return None
+        return dict(zip(TRANSITIONS, totals.tolist()))
@@ -1,97 +1,403 @@
+import hashlib
+import os
 import struct
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import Any
 
 import numpy as np
 import compushady
 import compushady.formats
-from compushady import HEAP_READBACK, Buffer, Texture2D, HEAP_UPLOAD, Compute
+from compushady import HEAP_READBACK, Buffer, Texture2D, HEAP_UPLOAD, Compute, get_backend
 from compushady.shaders import hlsl
 from numpy import ndarray
 
+from src.simulation.philox import seed_key
+from src.simulation.stats import NO_FIRE, STATS_BOX, STATS_SIZE, StepStats
+from src.simulation.types import TRANSITIONS
+
+SLOTS = 2
+
+# Generations fused into a single dispatch by advance
+BLOCK_STEPS = 4
+
+GROUP_SIZE = 16
+
+# main keeps a (16 + 2 * radius)^2 tile and two 16 x (16 + 2 * radius) column
+# summaries in groupshared memory, 32 KB allows up to radius 16
+MAX_RADIUS = 16
+
+
+# Compiled blobs are cached on disk, keyed by backend, entry point, defines
+# and source, so only the first run after a shader edit pays for dxc
+SHADER_CACHE = os.environ.get(
+    "FOREST_SHADER_CACHE",
+    os.path.join(os.path.expanduser("~"), ".cache", "forest-fire", "shaders")
+)
+
+
+def compile_shader(source: str, entry_point: str = "main", **defines) -> bytes:
+    preamble = "".join(f"#define {name} {value}\n" for name, value in defines.items())
+    source = preamble + source
+
+    backend = get_backend()
+    key = "\0".join((backend.__name__, str(backend.get_shader_binary_type()), entry_point, source))
+    path = os.path.join(SHADER_CACHE, hashlib.sha256(key.encode("utf-8")).hexdigest() + ".bin")
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except OSError:
+        pass
+
+    blob = hlsl.compile(source, entry_point)
+    # Metal returns a compiled library object rather than bytes
+    if isinstance(blob, bytes):
+        try:
+            os.makedirs(SHADER_CACHE, exist_ok=True)
+            with open(path + f".{os.getpid()}.tmp", "wb") as f:
+                f.write(blob)
+            os.replace(path + f".{os.getpid()}.tmp", path)
+        except OSError:
+            pass
+    return blob
+
+
+class StagedTexture:
+    # Texture with a host mirror laid out with the texture row pitch, so NumPy
+    # arrays go to and from the staging buffer through the buffer protocol
+    def __init__(self, width: int, height: int, format: int, dtype, heap_type: int) -> None:
+        self.width = width
+        self.height = height
+        self.texture = Texture2D(width, height, format)
+        self.buffer = Buffer(self.texture.size, heap_type)
+
+        dtype = np.dtype(dtype)
+        pitch = self.texture.row_pitch // dtype.itemsize
+        self.hosts = [np.zeros((height, pitch), dtype=dtype) for _ in range(SLOTS)]
+
+    def view(self, slot: int = 0) -> np.ndarray:
+        return self.hosts[slot][:, :self.width]
+
+    def write(self, array: np.ndarray, slot: int = 0) -> None:
+        np.copyto(self.view(slot), array.reshape(self.height, self.width), casting='unsafe')
+
+    def upload(self, slot: int = 0, texture: Texture2D = None) -> None:
+        self.buffer.upload(self.hosts[slot])
+        self.buffer.copy_to(texture or self.texture)
+
+    def readback(self, slot: int = 0, texture: Texture2D = None) -> np.ndarray:
+        (texture or self.texture).copy_to(self.buffer)
+        self.buffer.readback(self.hosts[slot])
+        return self.view(slot)
+
 
 class ForestComputeEngine:
     def __init__(self,
                  shader_path: str,
-                 size: int,
+                 width: int,
+                 height: int,
                  growth_prob: float,
                  spread_prob: float,
                  lightning_prob: float,
                  humidity_change: float,
-                 humidity_change_fire: float) -> None:
+                 humidity_change_fire: float,
+                 seed: int,
+                 double_buffered: bool = False,
+                 resident: bool = False,
+                 radius: int = 1) -> None:
 
-        self.size = size
+        self.width = width
+        self.height = height
+        if not 1 <= radius <= MAX_RADIUS:
+            raise ValueError(f"The GPU engine supports radius 1 to {MAX_RADIUS}, got {radius}")
+        self.radius = radius
+        self.groups = (-(-width // GROUP_SIZE), -(-height // GROUP_SIZE), 1)
 
         with open(shader_path) as f:
-            self.shader = hlsl.compile(f.read())
-
-        self.humidity_texture = Texture2D(size, size, compushady.formats.R32_FLOAT)
-        self.humidity_buffer = Buffer(self.humidity_texture.size, HEAP_UPLOAD)
-
-        self.humidity_out = Texture2D(size, size, compushady.formats.R16_FLOAT)
-        self.humidity_out_buffer = Buffer(self.humidity_out.size, HEAP_READBACK)
+            self.shader_source = f.read()
+        self.shader = self.compile("main")
 
-        self.source = Texture2D(size, size, compushady.formats.R8_UINT)
-        self.source_buffer = Buffer(self.source.size, HEAP_UPLOAD)
+        self.humidity = StagedTexture(width, height, compushady.formats.R32_FLOAT, np.float32, HEAP_UPLOAD)
+        self.humidity_out = StagedTexture(width, height, compushady.formats.R16_FLOAT, np.float16, HEAP_READBACK)
+        self.source = StagedTexture(width, height, compushady.formats.R8_UINT, np.uint8, HEAP_UPLOAD)
+        self.target = StagedTexture(width, height, compushady.formats.R8_UINT, np.uint8, HEAP_READBACK)
+        self.humidity_next = StagedTexture(width, height, compushady.formats.R32_FLOAT, np.float32, HEAP_READBACK)
 
-        self.noise = Texture2D(size, size, compushady.formats.R32_FLOAT)
-        self.noise_buffer = Buffer(self.noise.size, HEAP_UPLOAD)
+        self.growth_prob = growth_prob
+        self.spread_prob = spread_prob
+        self.lightning_prob = lightning_prob
+        self.humidity_change = humidity_change
+        self.humidity_change_fire = humidity_change_fire
+        self.config = Buffer(96, HEAP_UPLOAD)
+        self.config_fast = Buffer(self.config.size)
+        self.upload_config(seed)
 
-        self.target = Texture2D(size, size, compushady.formats.R8_UINT)
-        self.target_buffer = Buffer(self.target.size, HEAP_READBACK)
-
-        config = Buffer(96, HEAP_UPLOAD)
-        self.config_fast = Buffer(config.size)
-        config.upload(
-            struct.pack(
-                'fffff',
-                growth_prob,
-                spread_prob,
-                lightning_prob,
-                humidity_change,
-                humidity_change_fire
-            )
-        )
-        config.copy_to(self.config_fast)
+        # Zeros for resetting the sticky humidity deltas
+        self.zeros = Buffer(self.humidity_out.texture.size, HEAP_UPLOAD)
+        self.zeros.upload(bytes(self.zeros.size))
 
         self.wind_config = Buffer(64, HEAP_UPLOAD)
         self.wind_buffer = Buffer(self.wind_config.size)
+        self.winds = [(0.0, 0.0)] * SLOTS
+        self.steps = [0] * SLOTS
 
         self.compute = Compute(
             self.shader,
             cbv=[self.config_fast, self.wind_buffer],
-            srv=[self.source, self.humidity_texture, self.noise],
-            uav=[self.target, self.humidity_out]
+            srv=[self.source.texture, self.humidity.texture],
+            uav=[self.target.texture, self.humidity_out.texture]
         )
 
+        # In resident mode grid and humidity never leave the device between
+        # steps: (source, target) and (humidity, humidity_next) are used as
+        # ping-pong pairs and `front` is the index holding the current state
+        self.resident = resident
+        self.front = 0
+        self.grids = [self.source.texture, self.target.texture]
+        self.humidities = [self.humidity.texture, self.humidity_next.texture]
+        self.resident_computes = None
+        if self.resident:
+            self.build_resident()
+        self.fused_computes = None
+
+        # Host staging is split into two slots: while the device works on one
+        # slot the caller can already fill the other. With double buffering
+        # all device work runs on a single worker thread (compushady releases
+        # the GIL while it waits for the queue).
+        self.slot = 0
+        self.executor = ThreadPoolExecutor(max_workers=1) if double_buffered else None
+        self.pending: Future | None = None
+        self.results = None
+
+    def upload_config(self, seed: int) -> None:
+        self.config.upload(
+            struct.pack(
+                'fffffII',
+                self.growth_prob,
+                self.spread_prob,
+                self.lightning_prob,
+                self.humidity_change,
+                self.humidity_change_fire,
+                *seed_key(seed)
+            )
+        )
+        self.config.copy_to(self.config_fast)
+
+    def reset(self, seed: int) -> None:
+        # Start over with a new seed, keeping shaders, textures and buffers
+        self.wait()
+        self.results = None
+        self.upload_config(seed)
+        self.zeros.copy_to(self.humidity_out.texture)
+        if self.fused_computes is not None:
+            self.zeros.copy_to(self.delta_spare)
+
     def update_grid(self, grid: np.ndarray) -> None:
-        self.source_buffer.upload(bytes(list(grid.flatten())))
-        self.source_buffer.copy_to(self.source)
+        self.source.write(grid, self.slot)
 
     def update_humidity(self, humidity: np.ndarray) -> None:
-        flat = b''.join([struct.pack('f', float(x)) for x in humidity.flatten()])
-        self.humidity_buffer.upload(flat)
-        self.humidity_buffer.copy_to(self.humidity_texture)
+        self.humidity.write(humidity, self.slot)
 
-    def update_noise(self, noise: np.ndarray) -> None:
-        flat = b''.join([struct.pack('f', float(x)) for x in noise])
-        self.noise_buffer.upload(flat)
-        self.noise_buffer.copy_to(self.noise)
+    def update_step(self, step: int) -> None:
+        self.steps[self.slot] = step
 
     def update_wind(self, wind_x: float, wind_y: float) -> None:
-        self.wind_config.upload(struct.pack('ff', wind_x, wind_y))
+        self.winds[self.slot] = (wind_x, wind_y)
+
+    def upload_state(self, grid: np.ndarray, humidity: np.ndarray) -> None:
+        self.wait()
+        self.source.write(grid, self.slot)
+        self.source.upload(self.slot, self.grids[self.front])
+        self.humidity.write(humidity, self.slot)
+        self.humidity.upload(self.slot, self.humidities[self.front])
+
+    def download_state(self) -> tuple[np.ndarray, np.ndarray]:
+        self.wait()
+        grid = self.target.readback(self.slot, self.grids[self.front])
+        humidity = self.humidity_next.readback(self.slot, self.humidities[self.front])
+        return grid.copy(), humidity.copy()
+
+    def read_stats(self) -> StepStats:
+        # Statistics of the last resident step, a few dozen bytes read back
+        self.wait()
+        values = np.zeros(STATS_SIZE, dtype=np.uint32)
+        self.stats.copy_to(self.stats_readback)
+        self.stats_readback.readback(values)
+        return StepStats.from_buffer(values)
+
+    def download_delta(self) -> np.ndarray:
+        self.wait()
+        return self.humidity_out.readback(self.slot).copy()
+
+    def upload_delta(self, delta: np.ndarray) -> None:
+        # Only needed when restoring a snapshot, the staging buffer is not kept
+        self.wait()
+        texture = self.humidity_out.texture
+        host = np.zeros((self.height, texture.row_pitch // 2), dtype=np.float16)
+        np.copyto(host[:, :self.width], delta.reshape(self.height, self.width), casting='unsafe')
+        staging = Buffer(texture.size, HEAP_UPLOAD)
+        staging.upload(host)
+        staging.copy_to(texture)
+
+    def upload_wind(self, slot: int) -> None:
+        self.wind_config.upload(struct.pack('ffI', *self.winds[slot], self.steps[slot]))
         self.wind_config.copy_to(self.wind_buffer)
 
-    def dispatch(self) -> None:
-        self.compute.dispatch(self.size // 16, self.size // 16, 1)
+    def run_resident(self, slot: int) -> None:
+        self.upload_wind(slot)
 
-    def read_results(self) -> tuple[ndarray[tuple[int, int], Any], ndarray[tuple[int, int], Any]]:
-        self.target.copy_to(self.target_buffer)
-        new_grid = np.array(list(self.target_buffer.readback())).reshape(self.size, self.size)
+        step, apply = self.resident_computes[self.front]
+        step.dispatch(*self.groups)
+        self.stats_reset.copy_to(self.stats)
+        apply.dispatch(*self.groups)
+        self.front = 1 - self.front
+
+    def step(self) -> None:
+        self.wait()
+        if self.executor is None:
+            self.run_resident(self.slot)
+        else:
+            self.pending = self.executor.submit(self.run_resident, self.slot)
+        self.slot = (self.slot + 1) % SLOTS
+
+    def compile(self, entry_point: str, **defines) -> bytes:
+        return compile_shader(self.shader_source, entry_point, WIDTH=self.width, HEIGHT=self.height,
+                              RADIUS=self.radius, **defines)
+
+    def build_resident(self) -> None:
+        # Also used by non-resident engines for wide-radius advance, which
+        # steps the ping-pong pairs one generation at a time
+        apply_shader = self.compile("apply_humidity")
+        grids = self.grids
+        humidities = self.humidities
+
+        # apply_humidity also reduces the step's statistics into this
+        # small buffer, so history does not need the grid on the host
+        initial = np.zeros(STATS_SIZE, dtype=np.uint32)
+        initial[STATS_BOX:] = NO_FIRE
+        self.stats_reset = Buffer(4 * STATS_SIZE, HEAP_UPLOAD)
+        self.stats_reset.upload(initial)
+        self.stats = Buffer(self.stats_reset.size, stride=4)
+        self.stats_readback = Buffer(self.stats_reset.size, HEAP_READBACK)
+        self.resident_computes = [
+            (
+                Compute(
+                    self.shader,
+                    cbv=[self.config_fast, self.wind_buffer],
+                    srv=[grids[k], humidities[k]],
+                    uav=[grids[1 - k], self.humidity_out.texture]
+                ),
+                Compute(
+                    apply_shader,
+                    srv=[grids[k], humidities[k]],
+                    uav=[grids[1 - k], self.humidity_out.texture, humidities[1 - k], self.stats]
+                )
+            )
+            for k in range(2)
+        ]
+
+    def build_fused(self) -> None:
+        shader = self.compile("main", FUSED=1, BLOCK_STEPS=BLOCK_STEPS)
+
+        # The sticky humidity delta is read from the halo of other groups, so
+        # it needs a ping-pong partner as well
+        self.delta_spare = Texture2D(self.width, self.height, compushady.formats.R16_FLOAT)
+        deltas = [self.humidity_out.texture, self.delta_spare]
+
+        self.block_config = Buffer(64, HEAP_UPLOAD)
+        self.block_buffer = Buffer(self.block_config.size)
+        self.block_winds_upload = Buffer(8 * BLOCK_STEPS, HEAP_UPLOAD)
+        self.block_winds = Buffer(self.block_winds_upload.size, stride=8)
 
-        self.humidity_out.copy_to(self.humidity_out_buffer)
-        delta_humidity = np.frombuffer(
-            self.humidity_out_buffer.readback(),
-            dtype=np.float16
-        ).reshape(self.size, self.size)
+        self.counters_upload = Buffer(4 * len(TRANSITIONS), HEAP_UPLOAD)
+        self.counters = Buffer(self.counters_upload.size, stride=4)
+        self.counters_readback = Buffer(self.counters_upload.size, HEAP_READBACK)
 
-        return new_grid, delta_humidity
+        self.fused_computes = [
+            [
+                Compute(
+                    shader,
+                    cbv=[self.config_fast, self.block_buffer],
+                    srv=[self.grids[k], self.humidities[k], deltas[d], self.block_winds],
+                    uav=[self.grids[1 - k], self.humidities[1 - k], deltas[1 - d], self.counters]
+                )
+                for d in range(2)
+            ]
+            for k in range(2)
+        ]
+
+    def advance(self, base_step: int, winds: np.ndarray, counters: bool = False) -> np.ndarray | None:
+        self.wait()
+        if self.radius != 1:
+            return self.advance_steps(base_step, winds, counters)
+        if self.fused_computes is None:
+            self.build_fused()
+
+        self.counters_upload.upload(np.zeros(len(TRANSITIONS), dtype=np.uint32))
+        self.counters_upload.copy_to(self.counters)
+
+        delta_front = 0
+        for start in range(0, len(winds), BLOCK_STEPS):
+            block = np.ascontiguousarray(winds[start:start + BLOCK_STEPS], dtype=np.float32)
+            self.block_winds_upload.upload(block)
+            self.block_winds_upload.copy_to(self.block_winds)
+            self.block_config.upload(struct.pack('II', base_step + start, len(block)))
+            self.block_config.copy_to(self.block_buffer)
+
+            self.fused_computes[self.front][delta_front].dispatch(*self.groups)
+            self.front = 1 - self.front
+            delta_front = 1 - delta_front
+
+        if delta_front:
+            self.delta_spare.copy_to(self.humidity_out.texture)
+
+        if not counters:
+            return None
+        totals = np.zeros(len(TRANSITIONS), dtype=np.uint32)
+        self.counters.copy_to(self.counters_readback)
+        self.counters_readback.readback(totals)
+        return totals.astype(np.int64)
+
+    def advance_steps(self, base_step: int, winds: np.ndarray, counters: bool) -> np.ndarray | None:
+        # The fused kernel's halo only covers radius 1, wider neighbourhoods
+        # take one resident step per generation
+        if self.resident_computes is None:
+            self.build_resident()
+        totals = np.zeros(len(TRANSITIONS), dtype=np.int64)
+        for i, wind in enumerate(np.asarray(winds, dtype=np.float32)):
+            self.winds[self.slot] = (float(wind[0]), float(wind[1]))
+            self.steps[self.slot] = base_step + i
+            self.run_resident(self.slot)
+            if counters:
+                totals += self.read_stats().transitions
+        return totals if counters else None
+
+    def wait(self) -> None:
+        if self.pending is not None:
+            self.results = self.pending.result()
+            self.pending = None
+
+    def run(self, slot: int) -> tuple[ndarray[tuple[int, int], Any], ndarray[tuple[int, int], Any]]:
+        self.source.upload(slot)
+        self.humidity.upload(slot)
+        self.upload_wind(slot)
+
+        self.compute.dispatch(*self.groups)
+
+        # The grid is handed to Forest, which keeps it across steps, so it
+        # leaves the staging slot here, on the worker thread with double
+        # buffering. The delta is only read before the next dispatch.
+        return self.target.readback(slot).copy(), self.humidity_out.readback(slot)
+
+    def dispatch(self) -> None:
+        self.wait()
+        if self.executor is None:
+            self.results = self.run(self.slot)
+        else:
+            self.pending = self.executor.submit(self.run, self.slot)
+        self.slot = (self.slot + 1) % SLOTS
+
+    def read_results(self) -> tuple[ndarray[tuple[int, int], Any], ndarray[tuple[int, int], Any]]:
+        # The grid is the caller's to keep. The delta is a view into the
+        # staging slot, valid until the slot is reused two dispatches later.
+        self.wait()
+        return self.results
@@ -1,23 +1,65 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
-from scipy.ndimage import gaussian_filter
+
+# Bumped whenever generated terrain changes, so cached maps are not reused
+TERRAIN_VERSION = 2
+
+# Gaussians are evaluated within this many sigmas of their centre
+CLUSTER_EXTENT = 4
+
+# The wobble noise is made on a grid this many times coarser than its sigma
+NOISE_CELLS_PER_SIGMA = 4
+
+
+def smooth_noise(rng: np.random.Generator, height: int, width: int, sigma: float):
+    # Equivalent of gaussian_filter(rng.random((height, width)), sigma) built
+    # on a coarse grid. Filtering white noise with sigma / f on a grid f times
+    # coarser leaves f times the deviation, so it is scaled back by 1 / f.
+    # scipy takes a few hundred ms to import, only load it when terrain is made
+    from scipy.ndimage import gaussian_filter
+
+    factor = max(1.0, sigma / NOISE_CELLS_PER_SIGMA)
+    coarse_shape = (int(np.ceil(height / factor)) + 1, int(np.ceil(width / factor)) + 1)
+    coarse = gaussian_filter(rng.random(size=coarse_shape, dtype=np.float32), sigma=sigma / factor)
+    return np.float32(0.5) + (coarse - np.float32(0.5)) / np.float32(factor), factor
+
+
+def sample_bilinear(coarse: np.ndarray, factor: float, ys: np.ndarray, xs: np.ndarray) -> np.ndarray:
+    # coarse sampled at full resolution rows ys and columns xs, interpolated
+    # along y on the coarse columns first so only one full sized gather is made
+    fy = ys.astype(np.float32) / np.float32(factor)
+    fx = xs.astype(np.float32) / np.float32(factor)
+    y0 = np.minimum(fy.astype(np.intp), coarse.shape[0] - 2)
+    x0 = np.minimum(fx.astype(np.intp), coarse.shape[1] - 2)
+    wy = (fy - y0)[:, None]
+    wx = fx - x0
+
+    columns = slice(x0[0], x0[-1] + 2)
+    rows = coarse[y0, columns] * (1 - wy) + coarse[y0 + 1, columns] * wy
+    x0 = x0 - x0[0]
+    return rows[:, x0] * (1 - wx) + rows[:, x0 + 1] * wx
 
 
 def generate_cluster_map(rng: np.random.Generator,
-                         size,
+                         shape,
                          min_clusters=15,
                          max_clusters=20,
                          sigma_range=(20, 50),
-                         noise_scale=25) -> np.ndarray:
+                         noise_scale=25,
+                         workers=1) -> np.ndarray:
+
+    # shape is (height, width), or a single int for a square map
+    height, width = (shape, shape) if np.isscalar(shape) else shape
 
-    x, y = np.meshgrid(
-        np.linspace(0, size, size),
-        np.linspace(0, size, size)
-    )
     num_clusters = rng.integers(min_clusters, max_clusters + 1)
     centers = [
         (
-            rng.uniform(0, x.shape[0]),
-            rng.uniform(0, y.shape[1])
+            rng.uniform(0, width),
+            rng.uniform(0, height)
         )
         for _ in range(num_clusters)
     ]
@@ -30,17 +72,122 @@ def generate_cluster_map(rng: np.random.Generator,
         for _ in range(num_clusters)
     ]
 
-    noise_x = gaussian_filter(rng.random(size=x.shape), sigma=noise_scale)
-    noise_y = gaussian_filter(rng.random(size=y.shape), sigma=noise_scale)
+    noise_x, factor = smooth_noise(rng, height, width, noise_scale)
+    noise_y, _ = smooth_noise(rng, height, width, noise_scale)
+
+    # Cell coordinates as the old linspace(0, size, size) meshgrid had them
+    scale_x = np.float32(width / max(width - 1, 1))
+    scale_y = np.float32(height / max(height - 1, 1))
+
+    result = np.zeros((height, width), dtype=np.float32)
+
+    def fill_rows(start: int, stop: int) -> None:
+        # Each cluster only touches cells within CLUSTER_EXTENT sigmas of its
+        # centre. Rows are split between workers, so no cell is written twice
+        # concurrently and the sum order per cell is the same for any split.
+        for (cx, cy), A, (sigma_x, sigma_y) in zip(centers, amplitudes, sigmas):
+            # The wobble noise is 0.5 give or take a fraction of a cell
+            x_lo = max(0, int((cx + 0.5 - CLUSTER_EXTENT * sigma_x) / scale_x))
+            x_hi = min(width, int((cx + 0.5 + CLUSTER_EXTENT * sigma_x) / scale_x) + 2)
+            y_lo = max(start, int((cy + 0.5 - CLUSTER_EXTENT * sigma_y) / scale_y))
+            y_hi = min(stop, int((cy + 0.5 + CLUSTER_EXTENT * sigma_y) / scale_y) + 2)
+            if x_lo >= x_hi or y_lo >= y_hi:
+                continue
+
+            ys = np.arange(y_lo, y_hi)
+            xs = np.arange(x_lo, x_hi)
+            wobble_x = np.float32(cx) + sample_bilinear(noise_x, factor, ys, xs)
+            wobble_y = np.float32(cy) + sample_bilinear(noise_y, factor, ys, xs)
+            dx = xs.astype(np.float32)[None, :] * scale_x - wobble_x
+            dy = ys.astype(np.float32)[:, None] * scale_y - wobble_y
+            exponent = dx * dx * np.float32(0.5 / sigma_x ** 2) + dy * dy * np.float32(0.5 / sigma_y ** 2)
+            result[y_lo:y_hi, x_lo:x_hi] += np.float32(A) * np.exp(-exponent)
 
-    result = np.zeros_like(x, dtype=np.float32)
-    for (cx, cy), A, (sigma_x, sigma_y) in zip(centers, amplitudes, sigmas):
-        wobble_x = cx + noise_x
-        wobble_y = cy + noise_y
-        result += A * np.exp(-(
-                ((x - wobble_x)**2) / (2 * sigma_x**2)
-                + ((y - wobble_y)**2) / (2 * sigma_y**2)
-        ))
+    if workers > 1 and height >= 2 * workers:
+        bands = np.linspace(0, height, workers + 1).astype(int)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(fill_rows, bands[:-1], bands[1:]))
+    else:
+        fill_rows(0, height)
 
     result = np.clip(result / np.max(result), 0, 1)
     return result
+
+
+def terrain_key(seed: int, shape, **params) -> str:
+    description = json.dumps(
+        {'version': TERRAIN_VERSION, 'seed': int(seed), 'shape': list(shape), **params},
+        sort_keys=True
+    )
+    return hashlib.sha256(description.encode('utf-8')).hexdigest()[:32]
+
+
+def load_terrain(cache_dir: str, key: str):
+    # Returns (humidity, grid, generator state) or None when not cached
+    path = os.path.join(cache_dir, key + '.npz')
+    try:
+        with np.load(path) as data:
+            return data['humidity'], data['grid'], json.loads(str(data['rng_state']))
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def save_terrain(cache_dir: str, key: str, humidity: np.ndarray, grid: np.ndarray, rng_state: dict) -> None:
+    path = os.path.join(cache_dir, key + '.npz')
+    temporary = f"{path}.{os.getpid()}.tmp.npz"
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        np.savez(temporary, humidity=humidity, grid=grid, rng_state=np.array(json.dumps(rng_state)))
+        os.replace(temporary, path)
+    except OSError:
+        # The cache is only an accelerator
+        pass
+
+
+# Out-of-core worlds draw their clusters per block of this many cells from a
+# generator keyed by the block, so any rectangle of the world can be made on
+# its own. A rectangle cannot see the world's maximum, clusters are scaled by
+# a fixed peak instead, chosen so the value spread is close to a normalised
+# generate_cluster_map at the default density.
+CLUSTER_BLOCK = 256
+CLUSTER_PEAK = 3.2
+
+
+def cluster_field(seed: int,
+                  salt: int,
+                  y0: int,
+                  x0: int,
+                  height: int,
+                  width: int,
+                  min_clusters=15,
+                  max_clusters=20,
+                  sigma_range=(20, 50)) -> np.ndarray:
+    # Rows y0:y0 + height, columns x0:x0 + width of an unbounded cluster map.
+    # Different salts give independent maps for the same seed.
+    result = np.zeros((height, width), dtype=np.float32)
+    reach = CLUSTER_EXTENT * sigma_range[1]
+    block_y = range(int((y0 - reach) // CLUSTER_BLOCK), int((y0 + height + reach) // CLUSTER_BLOCK) + 1)
+    block_x = range(int((x0 - reach) // CLUSTER_BLOCK), int((x0 + width + reach) // CLUSTER_BLOCK) + 1)
+
+    for by in block_y:
+        for bx in block_x:
+            rng = np.random.default_rng([seed & 0xFFFFFFFFFFFFFFFF, salt, by & 0xFFFFFFFF, bx & 0xFFFFFFFF])
+            for _ in range(rng.integers(min_clusters, max_clusters + 1)):
+                cx = (bx + rng.random()) * CLUSTER_BLOCK
+                cy = (by + rng.random()) * CLUSTER_BLOCK
+                amplitude = rng.uniform(0.5, 1.0)
+                sigma_x, sigma_y = rng.uniform(*sigma_range, size=2)
+
+                x_lo = max(x0, int(cx - CLUSTER_EXTENT * sigma_x))
+                x_hi = min(x0 + width, int(cx + CLUSTER_EXTENT * sigma_x) + 2)
+                y_lo = max(y0, int(cy - CLUSTER_EXTENT * sigma_y))
+                y_hi = min(y0 + height, int(cy + CLUSTER_EXTENT * sigma_y) + 2)
+                if x_lo >= x_hi or y_lo >= y_hi:
+                    continue
+
+                dx = np.arange(x_lo, x_hi, dtype=np.float32)[None, :] - np.float32(cx)
+                dy = np.arange(y_lo, y_hi, dtype=np.float32)[:, None] - np.float32(cy)
+                exponent = dx * dx * np.float32(0.5 / sigma_x ** 2) + dy * dy * np.float32(0.5 / sigma_y ** 2)
+                result[y_lo - y0:y_hi - y0, x_lo - x0:x_hi - x0] += np.float32(amplitude) * np.exp(-exponent)
+
+    return np.clip(result / np.float32(CLUSTER_PEAK), 0, 1)
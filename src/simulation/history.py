@@ -0,0 +1,102 @@
+import os
+
+import numpy as np
+
+from src.simulation.types import Type
+
+COLUMNS = ['step'] + [t.name.lower() for t in Type]
+
+
+def free_path(path: str) -> str:
+    # path when nothing is there yet, else the first free name.N.ext
+    if not os.path.exists(path):
+        return path
+    stem, extension = os.path.splitext(path)
+    number = 1
+    while os.path.exists(f"{stem}.{number}{extension}"):
+        number += 1
+    return f"{stem}.{number}{extension}"
+
+
+class History:
+    def __init__(self,
+                 capacity: int = 1024,
+                 limit: int = None,
+                 path: str = None,
+                 flush_every: int = 10000) -> None:
+        # limit turns the store into a ring buffer keeping the last `limit`
+        # rows; path streams rows to a .csv or .parquet file every
+        # `flush_every` rows and keeps only the unflushed ones in memory.
+        # With both every row goes to the file and limit only caps the
+        # unflushed rows, so no more than `limit` are ever held. An existing
+        # file is never replaced: the rows go to the first free name.N.ext
+        # instead, so every run and every reset gets its own file.
+        self.limit = limit
+        self.path = None if path is None else free_path(path)
+        self.writer = None
+        self.ring = limit is not None and path is None
+
+        if path is not None:
+            self.flush_every = flush_every if limit is None else min(limit, flush_every)
+            capacity = self.flush_every
+        elif limit is not None:
+            capacity = limit
+        # One contiguous array per metric, data[i] is COLUMNS[i]
+        self.data = np.zeros((len(COLUMNS), capacity), dtype=np.int64)
+        self.rows = 0
+        self.total = 0
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def append(self, step: int, counts: np.ndarray) -> None:
+        capacity = self.data.shape[1]
+        if self.ring:
+            index = self.total % capacity
+        else:
+            if self.rows == capacity:
+                self.data = np.concatenate([self.data, np.zeros_like(self.data)], axis=1)
+            index = self.rows
+
+        self.data[0, index] = step
+        self.data[1:, index] = counts
+        self.rows = min(self.rows + 1, capacity) if self.ring else self.rows + 1
+        self.total += 1
+
+        if self.path is not None and self.rows >= self.flush_every:
+            self.flush()
+
+    def columns(self) -> dict[str, np.ndarray]:
+        if self.ring and self.total > self.rows:
+            start = self.total % self.rows
+            data = np.roll(self.data, -start, axis=1)
+        else:
+            data = self.data[:, :self.rows]
+        return dict(zip(COLUMNS, data))
+
+    def to_dataframe(self):
+        import pandas as pd
+        return pd.DataFrame(self.columns())
+
+    def flush(self) -> None:
+        if self.path is None or self.rows == 0:
+            return
+
+        frame = self.to_dataframe()
+        if self.path.endswith('.parquet'):
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            if self.writer is None:
+                self.writer = pq.ParquetWriter(self.path, table.schema)
+            self.writer.write_table(table)
+        else:
+            frame.to_csv(self.path, mode='a', header=not os.path.exists(self.path), index=False)
+        self.rows = 0
+        self.total = 0
+
+    def close(self) -> None:
+        self.flush()
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
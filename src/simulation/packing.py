@@ -0,0 +1,28 @@
+import numpy as np
+
+# Compact cell storage for worlds that do not fit in memory. The six cell
+# types fit in 4 bits, so two cells share a byte: the even column in the low
+# nibble, the odd column in the high one. Humidity is kept as float16, 8-bit
+# quantisation (as in recordings) would round away humidity_change steps of
+# 1e-3, float16 resolves 5e-4 to 1e-3 over [0.5, 1.5].
+HUMIDITY_DTYPE = np.float16
+
+
+def packed_width(width: int) -> int:
+    return (width + 1) // 2
+
+
+def pack_nibbles(values: np.ndarray) -> np.ndarray:
+    # (..., width) values below 16 into (..., packed_width(width)) bytes
+    values = np.asarray(values, dtype=np.uint8)
+    if values.shape[-1] % 2:
+        values = np.concatenate([values, np.zeros(values.shape[:-1] + (1,), dtype=np.uint8)], axis=-1)
+    return values[..., 0::2] | (values[..., 1::2] << np.uint8(4))
+
+
+def unpack_nibbles(packed: np.ndarray, width: int) -> np.ndarray:
+    packed = np.asarray(packed, dtype=np.uint8)
+    values = np.empty(packed.shape[:-1] + (2 * packed.shape[-1],), dtype=np.uint8)
+    values[..., 0::2] = packed & np.uint8(0x0F)
+    values[..., 1::2] = packed >> np.uint8(4)
+    return values[..., :width]
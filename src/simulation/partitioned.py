@@ -0,0 +1,326 @@
+import multiprocessing
+import os
+import traceback
+import weakref
+from multiprocessing.shared_memory import SharedMemory
+from typing import Sequence
+
+import numpy as np
+
+from src.simulation.cpu_compute import next_state, step_stats, transition_counts
+from src.simulation.philox import cell_noise
+from src.simulation.stats import StepStats, STATS_BOX, STATS_SIZE, NO_FIRE
+from src.simulation.types import TRANSITIONS
+
+# Shared arrays of the world: grid and humidity are double-buffered, a step
+# reads one buffer and writes the other, and the humidity delta keeps its
+# values between steps like the CPU engine's humidity_out
+ARRAYS = {
+    'grid0': np.uint8,
+    'grid1': np.uint8,
+    'humidity0': np.float32,
+    'humidity1': np.float32,
+    'delta': np.float16,
+}
+
+
+def partition(height: int, width: int, workers: int | Sequence[int]) -> list[tuple[int, int, int, int]]:
+    # (y0, y1, x0, x1) of every block, workers is a number of horizontal
+    # strips or (rows, columns) of 2D blocks
+    rows, columns = (workers, 1) if np.ndim(workers) == 0 else workers
+    rows, columns = int(rows), int(columns)
+    if rows < 1 or columns < 1:
+        raise ValueError(f"Expected at least one block, got {rows}x{columns}")
+    if rows > height or columns > width:
+        raise ValueError(f"{rows}x{columns} blocks do not fit a {width}x{height} world")
+    ys = [height * i // rows for i in range(rows + 1)]
+    xs = [width * i // columns for i in range(columns + 1)]
+    return [(ys[i], ys[i + 1], xs[j], xs[j + 1]) for i in range(rows) for j in range(columns)]
+
+
+def attach(names: dict, shape: tuple[int, int]) -> tuple[list[SharedMemory], dict]:
+    memories = [SharedMemory(name=names[key]) for key in ARRAYS]
+    arrays = {key: np.ndarray(shape, dtype=dtype, buffer=memory.buf)
+              for (key, dtype), memory in zip(ARRAYS.items(), memories)}
+    return memories, arrays
+
+
+class Block:
+    def __init__(self, bounds: tuple[int, int, int, int], shape: tuple[int, int], halo: int) -> None:
+        # A worker's cells and the window next_state runs on: the cells plus
+        # halo cells of the neighbouring blocks, clipped to the world. Cells
+        # within radius of the block see whole neighbourhoods in a 2 * radius
+        # halo, so the block's new states and humidity writes equal those of
+        # a step over the whole world.
+        y0, y1, x0, x1 = bounds
+        height, width = shape
+        self.bounds = bounds
+        self.own = np.s_[y0:y1, x0:x1]
+        self.top = max(0, y0 - halo)
+        self.left = max(0, x0 - halo)
+        self.window = np.s_[self.top:min(height, y1 + halo), self.left:min(width, x1 + halo)]
+        self.inner = np.s_[y0 - self.top:y1 - self.top, x0 - self.left:x1 - self.left]
+
+
+def serve(block: Block, arrays: dict, params: dict, barrier, connection) -> None:
+    # Answers commands from PartitionedComputeEngine until stop. Steps of one
+    # command are separated by the barrier, after it every block has written
+    # the buffer the next step reads, halo rows and columns included.
+    grids = (arrays['grid0'], arrays['grid1'])
+    humidities = (arrays['humidity0'], arrays['humidity1'])
+    height = block.window[0].stop - block.window[0].start
+    width = block.window[1].stop - block.window[1].start
+
+    while True:
+        command, *args = connection.recv()
+        if command == 'stop':
+            return
+        try:
+            if command == 'advance':
+                parity, seed, base_step, winds, counters = args
+                totals = np.zeros(len(TRANSITIONS), dtype=np.int64)
+                # Delta cells outside the block are scratch, only its own
+                # are written back
+                delta = arrays['delta'][block.window].copy()
+                for i, wind in enumerate(winds):
+                    if i:
+                        barrier.wait()
+                    grid = grids[parity][block.window]
+                    humidity = humidities[parity][block.window]
+                    noise = cell_noise(seed, base_step + i, height, width, block.left, block.top)
+                    new_grid = next_state(
+                        grid,
+                        humidity,
+                        noise,
+                        wind,
+                        delta,
+                        params['growth_prob'],
+                        params['spread_prob'],
+                        params['lightning_prob'],
+                        params['humidity_change'],
+                        params['humidity_change_fire'],
+                        params['radius']
+                    )
+                    parity = 1 - parity
+                    grids[parity][block.own] = new_grid[block.inner]
+                    np.clip(humidity[block.inner] + delta[block.inner], 0.5, 1.5,
+                            out=humidities[parity][block.own])
+                    if counters:
+                        totals += transition_counts(grid[block.inner], new_grid[block.inner])
+                arrays['delta'][block.own] = delta[block.inner]
+                connection.send(('ok', totals))
+            elif command == 'stats':
+                parity, = args
+                stats = step_stats(grids[1 - parity][block.own], grids[parity][block.own])
+                values = np.zeros(STATS_SIZE, dtype=np.int64)
+                values[:STATS_BOX] = np.concatenate([stats.counts, stats.transitions])
+                if stats.fire_box is None:
+                    values[STATS_BOX:] = NO_FIRE
+                else:
+                    y0, _, x0, _ = block.bounds
+                    values[STATS_BOX:] = np.add(stats.fire_box, (x0, y0, x0, y0))
+                connection.send(('ok', values))
+            else:
+                raise ValueError(f"Unknown command: {command}")
+        except Exception:
+            # Workers waiting for this one at the barrier fail too
+            barrier.abort()
+            connection.send(('error', traceback.format_exc()))
+
+
+def run_worker(bounds, shape, names, params, barrier, connection) -> None:
+    memories, arrays = attach(names, shape)
+    try:
+        serve(Block(bounds, shape, 2 * params['radius']), arrays, params, barrier, connection)
+    finally:
+        # The views must go before the mappings are closed
+        del arrays
+        for memory in memories:
+            memory.close()
+
+
+def shutdown(processes, connections, memories) -> None:
+    for connection in connections:
+        try:
+            connection.send(('stop',))
+        except (BrokenPipeError, OSError):
+            pass
+    for process in processes:
+        process.join(timeout=5)
+        if process.is_alive():
+            process.terminate()
+    for memory in memories:
+        try:
+            memory.close()
+        except BufferError:
+            # Still viewed by an engine alive at interpreter exit
+            pass
+        memory.unlink()
+
+
+class PartitionedComputeEngine:
+    def __init__(self,
+                 width: int,
+                 height: int,
+                 growth_prob: float,
+                 spread_prob: float,
+                 lightning_prob: float,
+                 humidity_change: float,
+                 humidity_change_fire: float,
+                 seed: int,
+                 double_buffered: bool = False,
+                 resident: bool = True,
+                 radius: int = 1,
+                 workers: int | Sequence[int] = None) -> None:
+        # Resident CPU engine over worker processes. The state lives in shared
+        # memory split into blocks, one process per block. Noise is drawn
+        # from world coordinates, so the results are the CPU engine's for any
+        # number or layout of blocks. step returns as soon as the workers
+        # have the command, so double_buffered changes nothing here.
+        if not resident:
+            raise ValueError("The partitioned backend needs resident state")
+        if radius < 1:
+            raise ValueError(f"Radius must be at least 1, got {radius}")
+
+        self.width = width
+        self.height = height
+        self.shape = (height, width)
+        self.seed = seed
+        self.radius = radius
+        self.blocks = partition(height, width, workers or os.cpu_count() or 1)
+        params = {
+            'growth_prob': growth_prob,
+            'spread_prob': spread_prob,
+            'lightning_prob': lightning_prob,
+            'humidity_change': humidity_change,
+            'humidity_change_fire': humidity_change_fire,
+            'radius': radius,
+        }
+
+        self.memories = [SharedMemory(create=True, size=height * width * np.dtype(dtype).itemsize)
+                         for dtype in ARRAYS.values()]
+        self.arrays = {key: np.ndarray(self.shape, dtype=dtype, buffer=memory.buf)
+                       for (key, dtype), memory in zip(ARRAYS.items(), self.memories)}
+        for array in self.arrays.values():
+            array.fill(0)
+        names = {key: memory.name for key, memory in zip(ARRAYS, self.memories)}
+
+        # Buffer holding the current state, the other one the previous state
+        self.parity = 0
+        self.step_counter = 0
+        self.wind = np.zeros(2, dtype=np.float32)
+
+        context = multiprocessing.get_context('spawn')
+        # Kept here, the workers unpickle it after start returns
+        self.barrier = context.Barrier(len(self.blocks))
+        self.connections = []
+        self.processes = []
+        for bounds in self.blocks:
+            connection, worker_connection = context.Pipe()
+            process = context.Process(target=run_worker,
+                                      args=(bounds, self.shape, names, params, self.barrier, worker_connection),
+                                      daemon=True)
+            process.start()
+            worker_connection.close()
+            self.connections.append(connection)
+            self.processes.append(process)
+        self.pending = False
+        self.finalizer = weakref.finalize(self, shutdown, self.processes, self.connections, self.memories)
+
+    @property
+    def workers(self) -> int:
+        return len(self.blocks)
+
+    def close(self) -> None:
+        self.wait()
+        self.arrays = None
+        self.finalizer()
+
+    def send(self, *command) -> None:
+        for connection in self.connections:
+            try:
+                connection.send(command)
+            except (BrokenPipeError, OSError):
+                # Dead worker, gather reports it
+                self.barrier.abort()
+        self.pending = True
+
+    def gather(self) -> list:
+        # Replies of every worker, the first failure is raised once all of
+        # them answered so none is left waiting. A worker that died never
+        # answers, the others are released from the barrier.
+        replies = []
+        for connection, process in zip(self.connections, self.processes):
+            while not connection.poll(0.1):
+                if not all(worker.is_alive() for worker in self.processes):
+                    self.barrier.abort()
+                if not process.is_alive():
+                    break
+            try:
+                replies.append(connection.recv())
+            except (EOFError, ConnectionError):
+                replies.append(('error', f"Worker process exited with code {process.exitcode}"))
+        self.pending = False
+        for status, value in replies:
+            if status == 'error':
+                raise RuntimeError(f"Partition worker failed:\n{value}")
+        return [value for _, value in replies]
+
+    def wait(self) -> None:
+        if self.pending:
+            self.gather()
+
+    def reset(self, seed: int) -> None:
+        self.wait()
+        self.seed = seed
+        self.arrays['delta'].fill(0)
+
+    def update_step(self, step: int) -> None:
+        self.step_counter = step
+
+    def update_wind(self, wind_x: float, wind_y: float) -> None:
+        self.wind[:] = (wind_x, wind_y)
+
+    def upload_state(self, grid: np.ndarray, humidity: np.ndarray) -> None:
+        # Both buffers, so statistics before the first step show no changes
+        self.wait()
+        for key in ('grid0', 'grid1'):
+            np.copyto(self.arrays[key], grid.reshape(self.shape), casting='unsafe')
+        for key in ('humidity0', 'humidity1'):
+            np.copyto(self.arrays[key], humidity.reshape(self.shape), casting='unsafe')
+
+    def download_state(self) -> tuple[np.ndarray, np.ndarray]:
+        self.wait()
+        return self.arrays[f'grid{self.parity}'].copy(), self.arrays[f'humidity{self.parity}'].copy()
+
+    def download_delta(self) -> np.ndarray:
+        self.wait()
+        return self.arrays['delta'].copy()
+
+    def upload_delta(self, delta: np.ndarray) -> None:
+        self.wait()
+        np.copyto(self.arrays['delta'], delta.reshape(self.shape), casting='unsafe')
+
+    def read_stats(self) -> StepStats:
+        # Per-block statistics of the last step, the boxes are merged
+        self.wait()
+        self.send('stats', self.parity)
+        values = np.stack(self.gather())
+        total = values.sum(axis=0)
+        total[STATS_BOX:STATS_BOX + 2] = values[:, STATS_BOX:STATS_BOX + 2].min(axis=0)
+        total[STATS_BOX + 2:] = values[:, STATS_BOX + 2:].max(axis=0)
+        return StepStats.from_buffer(total)
+
+    def submit(self, base_step: int, winds: np.ndarray, counters: bool) -> None:
+        self.wait()
+        winds = np.asarray(winds, dtype=np.float32)
+        self.send('advance', self.parity, self.seed, base_step, winds, counters)
+        self.parity = (self.parity + len(winds)) % 2
+
+    def step(self) -> None:
+        self.submit(self.step_counter, self.wind[None].copy(), False)
+
+    def advance(self, base_step: int, winds: np.ndarray, counters: bool = False) -> np.ndarray | None:
+        self.submit(base_step, winds, counters)
+        totals = np.sum(self.gather(), axis=0)
+        return totals if counters else None
@@ -0,0 +1,73 @@
+import numpy as np
+
+# Philox4x32-10 (Salmon et al., "Parallel Random Numbers: As Easy as 1, 2, 3"),
+# the same generator is implemented in shader.hlsl so both backends draw
+# identical numbers for a given (seed, step, cell)
+PHILOX_M0 = np.uint64(0xD2511F53)
+PHILOX_M1 = np.uint64(0xCD9E8D57)
+PHILOX_W0 = np.uint64(0x9E3779B9)
+PHILOX_W1 = np.uint64(0xBB67AE85)
+PHILOX_ROUNDS = 10
+
+SHIFT = np.uint64(32)
+MASK = np.uint64(0xFFFFFFFF)
+
+
+def seed_key(seed: int) -> tuple[int, int]:
+    seed = int(seed) & 0xFFFFFFFFFFFFFFFF
+    return seed & 0xFFFFFFFF, seed >> 32
+
+
+def philox4x32(counter, key) -> list[np.ndarray]:
+    # Words are carried in uint64 so the 32x32 -> 64 bit products need no casts
+    c0, c1, c2, c3 = (np.asarray(c, dtype=np.uint64) for c in counter)
+    k0, k1 = (np.asarray(k, dtype=np.uint64) for k in key)
+
+    for _ in range(PHILOX_ROUNDS):
+        product0 = PHILOX_M0 * c0
+        product1 = PHILOX_M1 * c2
+        c0 = (product1 >> SHIFT) ^ c1 ^ k0
+        c1 = product1 & MASK
+        c2 = (product0 >> SHIFT) ^ c3 ^ k1
+        c3 = product0 & MASK
+        k0 = (k0 + PHILOX_W0) & MASK
+        k1 = (k1 + PHILOX_W1) & MASK
+
+    return [c.astype(np.uint32) for c in (c0, c1, c2, c3)]
+
+
+def to_uniform(words: np.ndarray) -> np.ndarray:
+    # 24 random bits, exactly representable as float32 in [0, 1)
+    return (words >> np.uint32(8)).astype(np.float32) * np.float32(1.0 / 16777216.0)
+
+
+def cell_noise(seed,
+               step: int,
+               height: int,
+               width: int,
+               x0: int = 0,
+               y0: int = 0) -> list[np.ndarray]:
+    # Counter is (x, y, step, 0) in world coordinates, key is the seed.
+    # One uniform per rule: lightning, burn out, growth and spread.
+    # A sequence of seeds gives one (height, width) plane per seed.
+    x = np.arange(x0, x0 + width, dtype=np.uint32)[None, :]
+    y = np.arange(y0, y0 + height, dtype=np.uint32)[:, None]
+    if np.ndim(seed) == 0:
+        key = seed_key(seed)
+        shape = (height, width)
+    else:
+        keys = np.array([seed_key(s) for s in seed], dtype=np.uint32).reshape(-1, 2, 1, 1)
+        key = (keys[:, 0], keys[:, 1])
+        shape = (len(keys), height, width)
+    words = philox4x32((x, y, np.uint32(step), np.uint32(0)), key)
+    return [to_uniform(np.broadcast_to(w, shape)) for w in words]
+
+
+def noise_at(seed: int, step: int, x: np.ndarray, y: np.ndarray) -> list[np.ndarray]:
+    # Same draws as cell_noise for arbitrary world coordinates, e.g. a batch
+    # of tile windows. Negative coordinates wrap and give unused values.
+    x = np.asarray(x).astype(np.uint32)
+    y = np.asarray(y).astype(np.uint32)
+    shape = np.broadcast_shapes(x.shape, y.shape)
+    words = philox4x32((x, y, np.uint32(step), np.uint32(0)), seed_key(seed))
+    return [to_uniform(np.broadcast_to(w, shape)) for w in words]
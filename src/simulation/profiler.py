@@ -0,0 +1,138 @@
+import csv
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+
+import numpy as np
+
+# Durations kept per span for the rolling percentiles
+WINDOW = 1024
+
+# Spans kept for the trace export, older ones are dropped
+TRACE_LIMIT = 1_000_000
+
+DISABLED = nullcontext()
+
+
+class Span:
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler: "Profiler", name: str) -> None:
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self) -> "Span":
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.profiler.add(self.name, self.start, time.perf_counter_ns())
+
+
+class Profiler:
+    def __init__(self) -> None:
+        # Disabled, span() returns a shared no-op context and costs a method
+        # call. Enabled, every span keeps its last WINDOW durations and, when
+        # tracing, its start and end for the Chrome trace export.
+        self.enabled = False
+        self.tracing = False
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter_ns()
+        self.durations: dict[str, np.ndarray] = {}
+        self.counts: dict[str, int] = {}
+        self.totals: dict[str, int] = {}
+        self.events = deque(maxlen=TRACE_LIMIT)
+
+    def enable(self, tracing: bool = False) -> None:
+        self.enabled = True
+        self.tracing = tracing
+
+    def disable(self) -> None:
+        self.enabled = False
+        self.tracing = False
+
+    def reset(self) -> None:
+        with self.lock:
+            self.origin = time.perf_counter_ns()
+            self.durations.clear()
+            self.counts.clear()
+            self.totals.clear()
+            self.events.clear()
+
+    def span(self, name: str):
+        if not self.enabled:
+            return DISABLED
+        return Span(self, name)
+
+    def add(self, name: str, start: int, end: int) -> None:
+        duration = end - start
+        with self.lock:
+            durations = self.durations.get(name)
+            if durations is None:
+                durations = self.durations[name] = np.zeros(WINDOW, dtype=np.int64)
+                self.counts[name] = 0
+                self.totals[name] = 0
+            durations[self.counts[name] % WINDOW] = duration
+            self.counts[name] += 1
+            self.totals[name] += duration
+            if self.tracing:
+                self.events.append((name, threading.get_ident(), start, duration))
+
+    def stats(self) -> dict[str, dict[str, float]]:
+        # Milliseconds over the last WINDOW spans of each name, except
+        # count and total_ms which cover everything since the last reset
+        with self.lock:
+            window = {name: durations[:min(self.counts[name], WINDOW)].copy()
+                      for name, durations in self.durations.items()}
+            counts = dict(self.counts)
+            totals = dict(self.totals)
+
+        result = {}
+        for name, durations in window.items():
+            p50, p95, p99 = np.percentile(durations, (50, 95, 99)) / 1e6
+            result[name] = {
+                'count': counts[name],
+                'total_ms': totals[name] / 1e6,
+                'mean_ms': float(durations.mean()) / 1e6,
+                'p50_ms': float(p50),
+                'p95_ms': float(p95),
+                'p99_ms': float(p99),
+                'max_ms': float(durations.max()) / 1e6,
+            }
+        return result
+
+    def export_trace(self, path: str) -> None:
+        # Chrome trace-event format, opens in chrome://tracing and Perfetto
+        with self.lock:
+            events = list(self.events)
+        threads = {thread: index for index, thread in enumerate(dict.fromkeys(e[1] for e in events))}
+        trace = [
+            {
+                'name': name,
+                'ph': 'X',
+                'ts': (start - self.origin) / 1e3,
+                'dur': duration / 1e3,
+                'pid': os.getpid(),
+                'tid': threads[thread],
+            }
+            for name, thread, start, duration in events
+        ]
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, file)
+
+    def export_csv(self, path: str) -> None:
+        stats = self.stats()
+        columns = ['span', 'count', 'total_ms', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms']
+        with open(path, 'w', encoding='utf-8', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(columns)
+            for name, values in sorted(stats.items(), key=lambda item: -item[1]['total_ms']):
+                writer.writerow([name] + [round(values[column], 4) for column in columns[1:]])
+
+
+# Process-wide profiler the simulation and game report to
+PROFILER = Profiler()
+span = PROFILER.span
@@ -0,0 +1,242 @@
+import os
+import queue
+import struct
+import threading
+import zlib
+
+import numpy as np
+
+# File layout: a header, then chunks written back to back. Every chunk is a
+# zlib stream holding a keyframe and the deltas of up to keyframe_every - 1
+# following steps, preceded by an uncompressed table of its steps so a reader
+# can index the file without decompressing it.
+#
+#   header:  MAGIC, version, height, width, keyframe_every
+#   chunk:   compressed length (u64), records (u32), steps (records x u64)
+#            zlib(keyframe record, delta record, ...)
+#   keyframe record: wind (2 x f32), grid (H*W u8), humidity (H*W u8)
+#   delta record:    wind (2 x f32), changed cells (u32),
+#                    index gaps (changed x u32), types (changed x u8),
+#                    humidity difference (H*W u8, modulo 256)
+#
+# Humidity is quantised to 8 bits over its [0.5, 1.5] range. Consecutive
+# frames differ in few cells, so index gaps and humidity differences are
+# mostly small or zero and compress well.
+MAGIC = b'FFRC'
+VERSION = 1
+HEADER = struct.Struct('<4sIIII')
+CHUNK = struct.Struct('<QI')
+WIND = struct.Struct('<ff')
+COUNT = struct.Struct('<I')
+
+
+def quantize_humidity(humidity: np.ndarray) -> np.ndarray:
+    scaled = (np.asarray(humidity, dtype=np.float32) - np.float32(0.5)) * np.float32(255)
+    return np.rint(np.clip(scaled, 0, 255)).astype(np.uint8)
+
+
+def dequantize_humidity(quantized: np.ndarray) -> np.ndarray:
+    return np.float32(0.5) + quantized.astype(np.float32) / np.float32(255)
+
+
+class Recorder:
+    def __init__(self,
+                 path: str,
+                 shape: tuple[int, int],
+                 keyframe_every: int = 100,
+                 level: int = 1,
+                 queue_size: int = 64) -> None:
+        # Frames are encoded, compressed and written by a background thread.
+        # record only copies the state; once queue_size frames are waiting
+        # it blocks, so a slow disk slows the simulation instead of filling
+        # memory.
+        self.path = path
+        self.shape = tuple(shape)
+        self.keyframe_every = keyframe_every
+        self.level = level
+        self.frames = queue.Queue(maxsize=queue_size)
+        self.error: BaseException | None = None
+
+        self.file = open(path, 'wb')
+        self.file.write(HEADER.pack(MAGIC, VERSION, *self.shape, keyframe_every))
+
+        self.steps = []
+        self.parts = []
+        self.previous = None
+        self.thread = threading.Thread(target=self.run, name="recorder", daemon=True)
+        self.thread.start()
+
+    def record(self, step: int, grid: np.ndarray, humidity: np.ndarray, wind) -> None:
+        if self.error is not None:
+            raise RuntimeError("Recorder failed") from self.error
+        frame = (
+            int(step),
+            np.array(grid, dtype=np.uint8).reshape(self.shape),
+            np.array(humidity, dtype=np.float32).reshape(self.shape),
+            (float(wind[0]), float(wind[1]))
+        )
+        self.frames.put(frame)
+
+    def keyframe(self) -> None:
+        # The next frame starts a new chunk, e.g. after the world was reset
+        self.frames.put(None)
+
+    def run(self) -> None:
+        try:
+            while True:
+                frame = self.frames.get()
+                if frame is None:
+                    self.flush()
+                    continue
+                if frame is StopIteration:
+                    self.flush()
+                    return
+                self.encode(*frame)
+                if len(self.steps) == self.keyframe_every:
+                    self.flush()
+        except BaseException as error:
+            self.error = error
+            raise
+
+    def encode(self, step: int, grid: np.ndarray, humidity: np.ndarray, wind: tuple[float, float]) -> None:
+        quantized = quantize_humidity(humidity)
+        if self.previous is None:
+            self.parts += [WIND.pack(*wind), grid.tobytes(), quantized.tobytes()]
+        else:
+            previous_grid, previous_quantized = self.previous
+            changed = np.flatnonzero(grid != previous_grid).astype(np.uint32)
+            gaps = np.diff(changed, prepend=np.uint32(0)).astype(np.uint32)
+            self.parts += [
+                WIND.pack(*wind),
+                COUNT.pack(len(changed)),
+                gaps.tobytes(),
+                grid.ravel()[changed].tobytes(),
+                (quantized - previous_quantized).tobytes()
+            ]
+        self.steps.append(step)
+        self.previous = (grid, quantized)
+
+    def flush(self) -> None:
+        if not self.steps:
+            return
+        data = zlib.compress(b''.join(self.parts), self.level)
+        self.file.write(CHUNK.pack(len(data), len(self.steps)))
+        self.file.write(np.asarray(self.steps, dtype=np.uint64).tobytes())
+        self.file.write(data)
+        self.file.flush()
+        self.steps = []
+        self.parts = []
+        self.previous = None
+
+    def close(self) -> None:
+        if self.thread.is_alive():
+            self.frames.put(StopIteration)
+            self.thread.join()
+        self.file.close()
+        if self.error is not None:
+            raise RuntimeError("Recorder failed") from self.error
+
+
+class Recording:
+    def __init__(self, path: str) -> None:
+        # Reader for Recorder files. Frames are addressed by index; the
+        # chunk holding the last requested frame stays decoded, so stepping
+        # forward applies one delta and stepping backward replays at most
+        # keyframe_every - 1 deltas from the chunk's keyframe.
+        self.path = path
+        self.file = open(path, 'rb')
+        magic, version, height, width, self.keyframe_every = HEADER.unpack(self.file.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a forest recording")
+        self.height = height
+        self.width = width
+        self.shape = (height, width)
+
+        # A chunk cut short by a crash is ignored
+        self.chunks = []
+        steps = []
+        size = os.fstat(self.file.fileno()).st_size
+        offset = HEADER.size
+        while offset + CHUNK.size <= size:
+            self.file.seek(offset)
+            length, records = CHUNK.unpack(self.file.read(CHUNK.size))
+            data_offset = offset + CHUNK.size + 8 * records
+            if data_offset + length > size:
+                break
+            steps.append(np.frombuffer(self.file.read(8 * records), dtype=np.uint64))
+            self.chunks.append((data_offset, length, records))
+            offset = data_offset + length
+
+        self.steps = np.concatenate(steps).astype(np.int64) if steps else np.zeros(0, dtype=np.int64)
+        self.starts = np.cumsum([0] + [records for _, _, records in self.chunks])
+
+        self.chunk = None
+        self.records = []
+        self.cursor = None
+        self.grid = np.zeros(self.shape, dtype=np.uint8)
+        self.quantized = np.zeros(self.shape, dtype=np.uint8)
+        self.wind = (0.0, 0.0)
+
+    def __len__(self) -> int:
+        return len(self.steps)
+
+    def index_of(self, step: int) -> int:
+        # First frame at or after step
+        later = np.flatnonzero(self.steps >= step)
+        return int(later[0]) if len(later) else len(self) - 1
+
+    def load_chunk(self, chunk: int) -> None:
+        offset, length, records = self.chunks[chunk]
+        self.file.seek(offset)
+        data = memoryview(zlib.decompress(self.file.read(length)))
+
+        cells = self.height * self.width
+        self.records = []
+        position = 0
+        for record in range(records):
+            wind = WIND.unpack_from(data, position)
+            position += WIND.size
+            if record == 0:
+                self.records.append((wind, data[position:position + cells], data[position + cells:position + 2 * cells]))
+                position += 2 * cells
+                continue
+            (changed,) = COUNT.unpack_from(data, position)
+            position += COUNT.size
+            gaps = np.frombuffer(data, dtype=np.uint32, count=changed, offset=position)
+            position += 4 * changed
+            types = np.frombuffer(data, dtype=np.uint8, count=changed, offset=position)
+            position += changed
+            humidity = np.frombuffer(data, dtype=np.uint8, count=cells, offset=position)
+            position += cells
+            self.records.append((wind, np.cumsum(gaps, dtype=np.int64), types, humidity))
+        self.chunk = chunk
+        self.cursor = None
+
+    def apply(self, record: int) -> None:
+        if record == 0:
+            self.wind, grid, quantized = self.records[0]
+            self.grid.ravel()[:] = np.frombuffer(grid, dtype=np.uint8)
+            self.quantized.ravel()[:] = np.frombuffer(quantized, dtype=np.uint8)
+        else:
+            self.wind, changed, types, humidity = self.records[record]
+            self.grid.ravel()[changed] = types
+            np.add(self.quantized.ravel(), humidity, out=self.quantized.ravel())
+        self.cursor = record
+
+    def frame(self, index: int) -> tuple[int, np.ndarray, np.ndarray, tuple[float, float]]:
+        # (step, grid, humidity, wind) of frame index. grid is reused by the
+        # next call, copy it to keep it.
+        if not 0 <= index < len(self):
+            raise IndexError(f"Frame {index} out of range for {len(self)} frames")
+        chunk = int(np.searchsorted(self.starts, index, side='right')) - 1
+        record = index - self.starts[chunk]
+        if chunk != self.chunk:
+            self.load_chunk(chunk)
+        if self.cursor is None or record < self.cursor:
+            self.apply(0)
+        for next_record in range(self.cursor + 1, record + 1):
+            self.apply(next_record)
+        return int(self.steps[index]), self.grid, dequantize_humidity(self.quantized), self.wind
+
+    def close(self) -> None:
+        self.file.close()
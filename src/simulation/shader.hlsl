@@ -8,7 +8,13 @@
 
 #define PI 3.14159265359
 
-#define size 256
+// World size, the engine passes the real one as defines
+#ifndef WIDTH
+#define WIDTH 256
+#endif
+#ifndef HEIGHT
+#define HEIGHT 256
+#endif
 
 cbuffer Config : register(b0) {
     float growth_prob;
@@ -16,55 +22,156 @@ cbuffer Config : register(b0) {
     float lightning_prob;
     float humidity_change;
     float humidity_change_fire;
+    uint2 seed;
 }
 
+// Philox4x32-10 counter-based generator, mirrors src/simulation/philox.py
+#define PHILOX_M0 0xD2511F53
+#define PHILOX_M1 0xCD9E8D57
+#define PHILOX_W0 0x9E3779B9
+#define PHILOX_W1 0xBB67AE85
+
+uint mulhi(uint a, uint b) {
+    uint a_lo = a & 0xFFFF;
+    uint a_hi = a >> 16;
+    uint b_lo = b & 0xFFFF;
+    uint b_hi = b >> 16;
+    uint lo_lo = a_lo * b_lo;
+    uint hi_lo = a_hi * b_lo;
+    uint lo_hi = a_lo * b_hi;
+    uint cross = (lo_lo >> 16) + (hi_lo & 0xFFFF) + lo_hi;
+    return a_hi * b_hi + (hi_lo >> 16) + (cross >> 16);
+}
+
+uint4 philox(uint4 counter, uint2 key) {
+    [unroll] for (int i = 0; i < 10; i++) {
+        uint hi0 = mulhi(PHILOX_M0, counter.x);
+        uint lo0 = PHILOX_M0 * counter.x;
+        uint hi1 = mulhi(PHILOX_M1, counter.z);
+        uint lo1 = PHILOX_M1 * counter.z;
+        counter = uint4(hi1 ^ counter.y ^ key.x, lo1, hi0 ^ counter.w ^ key.y, lo0);
+        key += uint2(PHILOX_W0, PHILOX_W1);
+    }
+    return counter;
+}
+
+// One independent uniform per rule: x lightning, y burn out, z growth, w spread
+float4 cell_noise(uint2 position, uint step_index) {
+    uint4 words = philox(uint4(position, step_index, 0), seed);
+    return float4(words >> 8) * (1.0 / 16777216.0);
+}
+
+float remap(float value, float in_from, float in_to, float out_from, float out_to) {
+    return out_from + (out_to - out_from) * (value - in_from) / (in_to - in_from);
+}
+
+#ifndef FUSED
+
 cbuffer Wind : register(b1) {
     float2 wind;
+    uint step;
 };
 
 Texture2D<int> source : register(t0);
 Texture2D<float> humidity : register(t1);
-Texture2D<float> noise : register(t2);
 
 RWTexture2D<int> target : register(u0);
 RWTexture2D<float> out_humidity : register(u1);
+RWTexture2D<float> next_humidity : register(u2);
+// Step statistics, layout of src/simulation/stats.py: cells per type,
+// lightning strikes, ignitions, burn outs, regrowth, then the bounding box of
+// burning cells as min x, min y, max x, max y
+RWStructuredBuffer<uint> stats : register(u3);
 
-float remap(float value, float in_from, float in_to, float out_from, float out_to) {
-    return out_from + (out_to - out_from) * (value - in_from) / (in_to - in_from);
+#define STATS_TRANSITIONS 6
+#define STATS_BOX (STATS_TRANSITIONS + 4)
+#define STATS_SIZE (STATS_BOX + 4)
+
+groupshared uint group_stats[STATS_SIZE];
+
+// Neighbourhood radius of growth, spread and change_humidity, the engine
+// passes the configured one
+#ifndef RADIUS
+#define RADIUS 1
+#endif
+
+// Every group loads its 16x16 tile plus a halo of RADIUS cells once. Per tile
+// column and output row it then keeps the first row offset holding fire and
+// whether a plant is in reach, so a cell scans 2 * RADIUS + 1 column summaries
+// instead of (2 * RADIUS + 1)^2 texture reads.
+#define GROUP 16
+#define REACH_SPAN (GROUP + 2 * RADIUS)
+#define OUTSIDE 255
+#define NO_FIRE_ROW (RADIUS + 1)
+
+groupshared uint reach_grid[REACH_SPAN * REACH_SPAN];
+groupshared int column_fire[GROUP * REACH_SPAN];
+groupshared uint column_plant[GROUP * REACH_SPAN];
+
+bool in_world(int2 position) {
+    return position.x >= 0 && position.x < WIDTH && position.y >= 0 && position.y < HEIGHT;
 }
 
-int2 neighbors_check(uint2 origin, int type) {
-    for (int i = -1; i <= 1; i++) {
-        for (int j = -1; j <= 1; j++) {
-            if (i == 0 && j == 0) {
-                continue;
-            }
+bool plant_in_reach(uint2 local) {
+    for (int i = -RADIUS; i <= RADIUS; i++) {
+        if (column_plant[local.y * REACH_SPAN + local.x + RADIUS + i] != 0) {
+            return true;
+        }
+    }
 
-            int2 position = int2(origin) + int2(i, j);
-            if (position.x >= 0 && position.x < size && position.y >= 0 && position.y < size) {
-                if (source[position] == type) {
-                    return position;
-                }
+    return false;
+}
+
+// Offset of the first burning cell within RADIUS, i outer and j inner as in
+// the CPU engine; z is 0 when there is none
+int3 fire_in_reach(uint2 local) {
+    for (int i = -RADIUS; i <= RADIUS; i++) {
+        int j = column_fire[local.y * REACH_SPAN + local.x + RADIUS + i];
+        if (j != NO_FIRE_ROW) {
+            return int3(i, j, 1);
+        }
+    }
+
+    return int3(0, 0, 0);
+}
+
+// Chance that at least one burning cell within RADIUS ignites the plant,
+// 1 - prod(1 - base * angle / PI) over the sources, each with the wind angle
+// of its own offset. Multiplied i outer and j inner like the CPU engine, and
+// only over columns whose summary holds fire.
+float spread_chance(uint2 local, float base) {
+    float keep = 1;
+    for (int i = -RADIUS; i <= RADIUS; i++) {
+        uint column = local.x + RADIUS + i;
+        if (column_fire[local.y * REACH_SPAN + column] == NO_FIRE_ROW) {
+            continue;
+        }
+
+        for (int j = -RADIUS; j <= RADIUS; j++) {
+            if (reach_grid[(local.y + RADIUS + j) * REACH_SPAN + column] == FIRE) {
+                float angle = acos(dot(normalize(-float2(i, j)), wind));
+                keep *= max(1 - base * (angle / PI), 0);
             }
         }
     }
 
-    return int2(-1, -1);
+    return 1 - keep;
 }
 
 void change_humidity(uint2 position, float change_value) {
-    for (int i = -1; i <= 1; i++) {
-        for (int j = -1; j <= 1; j++) {
+    for (int i = -RADIUS; i <= RADIUS; i++) {
+        for (int j = -RADIUS; j <= RADIUS; j++) {
             int2 neighbor = int2(position) + int2(i, j);
-            if (neighbor.x >= 0 && neighbor.x < size && neighbor.y >= 0 && neighbor.y < size) {
+            if (in_world(neighbor)) {
                 out_humidity[neighbor] = change_value;
             }
         }
     }
 }
 
-int next_state(uint2 position) {
+int next_state(uint2 position, uint2 local) {
     uint state = source[position];
+    float4 noise = cell_noise(position, step);
 
     // Leave Water Alone (Water -> Water)
     if (state == WATER) {
@@ -72,7 +179,7 @@ int next_state(uint2 position) {
     }
 
     // Any -> Lightning
-    if (noise[position] < lightning_prob) {
+    if (noise.x < lightning_prob) {
         return LIGHTNING;
     }
 
@@ -83,7 +190,7 @@ int next_state(uint2 position) {
 
     // Fire -> Ash
     if (state == FIRE) {
-        if (noise[position] < remap(humidity[position], 0.5, 1.5, .5, 1)) {
+        if (noise.y < remap(humidity[position], 0.5, 1.5, .5, 1)) {
             return ASH;
         }
     }
@@ -95,7 +202,7 @@ int next_state(uint2 position) {
 
     // Empty -> Plant
     if (state == EMPTY) {
-        if (neighbors_check(position, PLANT).x != -1 && noise[position] < growth_prob) {
+        if (plant_in_reach(local) && noise.z < growth_prob) {
             if (humidity_change != 0) {
                 change_humidity(position, humidity_change);
             }
@@ -104,14 +211,16 @@ int next_state(uint2 position) {
         }
     }
 
-    // Plant -> Fire
+    // Plant -> Fire, at radius 1 the first burning neighbour decides the
+    // angle, beyond it every burning cell in reach is a separate chance
     if (state == PLANT) {
-        int2 fire_position = neighbors_check(position, FIRE);
-        if (fire_position.x != -1 && fire_position.y != -1) {
-            float2 fire_direction = normalize(float2(position) - float2(fire_position));
+#if RADIUS == 1
+        int3 fire = fire_in_reach(local);
+        if (fire.z != 0) {
+            float2 fire_direction = normalize(-float2(fire.xy));
             float angle = acos(dot(fire_direction, wind));
 
-            if (noise[position] < spread_prob * (2 - humidity[position]) * (angle / PI)) {
+            if (noise.w < spread_prob * (2 - humidity[position]) * (angle / PI)) {
                 if (humidity_change_fire != 0) {
                     change_humidity(position, humidity_change_fire);
                 }
@@ -119,12 +228,309 @@ int next_state(uint2 position) {
                 return FIRE;
             }
         }
+#else
+        if (noise.w < spread_chance(local, spread_prob * (2 - humidity[position]))) {
+            if (humidity_change_fire != 0) {
+                change_humidity(position, humidity_change_fire);
+            }
+
+            return FIRE;
+        }
+#endif
     }
 
     // Default
     return state;
 }
 
-[numthreads(16, 16, 1)] void main(uint3 tid : SV_DispatchThreadID) {
-    target[tid.xy] = next_state(tid.xy);
-}
\ No newline at end of file
+[numthreads(GROUP, GROUP, 1)] void main(uint3 tid : SV_DispatchThreadID, uint3 gid : SV_GroupID, uint3 gtid : SV_GroupThreadID) {
+    uint thread_index = gtid.y * GROUP + gtid.x;
+    int2 origin = int2(gid.xy * GROUP) - RADIUS;
+
+    for (uint i = thread_index; i < REACH_SPAN * REACH_SPAN; i += GROUP * GROUP) {
+        int2 world = origin + int2(i % REACH_SPAN, i / REACH_SPAN);
+        reach_grid[i] = in_world(world) ? source[world] : OUTSIDE;
+    }
+    GroupMemoryBarrierWithGroupSync();
+
+    // Column summaries over rows row - RADIUS .. row + RADIUS, walked upward
+    // so the smallest row offset with fire wins. The cell itself is never a
+    // match: only empty cells look for plants and only plants for fire.
+    for (uint i = thread_index; i < GROUP * REACH_SPAN; i += GROUP * GROUP) {
+        uint row = i / REACH_SPAN;
+        uint column = i % REACH_SPAN;
+        int first_fire = NO_FIRE_ROW;
+        uint plant = 0;
+        for (int j = RADIUS; j >= -RADIUS; j--) {
+            uint cell = reach_grid[(row + RADIUS + j) * REACH_SPAN + column];
+            if (cell == FIRE) {
+                first_fire = j;
+            }
+            plant |= cell == PLANT ? 1 : 0;
+        }
+        column_fire[i] = first_fire;
+        column_plant[i] = plant;
+    }
+    GroupMemoryBarrierWithGroupSync();
+
+    // The dispatch is rounded up to whole groups, threads outside the world
+    // still take part in the barriers
+    if (tid.x < WIDTH && tid.y < HEIGHT) {
+        target[tid.xy] = next_state(tid.xy, gtid.xy);
+    }
+}
+
+// Device-resident mode: applies the humidity delta written by main and
+// reduces the step's statistics, per group in groupshared memory first
+[numthreads(16, 16, 1)] void apply_humidity(uint3 tid : SV_DispatchThreadID, uint group_index : SV_GroupIndex) {
+    if (group_index < STATS_SIZE) {
+        group_stats[group_index] = (group_index == STATS_BOX || group_index == STATS_BOX + 1) ? 0xFFFFFFFF : 0;
+    }
+    GroupMemoryBarrierWithGroupSync();
+
+    // The dispatch is rounded up to whole groups, threads outside the world
+    // still take part in the barriers
+    if (tid.x < WIDTH && tid.y < HEIGHT) {
+        next_humidity[tid.xy] = clamp(humidity[tid.xy] + out_humidity[tid.xy], 0.5, 1.5);
+
+        uint previous = source[tid.xy];
+        uint next = target[tid.xy];
+        InterlockedAdd(group_stats[next], 1);
+        if (next == LIGHTNING) {
+            InterlockedAdd(group_stats[STATS_TRANSITIONS], 1);
+        } else if (previous == PLANT && next == FIRE) {
+            InterlockedAdd(group_stats[STATS_TRANSITIONS + 1], 1);
+        } else if (previous == FIRE && next == ASH) {
+            InterlockedAdd(group_stats[STATS_TRANSITIONS + 2], 1);
+        } else if (previous == EMPTY && next == PLANT) {
+            InterlockedAdd(group_stats[STATS_TRANSITIONS + 3], 1);
+        }
+
+        if (next == FIRE) {
+            InterlockedMin(group_stats[STATS_BOX], tid.x);
+            InterlockedMin(group_stats[STATS_BOX + 1], tid.y);
+            InterlockedMax(group_stats[STATS_BOX + 2], tid.x);
+            InterlockedMax(group_stats[STATS_BOX + 3], tid.y);
+        }
+    }
+    GroupMemoryBarrierWithGroupSync();
+
+    if (group_index < STATS_BOX) {
+        InterlockedAdd(stats[group_index], group_stats[group_index]);
+    } else if (group_index < STATS_BOX + 2) {
+        InterlockedMin(stats[group_index], group_stats[group_index]);
+    } else if (group_index < STATS_SIZE) {
+        InterlockedMax(stats[group_index], group_stats[group_index]);
+    }
+}
+
+#else
+
+// Fused multi-generation kernel (compiled with FUSED defined): every group
+// loads its 16x16 tile plus a halo into groupshared memory and advances it
+// block_steps generations without leaving the group. A generation invalidates
+// one ring of the grid and humidity lags one ring behind, hence the halo of
+// BLOCK_STEPS + 1 cells.
+
+#ifndef BLOCK_STEPS
+#define BLOCK_STEPS 4
+#endif
+
+#define TILE 16
+#define HALO (BLOCK_STEPS + 1)
+#define SPAN (TILE + 2 * HALO)
+#define OUTSIDE 255
+
+cbuffer Block : register(b1) {
+    uint base_step;
+    uint block_steps;
+};
+
+Texture2D<int> source : register(t0);
+Texture2D<float> humidity : register(t1);
+Texture2D<float> delta_in : register(t2);
+StructuredBuffer<float2> block_winds : register(t3);
+
+RWTexture2D<int> target : register(u0);
+RWTexture2D<float> next_humidity : register(u1);
+RWTexture2D<float> delta_out : register(u2);
+// lightning strikes, ignitions, burn outs, regrowth
+RWStructuredBuffer<uint> counters : register(u3);
+
+groupshared uint tile_grid[SPAN * SPAN];
+groupshared uint tile_next[SPAN * SPAN];
+groupshared float tile_humidity[SPAN * SPAN];
+groupshared float tile_delta[SPAN * SPAN];
+groupshared uint tile_counters[4];
+
+bool in_world(int2 position) {
+    return position.x >= 0 && position.x < WIDTH && position.y >= 0 && position.y < HEIGHT;
+}
+
+// Offset of the first neighbour of the given type, in the same loop order as
+// neighbors_check; z is 0 when there is none
+int3 tile_neighbors_check(int2 local, uint type) {
+    for (int i = -1; i <= 1; i++) {
+        for (int j = -1; j <= 1; j++) {
+            if (i == 0 && j == 0) {
+                continue;
+            }
+
+            int2 position = local + int2(i, j);
+            if (tile_grid[position.y * SPAN + position.x] == type) {
+                return int3(i, j, 1);
+            }
+        }
+    }
+
+    return int3(0, 0, 0);
+}
+
+uint tile_next_state(int2 local, int2 world, uint generation) {
+    uint index = local.y * SPAN + local.x;
+    uint state = tile_grid[index];
+
+    if (state == OUTSIDE || state == WATER) {
+        return state;
+    }
+
+    float4 noise = cell_noise(uint2(world), base_step + generation);
+    float cell_humidity = tile_humidity[index];
+
+    if (noise.x < lightning_prob) {
+        return LIGHTNING;
+    }
+
+    if (state == LIGHTNING) {
+        return FIRE;
+    }
+
+    if (state == FIRE) {
+        if (noise.y < remap(cell_humidity, 0.5, 1.5, .5, 1)) {
+            return ASH;
+        }
+    }
+
+    if (state == ASH) {
+        return EMPTY;
+    }
+
+    if (state == EMPTY) {
+        if (tile_neighbors_check(local, PLANT).z != 0 && noise.z < growth_prob) {
+            return PLANT;
+        }
+    }
+
+    if (state == PLANT) {
+        int3 fire = tile_neighbors_check(local, FIRE);
+        if (fire.z != 0) {
+            float2 fire_direction = normalize(-float2(fire.xy));
+            float angle = acos(dot(fire_direction, block_winds[generation]));
+
+            if (noise.w < spread_prob * (2 - cell_humidity) * (angle / PI)) {
+                return FIRE;
+            }
+        }
+    }
+
+    return state;
+}
+
+[numthreads(TILE, TILE, 1)] void main(uint3 gid : SV_GroupID, uint3 gtid : SV_GroupThreadID) {
+    uint thread_index = gtid.y * TILE + gtid.x;
+    int2 origin = int2(gid.xy * TILE) - HALO;
+
+    if (thread_index < 4) {
+        tile_counters[thread_index] = 0;
+    }
+
+    for (uint i = thread_index; i < SPAN * SPAN; i += TILE * TILE) {
+        int2 world = origin + int2(i % SPAN, i / SPAN);
+        if (in_world(world)) {
+            tile_grid[i] = source[world];
+            tile_humidity[i] = humidity[world];
+            tile_delta[i] = delta_in[world];
+        } else {
+            tile_grid[i] = OUTSIDE;
+            tile_humidity[i] = 0.5;
+            tile_delta[i] = 0;
+        }
+    }
+    GroupMemoryBarrierWithGroupSync();
+
+    // Values go through half precision like the R16 delta texture
+    float growth_delta = f16tof32(f32tof16(humidity_change));
+    float fire_delta = f16tof32(f32tof16(humidity_change_fire));
+
+    for (uint generation = 0; generation < block_steps; generation++) {
+        for (uint i = thread_index; i < SPAN * SPAN; i += TILE * TILE) {
+            int2 local = int2(i % SPAN, i / SPAN);
+            uint next = tile_grid[i];
+            if (all(local > 0) && all(local < SPAN - 1)) {
+                next = tile_next_state(local, origin + local, generation);
+            }
+            tile_next[i] = next;
+        }
+        GroupMemoryBarrierWithGroupSync();
+
+        // Gather form of change_humidity, fire is applied after growth
+        for (uint i = thread_index; i < SPAN * SPAN; i += TILE * TILE) {
+            int2 local = int2(i % SPAN, i / SPAN);
+            if (any(local == 0) || any(local == SPAN - 1)) {
+                continue;
+            }
+
+            bool grown = false;
+            bool ignited = false;
+            for (int dx = -1; dx <= 1; dx++) {
+                for (int dy = -1; dy <= 1; dy++) {
+                    uint neighbor = (local.y + dy) * SPAN + local.x + dx;
+                    grown = grown || (tile_grid[neighbor] == EMPTY && tile_next[neighbor] == PLANT);
+                    ignited = ignited || (tile_grid[neighbor] == PLANT && tile_next[neighbor] == FIRE);
+                }
+            }
+
+            if (humidity_change_fire != 0 && ignited) {
+                tile_delta[i] = fire_delta;
+            } else if (humidity_change != 0 && grown) {
+                tile_delta[i] = growth_delta;
+            }
+            tile_humidity[i] = clamp(tile_humidity[i] + tile_delta[i], 0.5, 1.5);
+
+            bool owned = all(local >= HALO) && all(local < HALO + TILE) && in_world(origin + local);
+            if (owned) {
+                uint previous = tile_grid[i];
+                uint next = tile_next[i];
+                if (next == LIGHTNING) {
+                    InterlockedAdd(tile_counters[0], 1);
+                } else if (previous == PLANT && next == FIRE) {
+                    InterlockedAdd(tile_counters[1], 1);
+                } else if (previous == FIRE && next == ASH) {
+                    InterlockedAdd(tile_counters[2], 1);
+                } else if (previous == EMPTY && next == PLANT) {
+                    InterlockedAdd(tile_counters[3], 1);
+                }
+            }
+        }
+        GroupMemoryBarrierWithGroupSync();
+
+        for (uint i = thread_index; i < SPAN * SPAN; i += TILE * TILE) {
+            tile_grid[i] = tile_next[i];
+        }
+        GroupMemoryBarrierWithGroupSync();
+    }
+
+    int2 world = int2(gid.xy * TILE + gtid.xy);
+    if (in_world(world)) {
+        uint index = (gtid.y + HALO) * SPAN + gtid.x + HALO;
+        target[world] = tile_grid[index];
+        next_humidity[world] = tile_humidity[index];
+        delta_out[world] = tile_delta[index];
+    }
+
+    if (thread_index < 4) {
+        InterlockedAdd(counters[thread_index], tile_counters[thread_index]);
+    }
+}
+
+#endif
@@ -0,0 +1,140 @@
+import json
+import os
+import re
+import shutil
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, NamedTuple
+
+import numpy as np
+
+# Arrays are stored as plain .npy files next to a JSON description, so a
+# snapshot loads with np.load(mmap_mode='r'): pages are only read when the
+# simulation touches them and forks loaded from one snapshot share them
+ARRAYS = ('grid', 'humidity', 'delta_humidity')
+META = 'snapshot.json'
+
+# Auto-checkpoints kept on disk, older ones are removed after a write
+CHECKPOINTS_KEPT = 2
+# Names of finished checkpoints. The .tmp and .old directories that
+# write_snapshot leaves behind when interrupted never match.
+CHECKPOINT_NAME = re.compile(r'step_\d{10}')
+
+
+class Snapshot(NamedTuple):
+    grid: np.ndarray
+    humidity: np.ndarray
+    # The engine's sticky humidity delta, needed to continue bit for bit
+    delta_humidity: np.ndarray
+    step: int
+    seed: int
+    wind: tuple[float, float]
+    rng_state: dict
+    params: dict[str, Any]
+
+
+def write_snapshot(path: str, snapshot: Snapshot) -> None:
+    # Written into a temporary directory and renamed into place. The
+    # previous snapshot is renamed aside first and only removed once the new
+    # one is in place, so a crash leaves the previous snapshot or the new
+    # one, at worst the previous one under its .old name between the two
+    # renames.
+    path = os.path.abspath(path)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    previous = f"{path}.{os.getpid()}.old"
+    if os.path.exists(temporary):
+        shutil.rmtree(temporary)
+    os.makedirs(temporary)
+
+    for name in ARRAYS:
+        np.save(os.path.join(temporary, name + '.npy'), np.ascontiguousarray(getattr(snapshot, name)))
+    meta = {
+        'step': int(snapshot.step),
+        'seed': int(snapshot.seed),
+        'wind': [float(snapshot.wind[0]), float(snapshot.wind[1])],
+        'rng_state': snapshot.rng_state,
+        'params': snapshot.params,
+    }
+    with open(os.path.join(temporary, META), 'w', encoding='utf-8') as file:
+        json.dump(meta, file, indent=4)
+
+    if os.path.exists(previous):
+        shutil.rmtree(previous)
+    if os.path.exists(path):
+        os.replace(path, previous)
+    os.replace(temporary, path)
+    if os.path.exists(previous):
+        shutil.rmtree(previous)
+
+
+def read_snapshot(path: str, mmap: bool = True) -> Snapshot:
+    with open(os.path.join(path, META), 'r', encoding='utf-8') as file:
+        meta = json.load(file)
+    arrays = {
+        name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r' if mmap else None)
+        for name in ARRAYS
+    }
+    return Snapshot(
+        step=meta['step'],
+        seed=meta['seed'],
+        wind=tuple(meta['wind']),
+        rng_state=meta['rng_state'],
+        params=meta['params'],
+        **arrays
+    )
+
+
+class Checkpointer:
+    def __init__(self, directory: str, every: int) -> None:
+        # Snapshots are written by a single background thread. A checkpoint
+        # that falls due while the previous one is still being written is
+        # taken at the first step after it finishes instead of waiting.
+        self.directory = directory
+        self.every = every
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="checkpoint")
+        self.pending: Future | None = None
+        self.next_step = every
+        self.error: BaseException | None = None
+
+    def due(self, step: int) -> bool:
+        if step < self.next_step:
+            return False
+        if self.pending is not None:
+            if not self.pending.done():
+                return False
+            self.collect()
+        return True
+
+    def collect(self) -> None:
+        error = self.pending.exception()
+        self.pending = None
+        if error is not None:
+            raise error
+
+    def submit(self, snapshot: Snapshot) -> None:
+        self.next_step = (snapshot.step // self.every + 1) * self.every
+        self.pending = self.executor.submit(self.write, snapshot)
+
+    def write(self, snapshot: Snapshot) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        write_snapshot(os.path.join(self.directory, f"step_{snapshot.step:010d}"), snapshot)
+
+        for name in finished_checkpoints(self.directory)[:-CHECKPOINTS_KEPT]:
+            shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+    def close(self) -> None:
+        if self.pending is not None:
+            self.pending.result()
+            self.pending = None
+        self.executor.shutdown()
+
+
+def finished_checkpoints(directory: str) -> list[str]:
+    # Oldest first, the step is zero-padded so names sort by it
+    return sorted(name for name in os.listdir(directory) if CHECKPOINT_NAME.fullmatch(name))
+
+
+def latest_checkpoint(directory: str) -> str | None:
+    if not os.path.isdir(directory):
+        return None
+    finished = finished_checkpoints(directory)
+    return os.path.join(directory, finished[-1]) if finished else None
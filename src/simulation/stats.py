@@ -0,0 +1,37 @@
+from typing import NamedTuple
+
+import numpy as np
+
+from src.simulation.types import Type, TRANSITIONS
+
+# Layout of the statistics buffer the compute engines fill every step, the
+# shader's STATS_* defines follow it: cells per Type, the TRANSITIONS
+# counters, then the bounding box of burning cells as min x, min y, max x,
+# max y. With nothing burning min stays above max.
+STATS_TRANSITIONS = len(Type)
+STATS_BOX = STATS_TRANSITIONS + len(TRANSITIONS)
+STATS_SIZE = STATS_BOX + 4
+NO_FIRE = (0xFFFFFFFF, 0xFFFFFFFF, 0, 0)
+
+
+class StepStats(NamedTuple):
+    counts: np.ndarray
+    transitions: np.ndarray
+    # Inclusive (min_x, min_y, max_x, max_y) in grid columns and rows, None
+    # when nothing burns
+    fire_box: tuple[int, int, int, int] | None
+
+    @classmethod
+    def from_buffer(cls, values: np.ndarray) -> "StepStats":
+        values = np.asarray(values, dtype=np.int64)
+        box = tuple(int(v) for v in values[STATS_BOX:STATS_SIZE])
+        return cls(
+            counts=values[:STATS_TRANSITIONS].copy(),
+            transitions=values[STATS_TRANSITIONS:STATS_BOX].copy(),
+            fire_box=box if box[0] <= box[2] else None
+        )
+
+    def as_dict(self) -> dict[str, int]:
+        result = {t.name.lower(): int(count) for t, count in zip(Type, self.counts)}
+        result.update(zip(TRANSITIONS, self.transitions.tolist()))
+        return result
@@ -8,3 +8,7 @@ class Type(IntEnum):
     LIGHTNING = 3
     ASH = 4
     WATER = 5
+
+
+# Per-step transition counters reported by the compute engines
+TRANSITIONS = ('lightning', 'ignited', 'burnt_out', 'regrown')
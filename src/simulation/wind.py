@@ -0,0 +1,37 @@
+import math
+
+
+class Wind:
+    # The part of pygame.Vector2 the simulation uses, so a headless Forest
+    # does not import pygame. rotate follows pygame: degrees, counter-clockwise.
+    __slots__ = ('x', 'y')
+
+    def __init__(self, x, y=None) -> None:
+        if y is None:
+            x, y = x
+        self.x = float(x)
+        self.y = float(y)
+
+    def __iter__(self):
+        yield self.x
+        yield self.y
+
+    def __len__(self) -> int:
+        return 2
+
+    def __getitem__(self, index: int) -> float:
+        return (self.x, self.y)[index]
+
+    def __repr__(self) -> str:
+        return f"Wind({self.x}, {self.y})"
+
+    def normalize(self) -> "Wind":
+        length = math.hypot(self.x, self.y)
+        if length == 0:
+            raise ValueError("Can't normalize Vector of length Zero")
+        return Wind(self.x / length, self.y / length)
+
+    def rotate(self, degrees: float) -> "Wind":
+        angle = math.radians(degrees)
+        cos, sin = math.cos(angle), math.sin(angle)
+        return Wind(cos * self.x - sin * self.y, sin * self.x + cos * self.y)
@@ -0,0 +1,445 @@
+import json
+import os
+
+import numpy as np
+
+from src.simulation.cpu_compute import OUTSIDE, box_any, dilate, next_state, transition_counts
+from src.simulation.helpers import cluster_field
+from src.simulation.packing import HUMIDITY_DTYPE, pack_nibbles, packed_width, unpack_nibbles
+from src.simulation.philox import noise_at
+from src.simulation.profiler import span
+from src.simulation.stats import StepStats
+from src.simulation.types import Type, TRANSITIONS
+from src.simulation.wind import Wind
+
+# A world is a directory:
+#
+#   world.json    size, page size, parameters, step, wind and generator state
+#   types.bin     cell types, 4 bits per cell
+#   humidity.bin  humidity, float16
+#   delta.bin     sticky humidity delta as DELTA_* codes, 4 bits per cell
+#   pages.npz     per page: hot flag, last step, land cells, type counts
+#
+# The .bin files are page-major, every PAGE x PAGE page is one contiguous run
+# of bytes, so paging one in is one read. Cells past the world's edge in the
+# last row and column of pages hold WATER and never change.
+WORLD_VERSION = 1
+PAGE = 256
+
+# Pages advanced by one next_state call
+BATCH_PAGES = 16
+
+# Regrowth a page missed while dormant is caught up in at most this many
+# passes when it is next run
+CATCH_UP_PASSES = 8
+
+# The sticky humidity delta only ever holds these values
+DELTA_NONE, DELTA_GROWTH, DELTA_FIRE = 0, 1, 2
+
+# Forest parameters a world uses
+WORLD_PARAMS = (
+    'tree_density',
+    'water_threshold',
+    'lightning_prob',
+    'growth_prob',
+    'spread_prob',
+    'humidity_change',
+    'humidity_change_fire',
+    'wind',
+    'wind_change',
+    'radius',
+)
+
+
+def page_terrain(seed: int,
+                 page: int,
+                 py: int,
+                 px: int,
+                 width: int,
+                 height: int,
+                 tree_density: float,
+                 water_threshold: float) -> tuple[np.ndarray, np.ndarray]:
+    # Humidity and cell types of one page, made from the page alone
+    y0, x0 = py * page, px * page
+    humidity = np.float32(0.5) + cluster_field(seed, 0, y0, x0, page, page)
+    cluster = cluster_field(seed, 1, y0, x0, page, page)
+    rng = np.random.default_rng([seed & 0xFFFFFFFFFFFFFFFF, 2, py, px])
+    trees = cluster + rng.standard_normal(size=cluster.shape, dtype=np.float32) * np.float32(0.1) >= 1 - tree_density
+
+    grid = np.zeros((page, page), dtype=np.uint8)
+    grid[trees] = Type.TREE
+    grid[humidity >= water_threshold] = Type.WATER
+    grid[max(0, height - y0):, :] = Type.WATER
+    grid[:, max(0, width - x0):] = Type.WATER
+    return humidity, grid
+
+
+def create_world(path: str,
+                 width: int,
+                 height: int,
+                 seed: int,
+                 tree_density: float,
+                 water_threshold: float,
+                 lightning_prob: float,
+                 growth_prob: float,
+                 spread_prob: float,
+                 humidity_change: float,
+                 humidity_change_fire: float,
+                 wind,
+                 wind_change: float,
+                 radius: int = 1,
+                 page: int = PAGE) -> None:
+    # Generates the world page by page straight into its files, memory use
+    # does not depend on the world size
+    if page % 2 or page < 2 * radius:
+        raise ValueError(f"Page size must be even and at least twice the radius, got {page}")
+    os.makedirs(path, exist_ok=True)
+    pages_y, pages_x = -(-height // page), -(-width // page)
+
+    hot = np.zeros((pages_y, pages_x), dtype=bool)
+    page_step = np.zeros((pages_y, pages_x), dtype=np.int64)
+    land = np.zeros((pages_y, pages_x), dtype=np.int64)
+    counts = np.zeros((pages_y, pages_x, len(Type)), dtype=np.int64)
+
+    with open(os.path.join(path, 'types.bin'), 'wb') as types_file, \
+            open(os.path.join(path, 'humidity.bin'), 'wb') as humidity_file:
+        for py in range(pages_y):
+            for px in range(pages_x):
+                humidity, grid = page_terrain(seed, page, py, px, width, height, tree_density, water_threshold)
+                types_file.write(pack_nibbles(grid).tobytes())
+                humidity_file.write(humidity.astype(HUMIDITY_DTYPE).tobytes())
+
+                inside = grid[:height - py * page, :width - px * page]
+                counts[py, px] = np.bincount(inside.ravel(), minlength=len(Type))
+                land[py, px] = inside.size - counts[py, px, Type.WATER]
+
+    # No deltas yet, a sparse file of zeros
+    with open(os.path.join(path, 'delta.bin'), 'wb') as delta_file:
+        delta_file.truncate(pages_y * pages_x * page * packed_width(page))
+
+    np.savez(os.path.join(path, 'pages.npz'), hot=hot, page_step=page_step, land=land, counts=counts)
+    with open(os.path.join(path, 'world.json'), 'w', encoding='utf-8') as file:
+        json.dump({
+            'version': WORLD_VERSION,
+            'width': width,
+            'height': height,
+            'page': page,
+            'seed': seed,
+            'step': 0,
+            'params': {
+                'tree_density': tree_density,
+                'water_threshold': water_threshold,
+                'lightning_prob': lightning_prob,
+                'growth_prob': growth_prob,
+                'spread_prob': spread_prob,
+                'humidity_change': humidity_change,
+                'humidity_change_fire': humidity_change_fire,
+                'wind_change': wind_change,
+                'radius': radius,
+            },
+            'wind': list(Wind(wind).normalize()),
+            'rng_state': np.random.default_rng(seed).bit_generator.state,
+        }, file, indent=2)
+
+
+class TiledWorld:
+    def __init__(self, path: str, batch_pages: int = BATCH_PAGES) -> None:
+        # A world too large for memory, stepped out of core. Pages holding
+        # fire, lightning or ash are hot; every step the hot pages and their
+        # neighbours are paged in a few rows at a time, advanced by
+        # next_state in batches with a halo of 2 * radius cells and written
+        # back. Memory use follows the burning area, not the world size.
+        #
+        # Run pages draw the same Philox numbers as a dense run. The other
+        # pages are dormant: humidity drift is caught up exactly when they
+        # are next read, lightning is drawn per page from a binomial like
+        # ActiveTiles does, and regrowth is caught up approximately in up
+        # to CATCH_UP_PASSES passes when they next run.
+        with open(os.path.join(path, 'world.json'), encoding='utf-8') as file:
+            meta = json.load(file)
+        if meta['version'] != WORLD_VERSION:
+            raise ValueError(f"{path} is a version {meta['version']} world, expected {WORLD_VERSION}")
+
+        self.path = path
+        self.batch_pages = batch_pages
+        self.width = meta['width']
+        self.height = meta['height']
+        self.page = meta['page']
+        self.seed = meta['seed']
+        self.step = meta['step']
+        params = meta['params']
+        self.tree_density = params['tree_density']
+        self.water_threshold = params['water_threshold']
+        self.lightning_prob = params['lightning_prob']
+        self.growth_prob = params['growth_prob']
+        self.spread_prob = params['spread_prob']
+        self.humidity_change = params['humidity_change']
+        self.humidity_change_fire = params['humidity_change_fire']
+        self.wind_change = params['wind_change']
+        self.radius = params['radius']
+        self.wind = Wind(meta['wind'])
+        self.rng = np.random.default_rng()
+        self.rng.bit_generator.state = meta['rng_state']
+
+        # Delta codes to the float16 values next_state would have written
+        self.delta_values = np.array(
+            [0, self.humidity_change, self.humidity_change_fire], dtype=np.float16
+        ).astype(np.float32)
+
+        self.pages_y = -(-self.height // self.page)
+        self.pages_x = -(-self.width // self.page)
+        packed = (self.pages_y, self.pages_x, self.page, packed_width(self.page))
+        self.types = np.memmap(os.path.join(path, 'types.bin'), dtype=np.uint8, mode='r+', shape=packed)
+        self.delta = np.memmap(os.path.join(path, 'delta.bin'), dtype=np.uint8, mode='r+', shape=packed)
+        self.humidity = np.memmap(os.path.join(path, 'humidity.bin'), dtype=HUMIDITY_DTYPE, mode='r+',
+                                  shape=(self.pages_y, self.pages_x, self.page, self.page))
+        with np.load(os.path.join(path, 'pages.npz')) as pages:
+            self.hot = pages['hot']
+            self.page_step = pages['page_step']
+            self.land = pages['land']
+            self.counts = pages['counts']
+
+        # Statistics of the last step, and the most pages held at once
+        self.transitions = np.zeros(len(TRANSITIONS), dtype=np.int64)
+        self.fire_box = None
+        self.peak_pages = 0
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return self.height, self.width
+
+    def stats(self) -> StepStats:
+        return StepStats(self.counts.sum(axis=(0, 1)), self.transitions.copy(), self.fire_box)
+
+    def load_page(self, py: int, px: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # (types, humidity, delta codes) of a page as of the current step.
+        # clip(h + d) applied n times equals clip(h + n * d) while d is fixed.
+        types = unpack_nibbles(self.types[py, px], self.page)
+        codes = unpack_nibbles(self.delta[py, px], self.page)
+        humidity = self.humidity[py, px].astype(np.float32)
+        missing = self.step - self.page_step[py, px]
+        if missing > 0 and codes.any():
+            drift = self.delta_values[codes]
+            humidity = np.clip(humidity + np.float32(missing) * drift, 0.5, 1.5)
+        return types, humidity, codes
+
+    def store_page(self, py: int, px: int, types: np.ndarray, humidity: np.ndarray, codes: np.ndarray) -> None:
+        self.types[py, px] = pack_nibbles(types)
+        self.delta[py, px] = pack_nibbles(codes)
+        self.humidity[py, px] = humidity
+        inside = types[:self.height - py * self.page, :self.width - px * self.page]
+        self.counts[py, px] = np.bincount(inside.ravel(), minlength=len(Type))[:len(Type)]
+
+    def regrow(self, py: int, px: int, types: np.ndarray, codes: np.ndarray) -> None:
+        # Approximate catch-up of the growth a dormant page missed: each pass
+        # grows empty cells next to trees with the chance of growing at
+        # least once in missed / passes steps
+        missed = self.step - self.page_step[py, px]
+        if missed <= 0 or self.growth_prob == 0:
+            return
+        passes = min(missed, CATCH_UP_PASSES)
+        chance = np.float32(1 - (1 - self.growth_prob) ** (missed / passes))
+        rng = np.random.default_rng([self.seed & 0xFFFFFFFFFFFFFFFF, 3, self.step, py, px])
+        for _ in range(passes):
+            grown = ((types == Type.EMPTY) & box_any(types == Type.TREE, self.radius)
+                     & (rng.random(types.shape, dtype=np.float32) < chance))
+            types[grown] = Type.TREE
+            if self.humidity_change != 0:
+                codes[box_any(grown, self.radius)] = DELTA_GROWTH
+
+    def read_region(self, y0: int, x0: int, height: int, width: int) -> tuple[np.ndarray, np.ndarray]:
+        # Types and humidity of a rectangle of the world, for viewers
+        grid = np.zeros((height, width), dtype=np.uint8)
+        humidity = np.zeros((height, width), dtype=np.float32)
+        for py in range(y0 // self.page, (y0 + height - 1) // self.page + 1):
+            for px in range(x0 // self.page, (x0 + width - 1) // self.page + 1):
+                types, page_humidity, _ = self.load_page(py, px)
+                top, left = py * self.page, px * self.page
+                rows = slice(max(y0, top), min(y0 + height, top + self.page))
+                columns = slice(max(x0, left), min(x0 + width, left + self.page))
+                target = (slice(rows.start - y0, rows.stop - y0), slice(columns.start - x0, columns.stop - x0))
+                source = (slice(rows.start - top, rows.stop - top), slice(columns.start - left, columns.stop - left))
+                grid[target] = types[source]
+                humidity[target] = page_humidity[source]
+        return grid, humidity
+
+    def window(self, pages: dict, py: int, px: int, halo: int) -> tuple[np.ndarray, np.ndarray]:
+        # Types and humidity of a page with halo cells from its neighbours,
+        # OUTSIDE beyond the last page
+        page = self.page
+        size = page + 2 * halo
+        grid = np.full((size, size), OUTSIDE, dtype=np.uint8)
+        humidity = np.ones((size, size), dtype=np.float32)
+        spans = {-1: (slice(page - halo, page), slice(0, halo)),
+                 0: (slice(0, page), slice(halo, halo + page)),
+                 1: (slice(0, halo), slice(halo + page, size))}
+        for dy, (source_rows, target_rows) in spans.items():
+            for dx, (source_columns, target_columns) in spans.items():
+                state = pages.get((py + dy, px + dx))
+                if state is not None:
+                    grid[target_rows, target_columns] = state[0][source_rows, source_columns]
+                    humidity[target_rows, target_columns] = state[1][source_rows, source_columns]
+        return grid, humidity
+
+    def run_batch(self, pages: dict, batch: list[tuple[int, int]], run: np.ndarray, wind: np.ndarray) -> dict:
+        # Advances a batch of run pages, returns their new (types, humidity,
+        # codes) and accumulates the step's statistics
+        page, radius = self.page, self.radius
+        halo = 2 * radius
+        size = page + 2 * halo
+        inner = (slice(None), slice(halo, halo + page), slice(halo, halo + page))
+
+        windows = [self.window(pages, py, px, halo) for py, px in batch]
+        grid = np.stack([w[0] for w in windows])
+        humidity = np.stack([w[1] for w in windows])
+
+        ys = np.array([py for py, _ in batch])[:, None, None] * page - halo + np.arange(size)[None, :, None]
+        xs = np.array([px for _, px in batch])[:, None, None] * page - halo + np.arange(size)[None, None, :]
+        with span('noise'):
+            noise = noise_at(self.seed, self.step, xs, ys)
+
+        # Deltas are gathered below so halo cells of dormant pages, which do
+        # not change, do not leave any
+        with span('next_state'):
+            new_grid = next_state(
+                grid,
+                humidity,
+                noise,
+                wind,
+                np.zeros(grid.shape, dtype=np.float16),
+                self.growth_prob,
+                self.spread_prob,
+                self.lightning_prob,
+                0,
+                0,
+                radius
+            )
+
+        # Cells within radius of the page have their whole neighbourhood in
+        # the window, so their transitions equal their own page's
+        running = np.zeros(grid.shape, dtype=bool)
+        blocks = ((-1, slice(0, halo)), (0, slice(halo, halo + page)), (1, slice(halo + page, size)))
+        for k, (py, px) in enumerate(batch):
+            for dy, rows in blocks:
+                for dx, columns in blocks:
+                    y, x = py + dy, px + dx
+                    if 0 <= y < self.pages_y and 0 <= x < self.pages_x:
+                        running[k, rows, columns] = run[y, x]
+        grown = (grid == Type.EMPTY) & (new_grid == Type.TREE) & running
+        ignited = (grid == Type.TREE) & (new_grid == Type.BURNING) & running
+        growth_near = box_any(grown, radius)[inner]
+        fire_near = box_any(ignited, radius)[inner]
+
+        results = {}
+        for k, (py, px) in enumerate(batch):
+            old_types = grid[k, halo:halo + page, halo:halo + page]
+            types = new_grid[k, halo:halo + page, halo:halo + page]
+            codes = pages[(py, px)][2].copy()
+            if self.humidity_change != 0:
+                codes[growth_near[k]] = DELTA_GROWTH
+            if self.humidity_change_fire != 0:
+                codes[fire_near[k]] = DELTA_FIRE
+            page_humidity = np.clip(humidity[inner][k] + self.delta_values[codes], 0.5, 1.5)
+            results[(py, px)] = (types, page_humidity, codes)
+
+            self.transitions += transition_counts(old_types, types)
+            self.hot[py, px] = np.isin(types, (Type.BURNING, Type.LIGHTNING, Type.ASH)).any()
+            burning_rows, burning_columns = np.nonzero(types == Type.BURNING)
+            if len(burning_rows):
+                box = (px * page + int(burning_columns.min()), py * page + int(burning_rows.min()),
+                       px * page + int(burning_columns.max()), py * page + int(burning_rows.max()))
+                self.fire_box = box if self.fire_box is None else (
+                    min(self.fire_box[0], box[0]), min(self.fire_box[1], box[1]),
+                    max(self.fire_box[2], box[2]), max(self.fire_box[3], box[3]))
+        return results
+
+    def next_gen(self) -> StepStats:
+        # Rows of run pages are processed top to bottom. Row py needs the old
+        # state of rows py - 1 to py + 1, so once it is done the new state of
+        # rows above it is written back and their pages are dropped.
+        self.transitions = np.zeros(len(TRANSITIONS), dtype=np.int64)
+        self.fire_box = None
+        run = dilate(self.hot)
+        wind = np.array([self.wind.x, self.wind.y], dtype=np.float32)
+
+        pages = {}
+        pending = {}
+
+        def load(py: int, px: int) -> None:
+            if (py, px) in pages or not (0 <= py < self.pages_y and 0 <= px < self.pages_x):
+                return
+            types, humidity, codes = self.load_page(py, px)
+            if run[py, px]:
+                self.regrow(py, px, types, codes)
+            pages[(py, px)] = (types, humidity, codes)
+
+        def commit(before_row: int) -> None:
+            for key in [key for key in pending if key[0] < before_row]:
+                self.store_page(*key, *pending.pop(key))
+                self.page_step[key] = self.step + 1
+            for key in [key for key in pages if key[0] < before_row]:
+                del pages[key]
+
+        for py in np.unique(np.nonzero(run)[0]):
+            columns = np.nonzero(run[py])[0]
+            with span('page_in'):
+                for px in columns:
+                    for dy in (-1, 0, 1):
+                        for dx in (-1, 0, 1):
+                            load(py + dy, px + dx)
+            self.peak_pages = max(self.peak_pages, len(pages) + len(pending))
+
+            for start in range(0, len(columns), self.batch_pages):
+                batch = [(int(py), int(px)) for px in columns[start:start + self.batch_pages]]
+                pending.update(self.run_batch(pages, batch, run, wind))
+
+            with span('page_out'):
+                commit(py)
+        with span('page_out'):
+            commit(self.pages_y)
+
+        self.transitions[TRANSITIONS.index('lightning')] += self.strike_dormant(~run)
+
+        self.step += 1
+        self.wind = self.wind.rotate(
+            (2 * self.rng.random() - 1) * self.wind_change)
+        return self.stats()
+
+    def strike_dormant(self, dormant: np.ndarray) -> int:
+        # Each land cell of a dormant page is hit with lightning_prob, so the
+        # number of strikes per page is binomial and the cells uniform
+        rng = np.random.default_rng((self.seed & 0xFFFFFFFFFFFFFFFF, self.step))
+        strikes = np.zeros(dormant.shape, dtype=np.int64)
+        strikes[dormant] = rng.binomial(self.land[dormant], self.lightning_prob)
+
+        for py, px in zip(*np.nonzero(strikes)):
+            types = unpack_nibbles(self.types[py, px], self.page)
+            inside = np.zeros(types.shape, dtype=bool)
+            inside[:self.height - py * self.page, :self.width - px * self.page] = True
+            land = np.flatnonzero((types != Type.WATER) & inside)
+            hit = np.unravel_index(rng.choice(land, size=strikes[py, px], replace=False), types.shape)
+            np.subtract.at(self.counts[py, px], types[hit], 1)
+            types[hit] = Type.LIGHTNING
+            self.counts[py, px, Type.LIGHTNING] += len(hit[0])
+            self.types[py, px] = pack_nibbles(types)
+            self.hot[py, px] = True
+        return int(strikes.sum())
+
+    def flush(self) -> None:
+        for array in (self.types, self.delta, self.humidity):
+            array.flush()
+        temporary = os.path.join(self.path, 'pages.tmp.npz')
+        np.savez(temporary, hot=self.hot, page_step=self.page_step, land=self.land, counts=self.counts)
+        os.replace(temporary, os.path.join(self.path, 'pages.npz'))
+
+        meta_path = os.path.join(self.path, 'world.json')
+        with open(meta_path, encoding='utf-8') as file:
+            meta = json.load(file)
+        meta.update(step=self.step, wind=list(self.wind), rng_state=self.rng.bit_generator.state)
+        with open(meta_path + '.tmp', 'w', encoding='utf-8') as file:
+            json.dump(meta, file, indent=2)
+        os.replace(meta_path + '.tmp', meta_path)
+
+    def close(self) -> None:
+        self.flush()
+        del self.types, self.delta, self.humidity
@@ -0,0 +1,171 @@
+import argparse
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Dict, List
+
+import numpy as np
+
+from src.config import load_forest_config
+from src.simulation.forest import Forest
+from src.simulation.history import COLUMNS
+from src.simulation.types import Type
+
+# Outputs of a single Forest run, switched off for every member since they
+# would all write the same files. They are left out of the run ids. The
+# terrain cache stays shared on purpose, its writes are atomic.
+PER_RUN_OUTPUTS = {'record_path': None, 'checkpoint_every': None, 'history_path': None}
+
+
+def expand_grid(param_grid: Dict[str, List[Any]]) -> List[Dict[str, Any]]:
+    names = sorted(param_grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(param_grid[n] for n in names))]
+
+
+def make_run_id(params: Dict[str, Any], seed: int) -> str:
+    key = json.dumps({'params': params, 'seed': seed}, sort_keys=True)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+
+def run_member(run_id: str, params: Dict[str, Any], seed: int, steps: int, shm_name: str) -> Dict[str, Any]:
+    # Step histories go straight into the parent's shared memory block, only
+    # the small summary dict is pickled back
+    shm = SharedMemory(name=shm_name)
+    try:
+        history = np.ndarray((steps, len(COLUMNS)), dtype=np.int64, buffer=shm.buf)
+        forest = Forest(**dict(params, **PER_RUN_OUTPUTS), seed=seed)
+        burnt = np.zeros(forest.shape, dtype=bool)
+        had_fire = False
+        extinction = -1
+
+        for step in range(steps):
+            # Counts come reduced from the engine, the grid is only copied
+            # back while something burns and only read inside the fire box
+            forest.next_gen(step)
+            stats = forest.stats
+            history[step, 0] = step
+            history[step, 1:] = stats.counts
+            if stats.fire_box is not None:
+                forest.sync_to_host()
+                min_x, min_y, max_x, max_y = stats.fire_box
+                window = (slice(min_y, max_y + 1), slice(min_x, max_x + 1))
+                burnt[window] |= forest.grid[window] == Type.BURNING
+
+            # Time of the last extinction: lightning can start a new fire
+            # after one went out, -1 while a fire is still going at the end
+            if stats.counts[Type.BURNING] + stats.counts[Type.LIGHTNING]:
+                had_fire = True
+                extinction = -1
+            elif had_fire and extinction < 0:
+                extinction = step
+
+        burning = history[:, 1 + Type.BURNING]
+        summary = {
+            'burnt_area': int(np.count_nonzero(burnt)),
+            'burnt_fraction': float(np.count_nonzero(burnt) / burnt.size),
+            'time_to_extinction': extinction,
+            'peak_fire': int(burning.max()) if steps else 0,
+            'peak_fire_step': int(burning.argmax()) if steps else -1,
+        }
+        del history
+        return summary
+    finally:
+        shm.close()
+
+
+def write_part(path: str, run_id: str, params: Dict[str, Any], seed: int,
+               summary: Dict[str, Any], history: np.ndarray) -> None:
+    import pandas as pd
+    row = {'run_id': run_id, 'seed': seed}
+    row.update({name: json.dumps(value) if isinstance(value, (list, tuple)) else value
+                for name, value in params.items()})
+    row.update(summary)
+    row.update({name: history[:, i].copy() for i, name in enumerate(COLUMNS)})
+    pd.DataFrame([row]).to_parquet(path, index=False)
+
+
+def run_sweep(param_grid: Dict[str, List[Any]],
+              seeds: List[int],
+              steps: int,
+              output: str,
+              workers: int = None,
+              base_params: Dict[str, Any] = None) -> None:
+    import pandas as pd
+
+    base = load_forest_config()
+    base.update(backend='cpu', resident=True, double_buffered=False)
+    base.update(base_params or {})
+
+    runs = []
+    for overrides in expand_grid(param_grid):
+        params = dict(base, **overrides)
+        for seed in seeds:
+            runs.append((make_run_id(params, seed), params, seed))
+
+    # Every finished run leaves a part file, so a resumed sweep skips it
+    parts_dir = output + '.parts'
+    os.makedirs(parts_dir, exist_ok=True)
+    todo = [run for run in runs if not os.path.exists(os.path.join(parts_dir, run[0] + '.parquet'))]
+    print(f"{len(runs)} runs, {len(runs) - len(todo)} already done")
+
+    workers = workers or os.cpu_count()
+    block_size = max(steps, 1) * len(COLUMNS) * np.dtype(np.int64).itemsize
+    failed = 0
+
+    with multiprocessing.get_context('spawn').Pool(workers) as pool:
+        queue = list(reversed(todo))
+        in_flight = {}
+        while queue or in_flight:
+            while queue and len(in_flight) < 2 * workers:
+                run_id, params, seed = queue.pop()
+                shm = SharedMemory(create=True, size=block_size)
+                result = pool.apply_async(run_member, (run_id, params, seed, steps, shm.name))
+                in_flight[run_id] = (result, shm, params, seed)
+
+            done = [run_id for run_id, (result, *_) in in_flight.items() if result.ready()]
+            if not done:
+                next(iter(in_flight.values()))[0].wait(0.05)
+                continue
+
+            for run_id in done:
+                result, shm, params, seed = in_flight.pop(run_id)
+                try:
+                    summary = result.get()
+                    history = np.ndarray((steps, len(COLUMNS)), dtype=np.int64, buffer=shm.buf)
+                    write_part(os.path.join(parts_dir, run_id + '.parquet'), run_id, params, seed, summary, history)
+                    del history
+                except Exception as error:
+                    failed += 1
+                    print(f"Run {run_id} (seed {seed}) failed: {error!r}")
+                finally:
+                    shm.close()
+                    shm.unlink()
+
+    parts = [os.path.join(parts_dir, run_id + '.parquet') for run_id, _, _ in runs]
+    frames = [pd.read_parquet(path) for path in parts if os.path.exists(path)]
+    if frames:
+        pd.concat(frames, ignore_index=True).to_parquet(output, index=False)
+    print(f"Wrote {len(frames)} runs to {output}" + (f", {failed} failed" if failed else ""))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Headless parameter sweep over Forest runs")
+    parser.add_argument('--grid', required=True,
+                        help='JSON file mapping parameter names to lists of values')
+    parser.add_argument('--seeds', type=int, default=10, help='number of seeds per parameter set')
+    parser.add_argument('--seed-start', type=int, default=0)
+    parser.add_argument('--steps', type=int, default=1000)
+    parser.add_argument('--output', default='sweep.parquet')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--size', type=int, default=None)
+    args = parser.parse_args()
+
+    with open(args.grid, 'r', encoding='utf-8') as file:
+        param_grid = json.load(file)
+
+    base_params = {'size': args.size} if args.size else None
+    seeds = list(range(args.seed_start, args.seed_start + args.seeds))
+    run_sweep(param_grid, seeds, args.steps, args.output, args.workers, base_params)
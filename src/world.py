@@ -0,0 +1,54 @@
+import argparse
+import resource
+import time
+
+from src.config import load_forest_config
+from src.simulation.world import PAGE, WORLD_PARAMS, TiledWorld, create_world
+from src.simulation.types import Type
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Create and run tiled worlds larger than memory")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    create = commands.add_parser('create', help='generate a world with the parameters of config/config.json')
+    create.add_argument('path', help='directory to write the world to')
+    create.add_argument('--width', type=int, required=True)
+    create.add_argument('--height', type=int, required=True)
+    create.add_argument('--seed', type=int, default=1234)
+    create.add_argument('--page', type=int, default=PAGE, help='cells per page side')
+
+    run = commands.add_parser('run', help='advance a world and write it back')
+    run.add_argument('path')
+    run.add_argument('--steps', type=int, default=100)
+    run.add_argument('--report-every', type=int, default=10)
+
+    args = parser.parse_args()
+
+    if args.command == 'create':
+        config = load_forest_config()
+        params = {key: config[key] for key in WORLD_PARAMS}
+        start = time.perf_counter()
+        create_world(args.path, args.width, args.height, args.seed, page=args.page, **params)
+        print(f"Created {args.width}x{args.height} world in {args.path} ({time.perf_counter() - start:.1f} s)")
+        return
+
+    world = TiledWorld(args.path)
+    print(f"{'step':>8} {'hot pages':>10} {'burning':>10} {'trees':>12} {'steps/s':>8}")
+    start = time.perf_counter()
+    try:
+        for index in range(1, args.steps + 1):
+            stats = world.next_gen()
+            if index % args.report_every == 0 or index == args.steps:
+                rate = index / (time.perf_counter() - start)
+                print(f"{world.step:8d} {int(world.hot.sum()):10d} {stats.counts[Type.BURNING]:10d} "
+                      f"{stats.counts[Type.TREE]:12d} {rate:8.2f}")
+    finally:
+        world.close()
+    # ru_maxrss is in kilobytes on Linux
+    print(f"{world.pages_y * world.pages_x} pages, at most {world.peak_pages} in memory, "
+          f"peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+import math
+
+import numpy as np
+import pytest
+
+from benchmarks.common import create_forest
+from src.simulation.cpu_compute import next_state, next_state_wide
+from src.simulation.types import Type
+
+PARAMS = {
+    'growth_prob': 0.6,
+    'spread_prob': 0.9,
+    'lightning_prob': 0.05,
+    'humidity_change': 0.01,
+    'humidity_change_fire': -0.02,
+}
+
+
+def random_state(rng: np.random.Generator, shape: tuple[int, int]):
+    grid = rng.choice(len(Type), size=shape, p=[0.25, 0.35, 0.15, 0.05, 0.1, 0.1]).astype(np.uint8)
+    humidity = rng.uniform(0.5, 1.5, shape).astype(np.float32)
+    noise = [rng.random(shape, dtype=np.float32) for _ in range(4)]
+    angle = rng.uniform(0, 2 * np.pi)
+    wind = np.array([np.cos(angle), np.sin(angle)], dtype=np.float32)
+    return grid, humidity, noise, wind
+
+
+def spread_factor(offset, wind):
+    norm = math.hypot(*offset)
+    dot = -offset[0] / norm * wind[0] - offset[1] / norm * wind[1]
+    return math.acos(max(-1.0, min(1.0, dot))) / math.pi
+
+
+def reference_state(grid, humidity, noise, wind, delta, radius, combined=None):
+    # shader.hlsl's next_state cell by cell. At radius 1 the first burning
+    # cell in loop order, dx outer and dy inner, decides the wind angle,
+    # beyond it (or when combined) every burning cell is a separate chance.
+    # Humidity writes of fire land after those of growth.
+    if combined is None:
+        combined = radius > 1
+    height, width = grid.shape
+    lightning, burn_out, growth, spread = noise
+    offsets = [(dx, dy) for dx in range(-radius, radius + 1) for dy in range(-radius, radius + 1)
+               if (dx, dy) != (0, 0)]
+
+    def neighbors(x, y):
+        for dx, dy in offsets:
+            if 0 <= x + dx < width and 0 <= y + dy < height:
+                yield dx, dy, grid[y + dy, x + dx]
+
+    new_grid = grid.copy()
+    grown, ignited = [], []
+    for y in range(height):
+        for x in range(width):
+            state = grid[y, x]
+            if state == Type.WATER:
+                continue
+            if lightning[y, x] < PARAMS['lightning_prob']:
+                new_grid[y, x] = Type.LIGHTNING
+            elif state == Type.LIGHTNING:
+                new_grid[y, x] = Type.BURNING
+            elif state == Type.BURNING:
+                if burn_out[y, x] < 0.5 + 0.5 * (humidity[y, x] - 0.5):
+                    new_grid[y, x] = Type.ASH
+            elif state == Type.ASH:
+                new_grid[y, x] = Type.EMPTY
+            elif state == Type.EMPTY:
+                if (any(cell == Type.TREE for _, _, cell in neighbors(x, y))
+                        and growth[y, x] < PARAMS['growth_prob']):
+                    new_grid[y, x] = Type.TREE
+                    grown.append((x, y))
+            elif state == Type.TREE:
+                fires = [(dx, dy) for dx, dy, cell in neighbors(x, y) if cell == Type.BURNING]
+                base = PARAMS['spread_prob'] * (2 - humidity[y, x])
+                if combined:
+                    keep = math.prod(max(0.0, 1 - base * spread_factor(fire, wind)) for fire in fires)
+                    chance = 1 - keep
+                else:
+                    chance = base * spread_factor(fires[0], wind) if fires else 0
+                if spread[y, x] < chance:
+                    new_grid[y, x] = Type.BURNING
+                    ignited.append((x, y))
+
+    for cells, change in ((grown, PARAMS['humidity_change']), (ignited, PARAMS['humidity_change_fire'])):
+        for x, y in cells:
+            delta[max(0, y - radius):y + radius + 1, max(0, x - radius):x + radius + 1] = change
+    return new_grid
+
+
+@pytest.mark.parametrize("radius", [1, 2, 3, 5])
+def test_next_state_matches_reference(radius):
+    rng = np.random.default_rng(radius)
+    for shape in [(12, 10), (9, 17)]:
+        grid, humidity, noise, wind = random_state(rng, shape)
+        delta = np.zeros(shape, dtype=np.float16)
+        expected_delta = np.zeros(shape, dtype=np.float16)
+
+        new_grid = next_state(grid, humidity, noise, wind, delta, radius=radius, **PARAMS)
+        expected = reference_state(grid, humidity, noise, wind, expected_delta, radius)
+
+        assert np.array_equal(new_grid, expected)
+        assert np.array_equal(delta, expected_delta)
+
+
+def test_wide_kernel_at_radius_one():
+    # The wide kernel run at radius 1 combines the eight neighbours, next_state
+    # takes the first burning one. Both agree on everything else.
+    grid, humidity, noise, wind = random_state(np.random.default_rng(7), (32, 24))
+    delta = np.zeros(grid.shape, dtype=np.float16)
+    wide_delta = np.zeros(grid.shape, dtype=np.float16)
+    expected_delta = np.zeros(grid.shape, dtype=np.float16)
+
+    result = next_state_wide(grid, humidity, noise, wind, wide_delta, radius=1, **PARAMS)
+    expected = reference_state(grid, humidity, noise, wind, expected_delta, 1, combined=True)
+    first = next_state(grid, humidity, noise, wind, delta, radius=1, **PARAMS)
+
+    assert np.array_equal(result, expected)
+    assert np.array_equal(wide_delta, expected_delta)
+    differs = result != first
+    assert differs.any()
+    assert np.all((grid[differs] == Type.TREE) & (result[differs] == Type.BURNING))
+
+
+@pytest.mark.parametrize("resident", [False, True])
+@pytest.mark.parametrize("radius", [1, 2])
+def test_advance_matches_next_gen(resident, radius):
+    # advance(n) draws the same winds and steps the same generations as n
+    # calls of next_gen, transition counts included
+    params = dict(backend="cpu", size=48, seed=1234, radius=radius, resident=resident, lightning_prob=0.002)
+    forest = create_forest(**params)
+    reference = create_forest(**params)
+
+    counts = forest.advance(12, counters=True)
+    expected = {name: 0 for name in counts}
+    for frame in range(12):
+        reference.next_gen(frame)
+        for name, value in zip(counts, reference.stats.transitions.tolist()):
+            expected[name] += value
+    forest.sync_to_host()
+    reference.sync_to_host()
+
+    assert forest.step == reference.step
+    assert np.array_equal(forest.grid, reference.grid)
+    assert np.array_equal(forest.humidity, reference.humidity)
+    assert counts == expected
+    assert sum(counts.values()) > 0
+    forest.close()
+    reference.close()
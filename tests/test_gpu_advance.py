@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from benchmarks.common import create_forest
+
+
+def gpu_forest(**overrides):
+    # Skips when compushady or a usable device is missing
+    pytest.importorskip("compushady")
+    try:
+        return create_forest(backend="gpu", size=64, seed=1234, **overrides)
+    except Exception as error:
+        pytest.skip(f"GPU backend unavailable: {error!r}")
+
+
+@pytest.mark.parametrize("radius", [1, 2, 3])
+def test_advance_without_resident_state(radius):
+    # advance on a non-resident engine builds the resident dispatches it
+    # needs and matches a resident forest stepped one generation at a time
+    forest = gpu_forest(radius=radius)
+    reference = gpu_forest(radius=radius, resident=True)
+
+    counts = forest.advance(10, counters=True)
+    expected = {name: 0 for name in counts}
+    for frame in range(10):
+        reference.next_gen(frame)
+        for name, value in zip(counts, reference.stats.transitions.tolist()):
+            expected[name] += value
+    reference.sync_to_host()
+
+    assert np.array_equal(forest.grid, reference.grid)
+    assert np.array_equal(forest.humidity, reference.humidity)
+    assert counts == expected
+
+
+@pytest.mark.parametrize("double_buffered", [False, True])
+def test_grid_kept_across_steps(double_buffered):
+    # Non-resident grids come out of reused staging slots, a grid held by
+    # the caller must not change with later steps
+    forest = gpu_forest(double_buffered=double_buffered)
+    held = []
+    for frame in range(4):
+        forest.next_gen(frame)
+        held.append((forest.grid, forest.grid.copy()))
+    for grid, expected in held:
+        assert np.array_equal(grid, expected)
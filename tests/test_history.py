@@ -0,0 +1,48 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.common import create_forest
+from src.simulation.history import History
+from src.simulation.types import Type
+
+
+@pytest.mark.parametrize("extension", [".csv", ".parquet"])
+def test_limit_and_path_stream_every_row(tmp_path, extension):
+    path = str(tmp_path / f"history{extension}")
+    history = History(limit=3, path=path)
+    for step in range(10):
+        history.append(step, np.full(len(Type), step))
+        assert len(history) <= 3
+    history.close()
+
+    frame = pd.read_csv(path) if extension == ".csv" else pd.read_parquet(path)
+    assert frame['step'].tolist() == list(range(10))
+
+
+def test_existing_file_is_kept(tmp_path):
+    path = str(tmp_path / "history.csv")
+    for run in range(3):
+        history = History(path=path)
+        history.append(run, np.zeros(len(Type)))
+        history.close()
+
+    assert sorted(os.listdir(tmp_path)) == ["history.1.csv", "history.2.csv", "history.csv"]
+    assert pd.read_csv(tmp_path / "history.csv")['step'].tolist() == [0]
+    assert pd.read_csv(tmp_path / "history.2.csv")['step'].tolist() == [2]
+
+
+def test_reset_keeps_the_previous_run(tmp_path):
+    path = str(tmp_path / "history.csv")
+    forest = create_forest(backend="cpu", size=32, seed=1, history_path=path)
+    for frame in range(3):
+        forest.next_gen(frame)
+    forest.simulation_reset(2)
+    for frame in range(2):
+        forest.next_gen(frame)
+    forest.close()
+
+    assert len(pd.read_csv(path)) == 3
+    assert len(pd.read_csv(tmp_path / "history.1.csv")) == 2
@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+
+from benchmarks.common import create_forest
+
+
+@pytest.mark.parametrize("radius", [1, 2])
+@pytest.mark.parametrize("workers", [2, (2, 3)], ids=["strips", "blocks"])
+def test_partitioned_matches_cpu(workers, radius):
+    # Noise is drawn from world coordinates and every block steps with a
+    # 2 * radius halo, so strips and 2D blocks reproduce the single-process
+    # engine. The workers are spawned, run_worker lives at module level.
+    params = dict(size=60, seed=77, radius=radius, resident=True, lightning_prob=0.002)
+    forest = create_forest(backend="partitioned", workers=workers, **params)
+    reference = create_forest(backend="cpu", **params)
+    try:
+        for frame in range(60):
+            forest.next_gen(frame)
+            reference.next_gen(frame)
+            assert np.array_equal(forest.stats.counts, reference.stats.counts), frame
+            assert np.array_equal(forest.stats.transitions, reference.stats.transitions), frame
+            assert forest.stats.fire_box == reference.stats.fire_box, frame
+
+        forest.sync_to_host()
+        reference.sync_to_host()
+        assert np.array_equal(forest.grid, reference.grid)
+        assert np.array_equal(forest.humidity, reference.humidity)
+        assert np.array_equal(forest.compute_engine.download_delta(), reference.compute_engine.download_delta())
+        assert reference.stats.transitions.sum() > 0
+    finally:
+        forest.close()
+        reference.close()
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from benchmarks.common import create_forest
+from src.game.replay import ReplayPlayer, SEEK
+from src.simulation.recording import Recording, dequantize_humidity, quantize_humidity
+
+KEYFRAME_EVERY = 4
+
+
+@pytest.fixture
+def recorded(tmp_path):
+    # A recorded run and the frames it showed live: the constructor
+    # records the initial state, next_gen every following step
+    path = str(tmp_path / "run.ffr")
+    forest = create_forest(backend="cpu", size=40, seed=21, lightning_prob=0.002,
+                           record_path=path, record_keyframe_every=KEYFRAME_EVERY)
+    live = [(forest.step, forest.grid.copy(), forest.humidity.copy(), tuple(forest.wind))]
+    for frame in range(13):
+        forest.next_gen(frame)
+        live.append((forest.step, forest.grid.copy(), forest.humidity.copy(), tuple(forest.wind)))
+    forest.close()
+    return path, live
+
+
+def assert_frame(frame, expected):
+    step, grid, humidity, wind = frame
+    expected_step, expected_grid, expected_humidity, expected_wind = expected
+    assert step == expected_step
+    assert np.array_equal(grid, expected_grid)
+    # Humidity is stored with 8 bits, the wind as float32
+    assert np.array_equal(humidity, dequantize_humidity(quantize_humidity(expected_humidity)))
+    assert wind == tuple(np.float32(expected_wind).tolist())
+
+
+def test_replay_matches_live_run(recorded):
+    path, live = recorded
+    recording = Recording(path)
+    assert len(recording) == len(live)
+    assert list(recording.steps) == [step for step, *_ in live]
+
+    # Forward through keyframes and deltas, then backward and across
+    # chunks, which replays from the chunk's keyframe
+    order = list(range(len(live))) + [10, 9, 4, 3, 0, 13, 1, 8, 7, 12]
+    for index in order:
+        assert_frame(recording.frame(index), live[index])
+    recording.close()
+
+
+def test_replay_player_frames(recorded):
+    path, live = recorded
+    player = ReplayPlayer(Recording(path))
+    for index in [0, 5, 4, 11, 3]:
+        player.send(SEEK, index)
+        frame = player.take_frame()
+        assert_frame((frame.step, frame.grid, frame.humidity, tuple(frame.wind)), live[index])
+    player.close()
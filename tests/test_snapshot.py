@@ -0,0 +1,39 @@
+import os
+import shutil
+
+import numpy as np
+
+from benchmarks.common import create_forest
+from src.simulation.forest import Forest
+from src.simulation.snapshot import Checkpointer, latest_checkpoint
+
+
+def test_stray_old_checkpoint_is_ignored(tmp_path):
+    # write_snapshot interrupted between its two renames leaves the previous
+    # checkpoint as step_XXXXXXXXXX.<pid>.old, which sorts after the real
+    # one. Resuming and retention only look at finished checkpoints.
+    directory = str(tmp_path)
+    checkpointer = Checkpointer(directory, 5)
+    forest = create_forest(backend="cpu", size=32, seed=3, resident=True)
+
+    def run_to(step):
+        while forest.step < step:
+            forest.next_gen(forest.step)
+        checkpointer.write(forest.snapshot())
+
+    run_to(5)
+    run_to(10)
+    stray = os.path.join(directory, "step_0000000010.4242.old")
+    shutil.copytree(os.path.join(directory, "step_0000000010"), stray)
+    assert latest_checkpoint(directory) == os.path.join(directory, "step_0000000010")
+
+    run_to(15)
+    assert sorted(os.listdir(directory)) == ["step_0000000010", "step_0000000010.4242.old", "step_0000000015"]
+
+    resumed = Forest.load_snapshot(latest_checkpoint(directory))
+    assert resumed.step == 15
+    assert np.array_equal(resumed.grid, forest.grid)
+    assert np.array_equal(resumed.humidity, forest.humidity)
+    resumed.close()
+    forest.close()
+    checkpointer.close()
@@ -0,0 +1,43 @@
+import numpy as np
+
+from benchmarks.common import create_forest
+from src.simulation.forest import Forest
+from src.simulation.types import Type
+
+
+def test_sparse_matches_dense():
+    # Without lightning the active tiles draw exactly what a dense step
+    # draws, the binomial strikes of quiescent tiles are the only difference
+    start = create_forest(backend="cpu", size=96, seed=99, resident=True, lightning_prob=0.0)
+    snapshot = start.snapshot()
+    start.close()
+
+    # A few fires, so spreading, burning out and regrowth all happen while
+    # most tiles stay quiescent
+    grid = snapshot.grid.copy()
+    trees = np.argwhere(grid == Type.TREE)
+    for y, x in trees[np.random.default_rng(5).choice(len(trees), size=4, replace=False)]:
+        grid[y, x] = Type.BURNING
+    snapshot = snapshot._replace(grid=grid)
+
+    sparse = Forest(**dict(snapshot.params, sparse=True), snapshot=snapshot)
+    dense = Forest(**dict(snapshot.params, sparse=False), snapshot=snapshot)
+
+    burning = 0
+    for frame in range(60):
+        sparse.next_gen(frame)
+        dense.next_gen(frame)
+        sparse.sync_to_host()
+        dense.sync_to_host()
+
+        assert np.array_equal(sparse.grid, dense.grid), frame
+        assert np.array_equal(sparse.humidity, dense.humidity), frame
+        assert np.array_equal(sparse.compute_engine.download_delta(), dense.compute_engine.download_delta()), frame
+        assert np.array_equal(sparse.stats.counts, dense.stats.counts), frame
+        assert np.array_equal(sparse.stats.transitions, dense.stats.transitions), frame
+        assert sparse.stats.fire_box == dense.stats.fire_box, frame
+        burning += dense.stats.counts[Type.BURNING]
+
+    assert burning > 0
+    sparse.close()
+    dense.close()